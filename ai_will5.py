@@ -1,88 +1,134 @@
-from streamlit_lottie import st_lottie #動畫
-import requests
-import base64 #匯入圖片、音檔
+from lottie_cache import get_animation
+import hashlib
+import uuid
+import groq_client
+import hedging
+import interview_engine
+import metrics
+import prompt_budget
+import session_spill
+import structured_output
+import session_memory
+import transcript
+import warmup
+import will_export
+from response_cache import cache as response_cache
+from semantic_cache import semantic_cache
+from functools import partial
+import background_jobs
+import will_drafts
+import speech_to_text
+from static_assets import AUDIO_AFTER_PAINT_HTML, audio_sources_html, background_css #圖片、音檔改由靜態資源伺服器提供
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
    
+metrics.rerun_started("ai_will5.py") # 每次 rerun 的執行時間（見 metrics.py）
+session_spill.resume() # 閒置後被移到磁碟的狀態先取回（見 session_spill.py）
+
 # 取得 GROQ API 金鑰（從 Streamlit Secrets 介面匯入）
 GROQ_API_KEY = st.secrets["GROQ_API_KEY"]
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
-
-# 初始問題
-initial_questions = [
-    "你希望這份遺囑是寫給誰的？",
-    "你有什麼話想對這個人說？",
-    "有沒有什麼未完成的心願或故事，想交代的？",
-    "是否有任何財產、物品、或資料需要安排？",
-    "你想以什麼語氣或風格呈現這份遺囑？（例如莊嚴、溫柔、幽默）"
-]
 
 # --- 頁面設定 ---
 st.set_page_config(page_title="AI 遺囑生成器", page_icon="🕊", layout="wide")
 
-#動畫元素
-def load_lottieurl(url: str):
-    r = requests.get(url)
-    print("Status code:", r.status_code)
-    if r.status_code != 200:
-        return None
-    return r.json()
-
+#動畫元素：從行程內快取／專案內附檔讀取，不在 rerun 時連網（見 lottie_cache.py）
 # ✅ 使用完整的 JSON 連結
 lottie_url = "https://lottie.host/8e67f872-e483-4e8c-9b28-6ca11329eb42/rgznX6aYYt.json"
-lottie_animation = load_lottieurl(lottie_url)
+lottie_animation = get_animation(lottie_url)
 
 
 
 # --- 初始化 session_state ---
-if "step" not in st.session_state:
-    st.session_state.step = 0
-    st.session_state.questions = initial_questions.copy()
-    st.session_state.initial_questions = initial_questions.copy()
-    st.session_state.answers = []  # 儲存所有回答
-    st.session_state.chat = []     # 儲存對話紀錄
-    st.session_state.done = False  # 標誌是否完成所有問題
-    st.session_state.generated = ""# 最終生成的遺囑草稿
-    st.session_state.followup_questions_generated = False # 確保只生成一次延伸問題
-    st.session_state.current_user_input = "" # 用於暫存用戶輸入，避免渲染問題
-
-# Groq API 呼叫函數
-def call_groq(prompt):
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": "llama3-70b-8192",
-        "messages": [
-            {"role": "system", "content": "你是一位溫柔且善於理解人心的助手，幫助使用者書寫遺囑，請用台灣繁體中文回答。"},
-            {"role": "user", "content": prompt}
-        ],
-        "temperature": 0.7
-    }
+if "interview" not in st.session_state:
+    st.session_state.interview = interview_engine.Interview() # 問題、回答、對話紀錄與草稿（流程見 interview_engine.py）
+    st.session_state.followup_future = None # 背景預先產生延伸問題的 Future
+    st.session_state.section_futures = {}   # 各段落草稿（段落 key -> 背景撰寫的 Future）
+    st.session_state.session_id = uuid.uuid4().hex # 標記這個 session 寫入的回應快取，方便整批清除
+
+
+def current_interview():
+    # fragment 單獨重跑時不會經過腳本開頭，這裡也要先取回閒置時移到磁碟的狀態；
+    # 每次從 session_state 取，不留在模組層級的變數裡（fragment 會保留腳本的全域變數，閒置時就無法釋放）
+    session_spill.resume()
+    return st.session_state.interview
+
+# Groq API 呼叫函數（經過全域限流器排隊，人多時顯示目前順位；超過該階段的延遲預算時改走對沖請求，見 hedging.py）
+def call_groq(prompt, stage="final", schema=None):
+    queue_notice = st.empty()
+    def show_queue_position(position):
+        queue_notice.info(f"⏳ 目前使用人數較多，您排在第 {position} 位，請稍候…")
+    try:
+        if schema is not None: # 延伸問題：以 JSON 模式取得並依 schema 驗證（見 structured_output.py）
+            return structured_output.chat_json(prompt, schema, api_key=GROQ_API_KEY, stage=stage, local=(stage == "followup"), temperature=0.7, on_wait=show_queue_position, session=st.session_state.session_id)
+        return hedging.chat(prompt, api_key=GROQ_API_KEY, stage=stage, local=(stage == "followup"), temperature=0.7, on_wait=show_queue_position, session=st.session_state.session_id)
+    except groq_client.GroqError as e:
+        st.error(f"呼叫 Groq API 時發生錯誤: {e}")
+        return None if schema is not None else groq_client.API_ERROR_MESSAGE # 錯誤訊息不會被當成延伸問題
+    finally:
+        queue_notice.empty()
+
+# --- 延伸問題提示詞 ---
+# 前四題（對象、想說的話、心願、財產）已包含大部分內容，回答完第 4 題就在背景先產生延伸問題；
+# 第 5 題（語氣）通常不影響要補問什麼，直接沿用，只有語氣回答本身內容較多時才以完整回答重新產生。
+SPECULATE_AFTER = 4
+TONE_REFINE_MIN_CHARS = 30
+
+def generate_followups(answers, ask):
+    # ask(prompt) 以 JSON 模式回傳 {"questions": [...]}（失敗時為 None）
+    # 先查語意快取：回答和過去的使用者夠相近時直接沿用當時的延伸問題，不呼叫模型
+    summary = interview_engine.followup_summary(answers)
+    cached = semantic_cache.lookup(summary)
+    if cached:
+        return cached
+    new_questions = interview_engine.followup_questions(ask(interview_engine.detailed_followup_prompt(answers)))
+    semantic_cache.store(summary, new_questions, answers[:len(interview_engine.INITIAL_QUESTIONS)])
+    return new_questions
+
+def start_followup_in_background(answers):
+    # 背景執行緒不能呼叫 st.*，所以直接用 structured_output.chat_json（經過 hedging.chat），錯誤留在 Future 裡
+    ask = partial(structured_output.chat_json, schema=interview_engine.FOLLOWUP_SCHEMA, api_key=GROQ_API_KEY, stage="followup",
+                  local=True, temperature=0.7, session=st.session_state.session_id)
+    st.session_state.followup_future = background_jobs.submit(generate_followups, answers, ask)
+
+def needs_refined_followup(tone_answer):
+    future = st.session_state.get("followup_future")
+    if future is None:
+        return True
+    if future.done() and future.exception() is not None:
+        return True
+    return len(tone_answer.strip()) >= TONE_REFINE_MIN_CHARS
+
+# 串流版本：以 OpenAI 相容的 SSE（stream: true）逐字回傳，搭配 st.write_stream 邊生成邊顯示
+# 最近一次呼叫的首字延遲（TTFT）、每秒 token 數與採用的路徑（primary / hedge）記錄在 st.session_state.llm_timing
+def call_groq_stream(prompt):
+    timing = {}
+    queue_notice = st.empty()
+    def show_queue_position(position):
+        queue_notice.info(f"⏳ 目前使用人數較多，您排在第 {position} 位，請稍候…")
     try:
-        res = requests.post(GROQ_API_URL, headers=headers, json=payload, timeout=60)
-        res.raise_for_status()
-        return res.json()["choices"][0]["message"]["content"]
-    except requests.exceptions.RequestException as e:
+        for delta in hedging.chat_stream(prompt, api_key=GROQ_API_KEY, stage="final_stream", temperature=0.7, timing=timing, on_wait=show_queue_position, session=st.session_state.session_id):
+            queue_notice.empty()
+            yield delta
+    except groq_client.GroqError as e:
         st.error(f"呼叫 Groq API 時發生錯誤: {e}")
-        return "很抱歉，API 呼叫失敗，請稍後再試。"
-      
+        timing["error"] = type(e).__name__ # 錯誤訊息不會被當成草稿內容；呼叫端依此判斷失敗
+    finally:
+        queue_notice.empty()
+        st.session_state.llm_timing = timing # 只保留最近一次，session 不隨呼叫次數變大；延遲與 token 數另外記錄在效能指標（見 metrics.py）
 
 
-# --- 功能函式：轉檔成 base64 ---
-def to_base64(file_path):
-    with open(file_path, "rb") as f:
-        return base64.b64encode(f.read()).decode()
 
 # --- 加入背景圖片與音樂 ---
-image_base64 = to_base64("assets/background.jpg")      
-audio_base64 = to_base64("assets/echoofsadness.mp3")    
-
-st.markdown(
-    f"""
+# 依 static/build/manifest.json 挑選最小的可用版本（沒有建置過則使用原始檔）
+# 整段 CSS 與播放器 HTML 每個行程只組一次；提問與草稿區改成 fragment 後，只有少數完整 rerun 才會再送出
+@st.cache_resource
+def page_shell_html():
+    background_rules = background_css()
+    audio_sources = audio_sources_html()
+    return f"""
     <style>
+    {background_rules}
     .stApp {{
-        background-image: url("data:image/jpg;base64,{image_base64}");
         background-size: cover;
         background-attachment: fixed;
     }}
@@ -139,13 +185,15 @@ st.markdown(
     </style>
    
     <div class="audio-player">
-        <audio autoplay loop controls>
-            <source src="data:audio/mp3;base64,{audio_base64}" type="audio/mp3">
+        <audio loop controls preload="none">
+            {audio_sources}
         </audio>
     </div>
-    """,
-    unsafe_allow_html=True
-)
+    """
+
+st.markdown(page_shell_html(), unsafe_allow_html=True)
+# 首次繪製完成後才開始播放音樂
+st.iframe(AUDIO_AFTER_PAINT_HTML, height=1)
 
 
    
@@ -153,6 +201,7 @@ st.markdown(
 
 # 顯示動畫
 if lottie_animation:
+    from streamlit_lottie import st_lottie # 動畫元件只在真的要顯示時才 import，不拖慢冷啟動
     st_lottie(
         lottie_animation,
         speed=1,
@@ -162,8 +211,7 @@ if lottie_animation:
         height=300,
         key="ending_animation"
     )
-else:
-    st.error("動畫載入失敗，請確認 URL 是否正確。")
+# 沒有動畫時（內附檔不存在且背景下載尚未完成）直接略過，不擋住頁面
 
 
 
@@ -245,117 +293,182 @@ with col2:
 
 
 
-# 顯示對話紀錄
-for entry in st.session_state.chat:
-    if entry["role"] == "user":
-        st.markdown(f"🧑‍💬 **你：** {entry['content']}")
-    else:
-        st.markdown(f"🤖 **AI：** {entry['content']}")
+# --- 提問區與草稿區：各自是獨立 rerun 的 fragment ---
+def rerun_fragment():
+    # 只有在 fragment 自己的 rerun 中才能只重跑 fragment；整頁執行時（例如第一次載入）改為整頁 rerun
+    ctx = get_script_run_ctx()
+    st.rerun(scope="fragment" if ctx and ctx.fragment_ids_this_run else "app")
 
 
-# --- 提問流程 ---
-if not st.session_state.done:
-    if st.session_state.step < len(st.session_state.questions):
-        current_q = st.session_state.questions[st.session_state.step]
-        with col1:
-            #st.markdown(f"**問題 {st.session_state.step + 1}：** {current_q}")
+# 送出回答、產生延伸問題、清除暫存等操作只會重新執行所在的 fragment，
+# 上面的 CSS、音樂播放器、動畫與常見問題只在完整 rerun 時送出（開頁、問答全部完成時各一次）。
+@st.fragment
+@metrics.timer("streamlit_fragment_seconds", fragment="interview_form")
+def interview_form():
+    interview = current_interview()
+    # --- 提問流程 ---
+    if not interview.done:
+        if interview.state == interview_engine.ASKING:
+            current_q = interview.current_question()
+            #st.markdown(f"**問題 {interview.step + 1}：** {current_q}")
             st.markdown(f"""
             <div style='font-size:24px; font-weight:bold; margin-bottom:8px; color:#333;'>
-            問題 {st.session_state.step + 1}：{current_q}
+            問題 {interview.step + 1}：{current_q}
             </div>
             """, unsafe_allow_html=True)
 
 
 
            
-            # 使用一個佔位符來處理輸入框和按鈕
-            # 將輸入框的 current_user_input 從 session_state 中取值
-            # 這樣在重新運行時，text_area 的值會保持，直到明確提交。
-            user_input_val = st.session_state.current_user_input
-            
+            # 🎤 語音輸入：錄音後在本機轉成文字，填進下方的回答欄（可再修改後送出）
+            voice_clip = st.audio_input("🎤 也可以直接用說的回答", key=f"voice_{interview.step}")
+            if voice_clip is not None:
+                clip_bytes = voice_clip.getvalue()
+                clip_id = hashlib.sha256(clip_bytes).hexdigest()
+                if st.session_state.get("last_voice_clip") != clip_id: # 同一段錄音只轉一次
+                    st.session_state.last_voice_clip = clip_id
+                    try:
+                        with st.spinner("正在將語音轉成文字…"):
+                            text, report = speech_to_text.transcribe(clip_bytes)
+                        st.session_state.stt_report = report # 只保留最近一次
+                        if text:
+                            input_key = f"input_{interview.step}"
+                            st.session_state[input_key] = f"{st.session_state.get(input_key, '').rstrip()}\n{text}".strip()
+                    except Exception as e:
+                        st.warning(f"語音轉文字失敗，請改用文字輸入。（{e}）")
+                if st.session_state.get("stt_report"):
+                    report = st.session_state.stt_report
+                    st.caption(
+                        f"錄音 {report['audio_seconds']:.1f} 秒，已略過 {report['dropped_seconds']:.1f} 秒靜音"
+                        f"（{report['segments']} 段語音）"
+                    )
+
+            # 輸入中的回答只存在 widget 的 key（input_{step}）裡，不另外複製一份暫存值；
+            # 在重新運行時 text_area 的值會保持，直到明確提交，語音轉出的文字也直接寫進同一個 key。
             user_input = st.text_area(
                 "您的回答：",
-                key=f"input_{st.session_state.step}",
+                key=f"input_{interview.step}",
                 placeholder="請在這裡輸入你的回答⋯⋯",
-                height=100,
-                value=user_input_val # 使用 session_state 中的暫存值
+                height=100
             )
-            
-            # 當 text_area 的值發生變化時，更新 session_state 中的暫存值
-            if user_input != st.session_state.current_user_input:
-                st.session_state.current_user_input = user_input
-                # 注意：這裡不應該直接觸發 rerun，否則會陷入循環
-            
+        
             # 送出按鈕
-            if st.button("送出回答", key=f"submit_q_{st.session_state.step}"):
-                if st.session_state.current_user_input.strip() == "": # 檢查暫存值
+            if st.button("送出回答", key=f"submit_q_{interview.step}"):
+                if not session_memory.fits(st.session_state, user_input): # 每個 session 的記憶體上限（見 session_memory.py）
+                    st.warning("這個回答太長了，請精簡後再送出。")
+                elif not interview.submit(user_input): # 空白回答不接受
                     st.warning("請輸入您的回答。")
                 else:
-                    # 提交回答前，將暫存值添加到 chat 和 answers
-                    st.session_state.chat.append({"role": "user", "content": st.session_state.current_user_input})
-                    st.session_state.answers.append(st.session_state.current_user_input)
-                    
-                    # 清空暫存值，為下一個問題做準備
-                    st.session_state.current_user_input = "" 
-                    
-                    st.session_state.step += 1
-                    st.rerun() # 提交回答後強制重新運行，顯示下一個問題或進入下一階段
-                
+                    # 分段撰寫：在背景先把這一題的回答寫成遺囑中的一個段落
+                    section = will_drafts.section_key(interview.step - 1)
+                    st.session_state.section_futures[section] = background_jobs.submit(
+                        will_drafts.draft_section, section, current_q, user_input, GROQ_API_KEY,
+                        st.session_state.session_id
+                    )
+                    del st.session_state[f"input_{interview.step - 1}"] # 回答已存進 interview，輸入框的值不再需要
+
+                    # 預先產生延伸問題：使用者作答最後一題的同時，背景已經在產生延伸問題
+                    answered = len(interview.answers)
+                    if answered == SPECULATE_AFTER:
+                        start_followup_in_background(list(interview.answers))
+                    elif answered == len(interview.initial_questions) and needs_refined_followup(interview.answers[-1]):
+                        start_followup_in_background(list(interview.answers))
+
+                    if interview.done: # 最後一題答完：完整 rerun 一次，讓草稿區開始生成
+                        st.rerun()
+                    rerun_fragment() # 只重新執行提問區，顯示下一個問題或延伸問題階段
+            
             #current_step = len(session_state.step)
             #total_steps = 5
              #   st.progress(current_step / total_steps, text=f"步驟 {current_step} / {total_steps}")
-    # --- 延伸問題生成邏輯 ---
-# 階段 2: 生成延伸問題的提示階段（僅在生成時顯示資訊，不需回答）
-    # 只有當所有初始問題都回答完，且延伸問題尚未生成時進入此階段
-    elif st.session_state.step == len(st.session_state.initial_questions) and not st.session_state.followup_questions_generated:
-        st.info("已回答完主要問題，正在思考為您補充更多細節…")
-        
-        # 整合所有初始問題的回答作為 AI 生成延伸問題的上下文
-        summary = "\n".join([f"{i+1}. {q}：{a}" for i, (q, a) in enumerate(zip(st.session_state.initial_questions, st.session_state.answers[:len(st.session_state.initial_questions)]))])
+        # --- 延伸問題生成邏輯 ---
+    # 階段 2: 生成延伸問題的提示階段（僅在生成時顯示資訊，不需回答）
+        # 只有當所有初始問題都回答完，且延伸問題尚未生成時進入此階段
+        elif interview.state == interview_engine.FOLLOWUP:
+            st.info("已回答完主要問題，正在思考為您補充更多細節…")
         
-        cot_prompt = f"請根據以下使用者提供的資訊，提出 **1 到 2 個** 可以幫助其更完善遺囑的**延伸問題**。請確保每個問題都以獨立的一行顯示，並使用清晰的繁體中文提問。例如：\n1. 請問您是否有特別想要指定受益人的比例？\n2. 您希望如何安排您的數位遺產？\n\n使用者提供的資訊：\n{summary}"
-        
-        with st.spinner("正在生成延伸問題…"):
-            follow = call_groq(cot_prompt)
-            
-        new_questions = [q.strip() for q in follow.split("\n") if q.strip()]
-        new_questions = [q for q in new_questions if q.startswith(('1.', '2.', '3.'))] # 篩選確保是問題格式
-        new_questions = new_questions[:2] # 確保只取前兩個問題
+            with st.spinner("正在生成延伸問題…"):
+                # 多數情況背景預先產生的結果已經好了，直接取用；背景失敗時才在這裡以完整回答重新呼叫
+                new_questions = background_jobs.result_or_none(st.session_state.get("followup_future"))
+                st.session_state.followup_future = None
+                if new_questions is None:
+                    # 整合所有初始問題的回答作為 AI 生成延伸問題的上下文
+                    new_questions = generate_followups(interview.answers, partial(call_groq, stage="followup", schema=interview_engine.FOLLOWUP_SCHEMA))
 
-        if new_questions:
             # 將新問題添加到總問題列表中，這樣後續的 step 就能處理它們
-            st.session_state.questions.extend(new_questions)
-            st.session_state.chat.append({"role": "assistant", "content": "好的，我們還有幾個問題想請教您，這能幫助我們完善遺囑…"})
-            st.session_state.followup_questions_generated = True # 標記延伸問題已生成
-            st.rerun() # 強制重新運行，讓 Streamlit 在下一個 step 顯示第一個延伸問題
-
-        else: # 如果沒有生成延伸問題，直接進入完成階段
-            st.session_state.done = True
-            st.rerun()
-
-    # 階段 3: 所有問題問完，進入最終生成階段
-    elif st.session_state.step == len(st.session_state.questions) and not st.session_state.done:
-        st.session_state.done = True
-        st.rerun()
-
-# --- 最終階段：產出遺囑 ---
-if st.session_state.done and not st.session_state.generated:
-    st.info("已收集所有必要資訊，正在為您撰寫遺囑草稿…")
-    final_prompt_parts = []
-    for i in range(len(st.session_state.questions)):
-        q = st.session_state.questions[i]
-        a = st.session_state.answers[i] if i < len(st.session_state.answers) else "未回答"
-        final_prompt_parts.append(f"問題: {q}\n回答: {a}")
-    
-    full_prompt = f"請根據以下資訊，幫我生成一份溫柔但格式清晰的中文遺囑草稿。請確保草稿包含所有提及的關鍵資訊。最後請加上今日日期結尾。\n\n{''.join(final_prompt_parts)}"
-
-    with st.spinner("正在生成遺囑草稿…"):
-        result = call_groq(full_prompt)
-        st.session_state.generated = result
-        st.session_state.chat.append({"role": "assistant", "content": result})
-        st.rerun() # 生成遺囑後強制重新運行，以顯示最終結果
-
-# --- 顯示最終遺囑草稿 ---
-if st.session_state.generated:
-    st.markdown("### 📝 你的遺囑草稿如下：")
-    st.success(st.session_state.generated)
+            interview.add_followups(new_questions)
+            if new_questions:
+                rerun_fragment() # 只重新執行提問區，顯示第一個延伸問題
+            else: # 如果沒有生成延伸問題，直接進入完成階段（完整 rerun 一次，讓草稿區開始生成）
+                st.rerun()
+
+    # 顯示對話紀錄
+    transcript.render(interview.chat) # 已顯示過的訊息留在瀏覽器，每次 rerun 只送出新訊息（見 transcript.py）
+
+
+@st.fragment
+@metrics.timer("streamlit_fragment_seconds", fragment="draft_area")
+def draft_area():
+    interview = current_interview()
+    # 上一次串流失敗或沒有產生任何內容：等使用者按下重試，不自動重跑（避免無限重新生成）
+    if interview.state == interview_engine.DRAFTING and st.session_state.get("draft_failed"):
+        st.error("遺囑草稿沒有產生成功，請稍後再試一次。")
+        if st.button("🔄 重新產生草稿", key="retry_draft"):
+            st.session_state.draft_failed = False
+
+    # --- 最終階段：產出遺囑 ---
+    if interview.state == interview_engine.DRAFTING and not st.session_state.get("draft_failed"):
+        st.info("已收集所有必要資訊，正在為您撰寫遺囑草稿…")
+        # 各段落大多已在背景寫好，這裡只等還沒完成的段落，再交給模型合併潤飾
+        sections = []
+        with st.spinner("正在整理各段落…"):
+            for i, a in enumerate(interview.final_answers()):
+                section = will_drafts.section_key(i)
+                text = background_jobs.result_or_none(st.session_state.section_futures.get(section))
+                if text is None: # 背景撰寫失敗時改用原始回答
+                    text = a
+                sections.append((section, text))
+
+            # 過長的段落先濃縮，保證合併用的 prompt 不超過 token 預算（見 prompt_budget.py）
+            section_keys = [key for key, _ in sections]
+            full_prompt, budget_report = prompt_budget.fit(
+                [text for _, text in sections],
+                lambda texts: will_drafts.merge_prompt(list(zip(section_keys, texts))),
+                api_key=GROQ_API_KEY, session=st.session_state.session_id,
+            )
+            st.session_state.prompt_budget_report = budget_report
+
+        # 逐字顯示草稿，串流結束後完整內容寫入 session_state
+        st.markdown("### 📝 你的遺囑草稿如下：")
+        with st.spinner("正在生成遺囑草稿…"):
+            result = st.write_stream(call_groq_stream(full_prompt))
+        draft = result if isinstance(result, str) else "".join(map(str, result)) # 沒有任何內容時為 "" 或 []
+        if st.session_state.llm_timing.get("error") or not draft.strip():
+            st.session_state.draft_failed = True
+            rerun_fragment() # 只重新執行草稿區，顯示重試按鈕
+        interview.finish(draft)
+        st.session_state.section_futures = {} # 段落已合併進草稿，不再保留
+        st.rerun() # 完整 rerun 一次：提問區的對話紀錄也要加上草稿
+
+    # --- 顯示最終遺囑草稿 ---
+    if interview.generated:
+        st.markdown("### 📝 你的遺囑草稿如下：")
+        st.success(interview.generated)
+        will_export.download_buttons(interview.generated) # PDF / Word 下載檔在背景產生（見 will_export.py）
+
+        # 回應快取中屬於這次對話的內容（記憶體與加密的磁碟快取）可以立即清除
+        if st.button("🗑 清除本次對話的暫存資料", key="purge_cache"):
+            removed = response_cache.purge_session(st.session_state.session_id)
+            will_export.forget(interview.generated) # 已產生的下載檔也一併刪除
+            st.toast(f"已清除 {removed} 筆暫存資料", icon="🗑")
+
+
+with col1:
+    interview_form()
+draft_area()
+
+# --- 首次繪製完成後，在背景預熱連線與模型（每個行程一次，見 warmup.py） ---
+warmup.after_first_paint(api_key=GROQ_API_KEY, speech=True, semantic=True, assets=True)
+session_memory.report(st.session_state, "ai_will5.py")
+session_spill.release() # 閒置而被標記的 session 在畫面畫完後移到磁碟（見 session_spill.py）
+metrics.rerun_finished()
@@ -1,107 +1,85 @@
 import streamlit as st
-import requests
+from functools import partial
+import groq_client
+import hedging
+import interview_engine
+import metrics
+import prompt_budget
+import session_spill
+import structured_output
+import transcript
+import warmup
+import will_export
+
+metrics.rerun_started("app.py") # 每次 rerun 的執行時間（見 metrics.py）
+session_spill.resume() # 閒置後被移到磁碟的狀態先取回（見 session_spill.py）
 
 # 取得 GROQ API 金鑰（從 Streamlit Secrets 介面匯入）
 GROQ_API_KEY = st.secrets["GROQ_API_KEY"]
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
-
-# 初始問題
-initial_questions = [
-    "你希望這份遺囑是寫給誰的？",
-    "你有什麼話想對這個人說？",
-    "有沒有什麼未完成的心願或故事，想交代的？",
-    "是否有任何財產、物品、或資料需要安排？",
-    "你想以什麼語氣或風格呈現這份遺囑？（例如莊嚴、溫柔、幽默）"
-]
 
 # 初始化 session_state
-if "step" not in st.session_state:
-    st.session_state.step = 0
-    st.session_state.questions = initial_questions.copy()
-    st.session_state.answers = []
-    st.session_state.chat = []
-    st.session_state.done = False
-    st.session_state.generated = ""
+if "interview" not in st.session_state:
+    # 問題、回答、對話紀錄與草稿（流程見 interview_engine.py）；延伸問題每一行都當成一題，並逐題列進對話紀錄
+    st.session_state.interview = interview_engine.Interview(interview_engine.BRIEF_FLOW)
     st.session_state.trigger_next = False
-    st.session_state.followup_added = False  # 避免重複加問題
     
 if "trigger_next" not in st.session_state:
     st.session_state.trigger_next = False
+interview = st.session_state.interview
 
 
-# Groq API 呼叫函數
-def call_groq(prompt):
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": "llama3-70b-8192",
-        "messages": [
-            {"role": "system", "content": "你是一位溫柔且善於理解人心的助手，幫助使用者書寫遺囑，請用台灣繁體中文回答。"},
-            {"role": "user", "content": prompt}
-        ]
-    }
-    res = requests.post(GROQ_API_URL, headers=headers, json=payload)
-    return res.json()["choices"][0]["message"]["content"]
+# Groq API 呼叫函數（經過全域限流器排隊，人多時顯示目前順位；超過該階段的延遲預算時改走對沖請求，見 hedging.py）
+def call_groq(prompt, stage="final", schema=None):
+    queue_notice = st.empty()
+    def show_queue_position(position):
+        queue_notice.info(f"⏳ 目前使用人數較多，您排在第 {position} 位，請稍候…")
+    try:
+        if schema is not None: # 延伸問題：以 JSON 模式取得並依 schema 驗證（見 structured_output.py）
+            return structured_output.chat_json(prompt, schema, api_key=GROQ_API_KEY, stage=stage, local=(stage == "followup"), on_wait=show_queue_position)
+        return hedging.chat(prompt, api_key=GROQ_API_KEY, stage=stage, local=(stage == "followup"), on_wait=show_queue_position)
+    except groq_client.GroqError as e:
+        st.error(f"呼叫 Groq API 時發生錯誤: {e}")
+        return None if schema is not None else groq_client.API_ERROR_MESSAGE # 錯誤訊息不會被當成延伸問題
+    finally:
+        queue_notice.empty()
 
 # UI 設定
 st.title("🕊 AI您好，我的遺囑如下…")
 st.markdown("這是一個由 AI 協助撰寫遺囑的互動工具，請放心作答，最後會生成一份完整草稿。")
 
 # 顯示對話紀錄
-for entry in st.session_state.chat:
-    if entry["role"] == "user":
-        st.markdown(f"🧑‍💬 **你：** {entry['content']}")
-    else:
-        st.markdown(f"🤖 **AI：** {entry['content']}")
+transcript.render(interview.chat) # 已顯示過的訊息留在瀏覽器，每次 rerun 只送出新訊息（見 transcript.py）
 
 # 提問流程
-if not st.session_state.done:
-    if st.session_state.step < len(st.session_state.questions):
-        current_q = st.session_state.questions[st.session_state.step]
-        st.markdown(f"**問題 {st.session_state.step + 1}：** {current_q}")
-        user_input = st.text_input("你的回答：", key=f"input_{st.session_state.step}")
-        
-        if st.button("送出回答", key=f"submit_{st.session_state.step}"):
-            st.session_state.chat.append({"role": "user", "content": user_input})
-            st.session_state.answers.append(user_input)
-            st.session_state.step += 1
+if interview.state == interview_engine.ASKING:
+    current_q = interview.current_question()
+    st.markdown(f"**問題 {interview.step + 1}：** {current_q}")
+    user_input = st.text_input("你的回答：", key=f"input_{interview.step}")
+    
+    if st.button("送出回答", key=f"submit_{interview.step}"):
+        if interview.submit(user_input):
             st.session_state.trigger_next = True
+        else:
+            st.warning("請輸入您的回答。")
 
-    # ✅ 當回答完初始問題，觸發延伸提問
-    elif not st.session_state.followup_added:
-        summary = "\n".join([f"{i+1}. {q}：{a}" for i, (q, a) in enumerate(zip(initial_questions, st.session_state.answers))])
-        cot_prompt = f"請根據以下回答，提出 1~2 個可以補充的延伸問題：\n{summary}"
-        follow = call_groq(cot_prompt)
-        new_questions = [q.strip("•-： ") for q in follow.split("\n") if q.strip()]
-        
-        # ✅ 加入延伸問題
-        st.session_state.questions.extend(new_questions)
-        st.session_state.chat.append({"role": "assistant", "content": "讓我們深入一點…"})  # 簡單提示
-        for nq in new_questions:
-            st.session_state.chat.append({"role": "assistant", "content": nq})
-        st.session_state.followup_added = True
-        st.session_state.trigger_next = True
-
-    # ✅ 所有問題都問完，才進入生成階段
-    elif st.session_state.step == len(st.session_state.questions):
-        st.session_state.done = True
-        st.session_state.trigger_next = True
-
-# ✅ 最終階段：產出遺囑
-if st.session_state.done and not st.session_state.generated:
-    final_prompt = "\n".join([f"{i+1}. {q}：{a}" for i, (q, a) in enumerate(zip(st.session_state.questions, st.session_state.answers))])
-    full_prompt = f"請根據以下資訊，幫我生成一份溫柔但格式清晰的中文遺囑草稿：\n{final_prompt}\n請加上今日日期結尾。"
+# ✅ 當回答完初始問題，觸發延伸提問（加入延伸問題；沒有延伸問題時直接進入生成階段）
+elif interview.state == interview_engine.FOLLOWUP:
+    interview.ask_followups(call_groq)
+    st.session_state.trigger_next = True
 
+# ✅ 最終階段：產出遺囑（過長的回答先濃縮，保證最終 prompt 不超過 token 預算，見 prompt_budget.py）
+elif interview.state == interview_engine.DRAFTING:
     with st.spinner("正在生成遺囑草稿…"):
-        result = call_groq(full_prompt)
-        st.session_state.generated = result
-        st.session_state.chat.append({"role": "assistant", "content": result})
+        interview.write_draft(call_groq, fit=partial(prompt_budget.fit, api_key=GROQ_API_KEY))
         st.session_state.trigger_next = True
 
 # 🧾 顯示最終遺囑草稿
-if st.session_state.generated:
+if interview.generated:
     st.markdown("### 📝 你的遺囑草稿如下：")
-    st.success(st.session_state.generated)
+    st.success(interview.generated)
+    will_export.download_buttons(interview.generated) # PDF / Word 下載檔在背景產生（見 will_export.py）
 
+# --- 首次繪製完成後，在背景預熱連線與模型（每個行程一次，見 warmup.py） ---
+warmup.after_first_paint(api_key=GROQ_API_KEY)
+session_spill.release() # 閒置而被標記的 session 在畫面畫完後移到磁碟（見 session_spill.py）
+metrics.rerun_finished()
@@ -0,0 +1,112 @@
+# --- 錄音前處理 ---
+# 使用者回答情緒性的問題時常停頓很久，直接把整段錄音丟給語音模型，大部分算力都花在靜音上。
+# 這裡在辨識前先：
+#   1. 直接從記憶體中的 bytes 解碼（torchaudio，不寫暫存檔）
+#   2. 混成單聲道、重新取樣到 16 kHz
+#   3. 以能量式語音活動偵測（VAD）切掉頭尾與中間過長的靜音，只把有聲音的片段交給模型
+# 回傳的報告會列出原始長度、保留的語音長度與丟掉的秒數。
+#
+# 環境變數：
+#   STT_VAD               1（預設）啟用靜音切除，0 時整段送進模型
+#   STT_VAD_MIN_SILENCE   超過幾秒的停頓才切掉，預設 0.5
+#   STT_VAD_PADDING       每段語音前後保留的秒數，預設 0.2
+import io
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_RATE = 16000
+VAD_ENABLED = os.environ.get("STT_VAD", "1") == "1"
+MIN_SILENCE = float(os.environ.get("STT_VAD_MIN_SILENCE", "0.5"))
+PADDING = float(os.environ.get("STT_VAD_PADDING", "0.2"))
+
+FRAME_SECONDS = 0.03
+MIN_SPEECH = 0.25         # 短於此長度的聲音（咳嗽、按鍵聲）不算語音
+RELATIVE_DB = 35.0        # 比整段最大音量低這麼多 dB 的視為靜音
+ABSOLUTE_FLOOR_DB = -50.0  # 低於此音量（dBFS）一律視為靜音
+JOIN_GAP = 0.3            # 片段之間保留的短暫靜音，讓模型仍能斷句
+
+
+def decode(audio_bytes):
+    """解碼錄音 bytes，回傳 16 kHz 單聲道的 1 維 float32 tensor。"""
+    import torch
+    import torchaudio
+
+    try:
+        waveform, sr = torchaudio.load(io.BytesIO(audio_bytes))
+    except Exception as e:
+        # torchaudio 的後端不支援的格式，改用 ffmpeg 管線解碼（同樣不落地）
+        logger.info("torchaudio 無法解碼，改用 ffmpeg：%s", e)
+        from transformers.pipelines.audio_utils import ffmpeg_read
+
+        return torch.from_numpy(ffmpeg_read(audio_bytes, SAMPLING_RATE))
+    waveform = waveform.mean(dim=0)
+    if sr != SAMPLING_RATE:
+        waveform = torchaudio.functional.resample(waveform, sr, SAMPLING_RATE)
+    return waveform
+
+
+def speech_segments(waveform):
+    """回傳語音片段的 [(起點樣本, 終點樣本)]。"""
+    import torch
+
+    frame = int(FRAME_SECONDS * SAMPLING_RATE)
+    n_frames = len(waveform) // frame
+    if n_frames == 0:
+        return []
+    frames = waveform[: n_frames * frame].reshape(n_frames, frame)
+    db = 10 * torch.log10(frames.pow(2).mean(dim=1).clamp(min=1e-10))
+    threshold = max(float(db.max()) - RELATIVE_DB, ABSOLUTE_FLOOR_DB)
+    voiced = (db > threshold).tolist()
+
+    # 把有聲音的 frame 連成片段，間隔短於 MIN_SILENCE 的停頓視為同一段
+    max_gap = int(MIN_SILENCE / FRAME_SECONDS)
+    segments = []
+    start = last = None
+    for i, v in enumerate(voiced):
+        if not v:
+            continue
+        if start is None:
+            start = i
+        elif i - last > max_gap:
+            segments.append((start, last + 1))
+            start = i
+        last = i
+    if start is not None:
+        segments.append((start, last + 1))
+
+    min_frames = int(MIN_SPEECH / FRAME_SECONDS)
+    pad = int(PADDING * SAMPLING_RATE)
+    return [
+        (max(0, s * frame - pad), min(len(waveform), e * frame + pad))
+        for s, e in segments if e - s >= min_frames
+    ]
+
+
+def preprocess(audio_bytes):
+    """解碼並切除靜音，回傳 (numpy 陣列, 報告)；沒有偵測到語音時陣列長度為 0。"""
+    import torch
+
+    waveform = decode(audio_bytes)
+    total = len(waveform)
+    if VAD_ENABLED:
+        segments = speech_segments(waveform)
+        gap = torch.zeros(int(JOIN_GAP * SAMPLING_RATE), dtype=waveform.dtype)
+        pieces = []
+        for s, e in segments:
+            if pieces:
+                pieces.append(gap)
+            pieces.append(waveform[s:e])
+        speech = torch.cat(pieces) if pieces else waveform[:0]
+    else:
+        segments = [(0, total)] if total else []
+        speech = waveform
+    kept = sum(e - s for s, e in segments)
+    report = {
+        "audio_seconds": total / SAMPLING_RATE,
+        "speech_seconds": kept / SAMPLING_RATE,
+        "dropped_seconds": (total - kept) / SAMPLING_RATE,
+        "segments": len(segments),
+    }
+    return speech.numpy(), report
@@ -0,0 +1,30 @@
+# --- 背景工作 ---
+# 整個行程共用一個執行緒池，用來在使用者作答時先在背景呼叫 LLM（例如預先產生延伸問題）。
+# 背景執行緒沒有 Streamlit 的 ScriptRunContext，工作函式內不能呼叫任何 st.* 函式，
+# 結果以 concurrent.futures.Future 交回頁面，由頁面在下一次 rerun 時取用。
+#
+# 環境變數：
+#   BACKGROUND_WORKERS         執行緒數量，預設 16（實際送往 Groq 的並行數仍受 groq_limiter 限制）
+#   BACKGROUND_RESULT_TIMEOUT  頁面最多等背景結果幾秒，預設 30；超過就當作沒有結果，由頁面改走備援
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+BACKGROUND_WORKERS = int(os.environ.get("BACKGROUND_WORKERS", "16"))
+RESULT_TIMEOUT = float(os.environ.get("BACKGROUND_RESULT_TIMEOUT", "30"))
+
+_executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="will-bg")
+
+
+def submit(fn, *args, **kwargs):
+    """在背景執行 fn(*args, **kwargs)，回傳 Future。"""
+    return _executor.submit(fn, *args, **kwargs)
+
+
+def result_or_none(future, timeout=RESULT_TIMEOUT):
+    """取回背景工作的結果；超過 timeout 秒仍未完成或執行失敗時回傳 None（工作本身繼續在背景執行）。"""
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=timeout)
+    except Exception:
+        return None
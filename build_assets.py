@@ -0,0 +1,120 @@
+# --- 離線資源建置 ---
+# 把 static/ 裡的原始背景圖與音樂轉成較輕量的版本，輸出到 static/build/，
+# 並寫出 static/build/manifest.json（含內容雜湊），頁面會依 manifest 挑選最小的可用版本。
+# static/ 由 Streamlit 對外提供，只有 manifest 列出的檔案會被頁面引用（見 static_assets.py）。
+#
+# 使用方式（部署前在本機執行一次，再把 static/build/ 一起 commit）：
+#   python build_assets.py
+#
+# 需要：Pillow（streamlit 已內含）與系統上的 ffmpeg（轉檔音樂用，沒有就只建置圖片）。
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+from PIL import Image
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+BUILD_DIR = os.path.join(ASSET_DIR, "build")
+MANIFEST_PATH = os.path.join(BUILD_DIR, "manifest.json")
+
+# 實際有在頁面上使用的原始檔（background1.jpg 沒有被任何頁面引用，放在 assets/，不公開也不建置）
+BACKGROUND_SOURCE = "background.jpg"
+MUSIC_SOURCE = "echoofsadness.mp3"
+
+# 背景圖的各種視窗寬度，超過原圖寬度的不放大
+BACKGROUND_WIDTHS = (480, 768, 1280, 1920)
+JPEG_QUALITY = 78
+WEBP_QUALITY = 72
+
+# 背景音樂只是氛圍，低位元率就夠了
+AUDIO_VARIANTS = (
+    # (副檔名, MIME type, ffmpeg 參數)
+    (".opus", 'audio/ogg; codecs=opus', ["-c:a", "libopus", "-b:a", "32k", "-vbr", "on", "-application", "audio"]),
+    (".m4a", 'audio/mp4; codecs=mp4a.40.2', ["-c:a", "aac", "-b:a", "64k", "-movflags", "+faststart"]),
+)
+
+
+def content_hash(path):
+    # 與 static_assets 網址中的雜湊一致
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def _entry(path, mime, **extra):
+    entry = {
+        "file": os.path.relpath(path, ASSET_DIR).replace(os.sep, "/"),
+        "type": mime,
+        "bytes": os.path.getsize(path),
+        "hash": content_hash(path),
+    }
+    entry.update(extra)
+    return entry
+
+
+def build_backgrounds():
+    src = os.path.join(ASSET_DIR, BACKGROUND_SOURCE)
+    stem = os.path.splitext(BACKGROUND_SOURCE)[0]
+    entries = []
+    with Image.open(src) as im:
+        im = im.convert("RGB")
+        widths = sorted({min(w, im.width) for w in BACKGROUND_WIDTHS})
+        for width in widths:
+            height = round(im.height * width / im.width)
+            resized = im if width == im.width else im.resize((width, height), Image.LANCZOS)
+
+            jpg_path = os.path.join(BUILD_DIR, f"{stem}-{width}.jpg")
+            resized.save(jpg_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            entries.append(_entry(jpg_path, "image/jpeg", width=width))
+
+            webp_path = os.path.join(BUILD_DIR, f"{stem}-{width}.webp")
+            resized.save(webp_path, "WEBP", quality=WEBP_QUALITY, method=6)
+            entries.append(_entry(webp_path, "image/webp", width=width))
+    return entries
+
+
+def build_music():
+    src = os.path.join(ASSET_DIR, MUSIC_SOURCE)
+    stem = os.path.splitext(MUSIC_SOURCE)[0]
+    if shutil.which("ffmpeg") is None:
+        print("⚠️ 找不到 ffmpeg，略過音樂轉檔（頁面會直接使用原始 mp3）", file=sys.stderr)
+        return []
+    entries = []
+    for ext, mime, codec_args in AUDIO_VARIANTS:
+        out_path = os.path.join(BUILD_DIR, stem + ext)
+        cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", src, "-vn", "-ac", "2", *codec_args, out_path]
+        try:
+            subprocess.run(cmd, check=True)
+        except subprocess.CalledProcessError as e:
+            # 有些 ffmpeg 編譯沒有 libopus，略過該格式即可
+            print(f"⚠️ 轉檔 {ext} 失敗：{e}", file=sys.stderr)
+            continue
+        entries.append(_entry(out_path, mime))
+    return entries
+
+
+def main():
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    manifest = {
+        "sources": {
+            name: content_hash(os.path.join(ASSET_DIR, name))
+            for name in (BACKGROUND_SOURCE, MUSIC_SOURCE)
+        },
+        "background": build_backgrounds(),
+        "audio": build_music(),
+    }
+    # 由小到大排列，頁面依序挑第一個瀏覽器支援的版本
+    manifest["audio"].sort(key=lambda e: e["bytes"])
+    with open(MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    for kind in ("background", "audio"):
+        for e in manifest[kind]:
+            print(f"{e['file']:40s} {e['bytes'] / 1024:8.1f} KB")
+    print(f"✅ manifest 已寫入 {os.path.relpath(MANIFEST_PATH)}")
+
+
+if __name__ == "__main__":
+    main()
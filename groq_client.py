@@ -0,0 +1,338 @@
+# --- Groq API 共用連線 ---
+# 所有頁面共用同一個行程內的 HTTP client：keep-alive 連線池（有安裝 httpx + h2 時走 HTTP/2），
+# 避免每次提問都重新做一次 TCP + TLS 握手。啟動時可先在背景預熱連線。
+#
+# 環境變數：
+#   GROQ_POOL_SIZE        連線池大小（同時進行中的請求數上限），預設 32
+#   GROQ_CONNECT_TIMEOUT  連線 timeout 秒數，預設 5
+#   GROQ_READ_TIMEOUT     等待回應的 timeout 秒數，預設 60
+#   GROQ_HTTP2            1（預設）時優先使用 httpx 的 HTTP/2，設 0 則固定使用 requests
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from groq_limiter import estimate_tokens, limiter
+from response_cache import cache
+
+httpx = None  # 選用，搭配 h2 套件才有 HTTP/2；第一次建立連線時才 import，不拖慢冷啟動
+
+logger = logging.getLogger(__name__)
+
+GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_MODELS_URL = "https://api.groq.com/openai/v1/models"
+DEFAULT_MODEL = "llama3-70b-8192"
+SYSTEM_PROMPT = "你是一位溫柔且善於理解人心的助手，幫助使用者書寫遺囑，請用台灣繁體中文回答。"
+API_ERROR_MESSAGE = "很抱歉，API 呼叫失敗，請稍後再試。"  # 頁面在呼叫失敗時顯示的文字
+
+POOL_SIZE = int(os.environ.get("GROQ_POOL_SIZE", "32"))
+CONNECT_TIMEOUT = float(os.environ.get("GROQ_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("GROQ_READ_TIMEOUT", "60"))
+USE_HTTP2 = os.environ.get("GROQ_HTTP2", "1") == "1"
+
+
+class GroqError(Exception):
+    """呼叫 Groq API 失敗（連線錯誤、HTTP 錯誤或回應格式不符）。"""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _retry_after(headers):
+    value = headers.get("retry-after") if headers else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+# --- 傳輸層：requests（HTTP/1.1 keep-alive）或 httpx（HTTP/2） ---
+class _RequestsTransport:
+    name = "requests/http1.1"
+
+    def __init__(self, pool_size):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+
+    def post(self, url, headers, payload, timeout):
+        try:
+            res = self.session.post(url, headers=headers, json=payload, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            raise GroqError(str(e)) from e
+        if res.status_code >= 400:
+            raise GroqError(f"{res.status_code} {res.reason}", res.status_code, _retry_after(res.headers))
+        try:
+            return res.json()
+        except ValueError as e:
+            raise GroqError(f"回應不是 JSON：{e}") from e
+
+    @contextmanager
+    def stream_lines(self, url, headers, payload, timeout):
+        try:
+            with self.session.post(url, headers=headers, json=payload, timeout=timeout, stream=True) as res:
+                if res.status_code >= 400:
+                    raise GroqError(f"{res.status_code} {res.reason}", res.status_code, _retry_after(res.headers))
+                yield res.iter_lines(decode_unicode=True)
+        except requests.exceptions.RequestException as e:
+            raise GroqError(str(e)) from e
+
+    def get(self, url, headers, timeout):
+        self.session.get(url, headers=headers, timeout=timeout).close()
+
+
+class _HttpxTransport:
+    name = "httpx/http2"
+
+    def __init__(self, pool_size):
+        self.client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    def post(self, url, headers, payload, timeout):
+        try:
+            res = self.client.post(url, headers=headers, json=payload, timeout=timeout)
+        except httpx.HTTPError as e:
+            raise GroqError(str(e)) from e
+        if res.status_code >= 400:
+            raise GroqError(f"{res.status_code} {res.reason_phrase}", res.status_code, _retry_after(res.headers))
+        try:
+            return res.json()
+        except ValueError as e:
+            raise GroqError(f"回應不是 JSON：{e}") from e
+
+    @contextmanager
+    def stream_lines(self, url, headers, payload, timeout):
+        try:
+            with self.client.stream("POST", url, headers=headers, json=payload, timeout=timeout) as res:
+                if res.status_code >= 400:
+                    raise GroqError(f"{res.status_code} {res.reason_phrase}", res.status_code, _retry_after(res.headers))
+                yield res.iter_lines()
+        except httpx.HTTPError as e:
+            raise GroqError(str(e)) from e
+
+    def get(self, url, headers, timeout):
+        self.client.get(url, headers=headers, timeout=timeout)
+
+
+_lock = threading.Lock()
+_transport = None
+_prewarmed = False
+
+
+def _make_transport():
+    global httpx
+    if USE_HTTP2 and httpx is None:
+        try:
+            import httpx
+        except ImportError:
+            pass
+    if USE_HTTP2 and httpx is not None:
+        try:
+            return _HttpxTransport(POOL_SIZE)
+        except ImportError:
+            # httpx 有裝但缺少 h2 套件
+            logger.info("httpx 缺少 h2 套件，改用 requests 連線池")
+    return _RequestsTransport(POOL_SIZE)
+
+
+def get_transport():
+    """取得（必要時建立）整個行程共用的 HTTP client。"""
+    global _transport
+    if _transport is None:
+        with _lock:
+            if _transport is None:
+                _transport = _make_transport()
+                logger.info("Groq client：%s，連線池大小 %s", _transport.name, POOL_SIZE)
+    return _transport
+
+
+def _headers(api_key):
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+def _timeout():
+    if httpx is not None and isinstance(get_transport(), _HttpxTransport):
+        return httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+    return (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+
+def build_messages(prompt, system=SYSTEM_PROMPT):
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def warm_connection(api_key):
+    """建立到 api.groq.com 的連線並留在連線池（同步執行）；失敗只記錄，不影響正常使用。"""
+    try:
+        get_transport().get(GROQ_MODELS_URL, _headers(api_key), _timeout())
+        logger.info("Groq 連線預熱完成")
+    except Exception as e:
+        logger.info("Groq 連線預熱失敗：%s", e)
+
+
+def prewarm(api_key):
+    """在背景先建立到 api.groq.com 的連線（每個行程只做一次），第一個問題就不必等握手。"""
+    global _prewarmed
+    with _lock:
+        if _prewarmed:
+            return
+        _prewarmed = True
+    threading.Thread(target=warm_connection, args=(api_key,), name="groq-prewarm", daemon=True).start()
+
+
+def _record_request(stage, model, seconds, usage, attempts, error=None, ttft=None):
+    """記錄一次請求的指標（見 metrics.py）；只有數字與固定標籤，不含 prompt 或回應內容。"""
+    labels = {"stage": stage or "other", "model": model}
+    metrics.inc("groq_requests_total", **labels)
+    metrics.inc("groq_retries_total", max(0, attempts - 1), **labels)
+    if error is not None:
+        metrics.inc("groq_errors_total", status=getattr(error, "status", None) or "network", **labels)
+        return
+    metrics.observe("groq_request_seconds", seconds, **labels)
+    metrics.observe("groq_ttft_seconds", ttft, **labels)
+    metrics.observe("groq_prompt_tokens", (usage or {}).get("prompt_tokens"), **labels)
+    metrics.observe("groq_completion_tokens", (usage or {}).get("completion_tokens"), **labels)
+
+
+def chat(prompt, api_key, model=DEFAULT_MODEL, temperature=None, system=SYSTEM_PROMPT, on_wait=None, session=None, stage=None, response_format=None):
+    """送出一次對話請求並回傳完整文字；重試用盡仍失敗時丟出 GroqError。
+
+    請求會先查回應快取（見 response_cache.py），沒有命中才經過全域限流器排隊，
+    排隊期間以 on_wait(順位) 回報目前順位。session 用來標記快取資料所屬的 session，
+    之後可用 response_cache.cache.purge_session(session) 清除。stage 只用來標記指標。
+    response_format 原樣放進請求（JSON 模式，見 structured_output.py；要求 JSON 的系統提示本身就讓快取的鍵不同）。
+    """
+    messages = build_messages(prompt, system)
+    cached = cache.get(model, messages, temperature)
+    if cached is not None:
+        metrics.inc("groq_cache_hits_total", stage=stage or "other", model=model)
+        return cached
+    payload = {"model": model, "messages": messages}
+    if temperature is not None:
+        payload["temperature"] = temperature
+    if response_format is not None:
+        payload["response_format"] = response_format
+    attempts = 0
+    usage = None
+
+    def send():
+        nonlocal attempts, usage
+        attempts += 1
+        data = get_transport().post(GROQ_API_URL, _headers(api_key), payload, _timeout())
+        try:
+            content = data["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError) as e:
+            raise GroqError(f"回應格式不符：{e}") from e
+        usage = data.get("usage") or {}
+        return content, usage.get("total_tokens")
+
+    start = time.perf_counter()
+    try:
+        content = limiter.run(send, estimate_tokens(system + prompt), on_wait, model)
+    except Exception as e:
+        _record_request(stage, model, time.perf_counter() - start, usage, attempts, error=e)
+        raise
+    _record_request(stage, model, time.perf_counter() - start, usage, attempts)
+    cache.put(model, messages, temperature, content, session=session)
+    return content
+
+
+def chat_stream(prompt, api_key, model=DEFAULT_MODEL, temperature=None, system=SYSTEM_PROMPT, timing=None, on_wait=None, session=None, stage=None):
+    """串流版本：以 SSE（stream: true）逐段 yield 文字；失敗時丟出 GroqError。
+
+    收到第一段文字前的失敗會依限流器的規則重試，之後的失敗直接丟出。
+    傳入 timing（dict）時，串流結束後會填入首字延遲 ttft、總時間 total、
+    completion_tokens 與 tokens_per_sec。stage 只用來標記指標。
+    """
+    messages = build_messages(prompt, system)
+    cached = cache.get(model, messages, temperature)
+    if cached is not None:
+        metrics.inc("groq_cache_hits_total", stage=stage or "other", model=model)
+        if timing is not None:
+            timing.update(ttft=0.0, total=0.0, completion_tokens=None, tokens_per_sec=None, retries=0, cached=True)
+        yield cached
+        return
+    payload = {"model": model, "messages": messages, "stream": True}
+    if temperature is not None:
+        payload["temperature"] = temperature
+    tokens = estimate_tokens(system + prompt)
+    pieces = []
+    start = time.perf_counter()
+    first_token_at = None
+    chunks = 0
+    usage = None
+    attempt = 0
+    completed = False
+    failure = None
+    try:
+        while True:
+            limiter.acquire(tokens, on_wait, model)
+            try:
+                with get_transport().stream_lines(GROQ_API_URL, _headers(api_key), payload, _timeout()) as lines:
+                    for line in lines:
+                        if not line or not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            event = json.loads(data)
+                        except ValueError as e:
+                            raise GroqError(f"串流內容不是 JSON：{e}") from e
+                        # Groq 在最後一個 chunk 的 x_groq.usage 附上 token 用量
+                        usage = (event.get("x_groq") or {}).get("usage") or event.get("usage") or usage
+                        if not event.get("choices"):
+                            continue
+                        delta = event["choices"][0].get("delta", {}).get("content")
+                        if delta:
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                            chunks += 1
+                            pieces.append(delta)
+                            yield delta
+                cache.put(model, messages, temperature, "".join(pieces), session=session)
+                completed = True
+                return
+            except GroqError as e:
+                delay = None if first_token_at is not None else limiter.retry_delay(e, attempt, model)
+                if delay is None:
+                    failure = e
+                    raise
+                error = e
+            finally:
+                limiter.release(tokens, (usage or {}).get("total_tokens"), model)
+            limiter.backoff(error, delay)
+            attempt += 1
+    finally:
+        end = time.perf_counter()
+        # 對沖落敗、中途被取消的串流不記錄延遲，只記錄完整結束或失敗的請求
+        if completed or failure is not None:
+            _record_request(
+                stage, model, end - start, usage, attempt + 1, error=failure,
+                ttft=(first_token_at - start) if first_token_at else None,
+            )
+        if timing is not None:
+            completion_tokens = (usage or {}).get("completion_tokens", chunks)
+            generation_time = end - (first_token_at or end)
+            timing.update(
+                ttft=(first_token_at - start) if first_token_at else None,
+                total=end - start,
+                completion_tokens=completion_tokens,
+                tokens_per_sec=completion_tokens / generation_time if generation_time > 0 else None,
+                retries=attempt,
+            )
@@ -0,0 +1,223 @@
+# --- Groq 請求的全域限流與排隊 ---
+# 整個行程共用一個限流器：同時進行中的請求數上限（所有模型合計）+ 每個模型各自的
+# 每分鐘請求數（RPM）與 token 數（TPM）token bucket（Groq 的額度是依模型分開計算的）。
+# 超出額度的請求在所屬模型的佇列裡依先來後到排隊，排隊中會回報目前的順位給畫面顯示；
+# 遇到 429 / 5xx 時依 Retry-After 暫停「同一個模型」的請求（其他模型照常送出），再以帶抖動的指數退避重試。
+#
+# 環境變數：
+#   GROQ_MAX_CONCURRENCY  同時送往 Groq 的請求數上限，預設 8
+#   GROQ_RPM              每個模型每分鐘請求數上限，預設 30
+#   GROQ_TPM              每個模型每分鐘 token 數上限，預設 6000
+#   GROQ_MODEL_LIMITS     個別模型的額度，格式 模型=RPM/TPM，以逗號分隔，例如 llama3-8b-8192=30/30000
+#   GROQ_MAX_RETRIES      失敗後最多重試幾次，預設 3
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import token_count
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENCY = int(os.environ.get("GROQ_MAX_CONCURRENCY", "8"))
+RPM = float(os.environ.get("GROQ_RPM", "30"))
+TPM = float(os.environ.get("GROQ_TPM", "6000"))
+MAX_RETRIES = int(os.environ.get("GROQ_MAX_RETRIES", "3"))
+
+
+def _parse_model_limits(value):
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        try:
+            model, rates = item.split("=", 1)
+            rpm, tpm = rates.split("/", 1)
+            limits[model.strip()] = (float(rpm), float(tpm))
+        except ValueError:
+            logger.warning("GROQ_MODEL_LIMITS 的 %r 格式不正確（應為 模型=RPM/TPM），略過", item)
+    return limits
+
+
+MODEL_LIMITS = _parse_model_limits(os.environ.get("GROQ_MODEL_LIMITS", ""))
+
+BACKOFF_BASE = 1.0   # 第一次重試前的退避上限（秒），之後每次加倍
+BACKOFF_CAP = 20.0
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+EXPECTED_COMPLETION_TOKENS = 600  # 還不知道實際用量時，先以此估計回答的 token 數
+WAIT_REPORT_INTERVAL = 1.0        # 排隊中至少每隔幾秒回報一次順位
+
+
+def estimate_tokens(text):
+    # prompt 以本機 tokenizer 計數（見 token_count.py），回答長度先用預估值，回應後會用實際用量校正
+    return token_count.count_tokens(text) + EXPECTED_COMPLETION_TOKENS
+
+
+class TokenBucket:
+    """每分鐘補充 rate_per_minute 的 token bucket，容量等於一分鐘的額度。"""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60.0
+        self.level = rate_per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """還要等幾秒才有 amount 個 token（0 代表現在就夠）。"""
+        self._refill(now)
+        amount = min(amount, self.capacity)  # 單一超大請求最多等滿一整桶
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.level -= amount
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class ModelQuota:
+    """單一模型的額度：RPM / TPM 兩個 token bucket、排隊中的請求，以及收到 429 後暫停到何時。"""
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.queue = deque()
+        self.paused_until = 0.0
+
+
+class RateLimiter:
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, rpm=RPM, tpm=TPM, model_limits=None):
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.model_limits = MODEL_LIMITS if model_limits is None else model_limits
+        self._quotas = {}  # model -> ModelQuota，第一次用到時建立
+        self._cond = threading.Condition()
+        self._ids = itertools.count()
+        self._in_flight = 0
+
+    # --- 排隊與放行 ---
+    def _quota(self, model):
+        # 呼叫端已持有鎖
+        quota = self._quotas.get(model)
+        if quota is None:
+            rpm, tpm = self.model_limits.get(model, (self.rpm, self.tpm))
+            quota = self._quotas[model] = ModelQuota(rpm, tpm)
+        return quota
+
+    def _wait_time(self, quota, tokens, now):
+        # 呼叫端已持有鎖
+        if self._in_flight >= self.max_concurrency:
+            return None  # 等其他請求結束時會被喚醒
+        return max(
+            quota.paused_until - now,
+            quota.requests.wait_time(1, now),
+            quota.tokens.wait_time(tokens, now),
+        )
+
+    def acquire(self, tokens, on_wait=None, model=None):
+        """排隊直到 model 的額度可以送出請求；on_wait(順位) 會在排隊期間被呼叫（順位從 1 開始，只和同一個模型的請求比較）。"""
+        ticket = next(self._ids)
+        with self._cond:
+            quota = self._quota(model)
+            quota.queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if quota.queue[0] == ticket:
+                        wait = self._wait_time(quota, tokens, now)
+                        if wait == 0:
+                            break
+                    if on_wait is not None:
+                        position = quota.queue.index(ticket) + 1
+                        self._cond.release()
+                        try:
+                            on_wait(position)  # 不持有鎖，避免畫面更新卡住其他執行緒
+                        finally:
+                            self._cond.acquire()
+                    timeout = WAIT_REPORT_INTERVAL if wait is None else min(wait, WAIT_REPORT_INTERVAL)
+                    self._cond.wait(timeout)
+                self._in_flight += 1
+                quota.requests.take(1, now)
+                quota.tokens.take(tokens, now)
+            finally:
+                quota.queue.remove(ticket)
+                self._cond.notify_all()
+
+    def release(self, estimated_tokens, actual_tokens=None, model=None):
+        with self._cond:
+            self._in_flight -= 1
+            if actual_tokens is not None and actual_tokens < estimated_tokens:
+                self._quota(model).tokens.give_back(estimated_tokens - actual_tokens)
+            self._cond.notify_all()
+
+    def pause(self, seconds, model=None):
+        """收到 429 / Retry-After 時暫停 model 的所有請求，避免其他使用者的請求也撞上同一個模型的限流。"""
+        with self._cond:
+            quota = self._quota(model)
+            quota.paused_until = max(quota.paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def queue_length(self, model=None):
+        """排隊中的請求數；指定 model 時只計算該模型。"""
+        with self._cond:
+            if model is not None:
+                return len(self._quota(model).queue)
+            return sum(len(quota.queue) for quota in self._quotas.values())
+
+    # --- 重試 ---
+    def retry_delay(self, error, attempt, model=None):
+        """判斷失敗的請求是否該重試；該重試時回傳要等待的秒數，否則回傳 None。
+
+        error 若有 status / retry_after 屬性（例如 groq_client.GroqError）會用來判斷。
+        收到 429 或 Retry-After 時會同時暫停同一個 model 的所有請求，等待由 acquire 負責。
+        """
+        status = getattr(error, "status", None)
+        retry_after = getattr(error, "retry_after", None)
+        if attempt >= MAX_RETRIES or (status is not None and status not in RETRY_STATUSES):
+            return None
+        # full jitter：在 [0, 上限] 之間隨機，避免大家同時重試又一起撞牆
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if status == 429 or retry_after is not None:
+            self.pause(delay, model)
+        logger.info("Groq 請求失敗（%s），%.1f 秒後第 %d 次重試", error, delay, attempt + 1)
+        return delay
+
+    def backoff(self, error, delay):
+        # 已經 pause 的情況交給 acquire 排隊等待（期間持續回報順位），其餘直接睡
+        if getattr(error, "status", None) != 429 and getattr(error, "retry_after", None) is None:
+            time.sleep(delay)
+
+    def run(self, fn, tokens, on_wait=None, model=None):
+        """排隊取得 model 的額度後執行 fn()，失敗時依 Retry-After 或抖動退避重試。
+
+        fn 回傳 (結果, 實際 token 用量或 None)。
+        """
+        attempt = 0
+        while True:
+            self.acquire(tokens, on_wait, model)
+            actual = None
+            try:
+                result, actual = fn()
+                return result
+            except Exception as e:
+                delay = self.retry_delay(e, attempt, model)
+                if delay is None:
+                    raise
+                error = e
+            finally:
+                self.release(tokens, actual, model)
+            self.backoff(error, delay)
+            attempt += 1
+
+
+limiter = RateLimiter()
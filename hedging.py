@@ -0,0 +1,255 @@
+# --- 有時限的 LLM 呼叫：對沖請求與本機備援 ---
+# 每個階段（延伸問題、段落草稿、最終草稿）都有自己的延遲預算，預設是最近回應時間的 p95。
+# 主請求超過預算還沒回來時：
+#   - 送出第二個相同的 Groq 請求（對沖請求）——只在限流器沒有人排隊時才送，
+#     排隊代表瓶頸在自己的額度，再多送一個只會更慢
+#   - 延伸問題另外可以交給本機 CPU 小模型（local_llm.py，預設停用；第一次需要時才在背景載入，載入完成後才使用）
+# 哪一條路徑先回來就用哪一個，其餘的結果丟棄（串流會立即中斷連線）。
+# 每次實際採用的路徑（primary / hedge / local / failed）與耗時都會記錄，可用 stats() 追蹤尾端延遲。
+#
+# 串流呼叫的預算以首字延遲（TTFT）計算：第一段文字先到的串流勝出，之後只讀它。
+#
+# 環境變數：
+#   HEDGE                 1（預設）啟用，0 時只送主請求
+#   HEDGE_PERCENTILE      以第幾百分位的延遲當預算，預設 0.95
+#   HEDGE_MIN_SAMPLES     累積幾筆延遲後才改用實測百分位，預設 20（之前用 DEFAULT_BUDGETS）
+#   HEDGE_WINDOW          每個階段保留最近幾筆延遲，預設 200
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import groq_client
+import local_llm
+import metrics
+from groq_limiter import limiter
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("HEDGE", "1") == "1"
+PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0.95"))
+MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+WINDOW = int(os.environ.get("HEDGE_WINDOW", "200"))
+
+# 實測資料不足時的預算（秒）；final_stream 是首字延遲，其餘是完整回應時間
+DEFAULT_BUDGETS = {"followup": 4.0, "section": 6.0, "condense": 8.0, "final": 15.0, "final_stream": 4.0}
+PATHS = ("primary", "hedge", "local", "failed")
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class LatencyBudgets:
+    def __init__(self, percentile=PERCENTILE, min_samples=MIN_SAMPLES, window=WINDOW):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self._lock = threading.Lock()
+        self._primary = {}   # 階段 -> 主請求的延遲（不論最後是否採用）
+        self._chosen = {}    # 階段 -> 實際採用路徑的延遲（使用者感受到的延遲）
+        self._counts = {}    # 階段 -> {路徑: 次數}
+
+    def budget(self, stage):
+        with self._lock:
+            samples = self._primary.get(stage)
+            if samples and len(samples) >= self.min_samples:
+                return _percentile(samples, self.percentile)
+        return DEFAULT_BUDGETS.get(stage, 10.0)
+
+    def record_primary(self, stage, seconds):
+        with self._lock:
+            self._primary.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    def record_path(self, stage, path, seconds, hedged):
+        with self._lock:
+            counts = self._counts.setdefault(stage, dict.fromkeys(PATHS + ("hedged",), 0))
+            counts[path] += 1
+            counts["hedged"] += int(hedged)
+            if path != "failed":
+                self._chosen.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+        metrics.observe("llm_stage_seconds", seconds, stage=stage, path=path, hedged=int(hedged))
+        logger.info("LLM 階段 %s：採用 %s（%.2f 秒%s）", stage, path, seconds, "，已對沖" if hedged else "")
+
+    def stats(self):
+        with self._lock:
+            stages = set(self._counts) | set(self._primary)
+            result = {}
+            for stage in stages:
+                chosen = list(self._chosen.get(stage, ()))
+                result[stage] = dict(self._counts.get(stage, {}))
+                result[stage]["p50"] = _percentile(chosen, 0.5) if chosen else None
+                result[stage]["p95"] = _percentile(chosen, 0.95) if chosen else None
+        for stage in result:
+            result[stage]["budget"] = self.budget(stage)
+        return result
+
+
+budgets = LatencyBudgets()
+
+
+def _can_hedge(model):
+    return ENABLED and limiter.queue_length(model) == 0
+
+
+def _start(target, *args):
+    # 用獨立的執行緒而不是 background_jobs：呼叫端本身可能就在執行緒池裡等結果
+    threading.Thread(target=target, args=args, name="llm-hedge", daemon=True).start()
+
+
+def chat(prompt, api_key, stage, local=False, on_wait=None, **kwargs):
+    """有時限的 groq_client.chat：超過階段預算時送出對沖請求（local=True 時也交給本機模型），先回來的勝出。
+
+    所有路徑都失敗時丟出最後一個錯誤（Groq 失敗為 GroqError）。on_wait 只會在呼叫端的執行緒被呼叫。
+    """
+    events = queue.Queue()
+    system = kwargs.get("system", groq_client.SYSTEM_PROMPT)
+    start = time.perf_counter()
+
+    def run(path):
+        def report(position):
+            events.put(("wait", path, position))
+        try:
+            if path == "local":
+                text = local_llm.generate(prompt, system)
+            else:
+                text = groq_client.chat(prompt, api_key, on_wait=report, stage=stage, **kwargs)
+        except Exception as e:
+            events.put(("error", path, e))
+            return
+        if path == "primary":
+            budgets.record_primary(stage, time.perf_counter() - start)
+        events.put(("done", path, text))
+
+    def launch_fallbacks(after_failure):
+        paths = []
+        if not after_failure and _can_hedge(kwargs.get("model", groq_client.DEFAULT_MODEL)):
+            paths.append("hedge")  # 主請求本身已經重試過，失敗後不再對沖同一個請求
+        if local and ENABLED:
+            if local_llm.is_ready():
+                paths.append("local")
+            else:
+                local_llm.load_in_background()  # 第一次需要時才載入；這一次只能等 Groq
+        for path in paths:
+            _start(run, path)
+        return paths
+
+    _start(run, "primary")
+    pending = {"primary"}
+    fallbacks_started = False
+    hedged = False  # 是否真的送出了對沖請求或交給本機模型
+    deadline = start + budgets.budget(stage)
+    error = None
+    while pending:
+        timeout = None if fallbacks_started else max(0.0, deadline - time.perf_counter())
+        try:
+            kind, path, value = events.get(timeout=timeout)
+        except queue.Empty:
+            fallbacks_started = True
+            launched = launch_fallbacks(after_failure=False)
+            hedged = hedged or bool(launched)
+            pending.update(launched)
+            continue
+        if kind == "wait":
+            if on_wait is not None and path == "primary":
+                on_wait(value)
+            continue
+        pending.discard(path)
+        if kind == "done":
+            budgets.record_path(stage, path, time.perf_counter() - start, hedged)
+            return value
+        error = value
+        if not fallbacks_started:
+            fallbacks_started = True
+            launched = launch_fallbacks(after_failure=True)
+            hedged = hedged or bool(launched)
+            pending.update(launched)
+    budgets.record_path(stage, "failed", time.perf_counter() - start, hedged)
+    raise error
+
+
+def chat_stream(prompt, api_key, stage="final_stream", timing=None, on_wait=None, **kwargs):
+    """有時限的 groq_client.chat_stream：首字超過預算時送出對沖串流，先吐出文字的勝出，之後只讀它。
+
+    timing 會填入勝出串流的計時資料，外加 path（primary / hedge）與 hedged。
+    """
+    events = queue.Queue()
+    cancelled = {"primary": threading.Event(), "hedge": threading.Event()}
+    start = time.perf_counter()
+
+    def run(path):
+        def report(position):
+            events.put(("wait", path, position))
+        stream_timing = {}
+        stream = groq_client.chat_stream(prompt, api_key, timing=stream_timing, on_wait=report, stage=stage, **kwargs)
+        try:
+            first = True
+            for delta in stream:
+                if first and path == "primary":
+                    budgets.record_primary(stage, time.perf_counter() - start)
+                first = False
+                if cancelled[path].is_set():
+                    break
+                events.put(("delta", path, delta))
+        except Exception as e:
+            events.put(("error", path, e))
+            return
+        finally:
+            stream.close()  # 落敗的串流在這裡中斷連線
+        events.put(("end", path, stream_timing))
+
+    _start(run, "primary")
+    pending = {"primary"}
+    hedged = False
+    deadline_passed = False
+    winner = None
+    deadline = start + budgets.budget(stage)
+    try:
+        while pending:
+            timeout = None if deadline_passed or winner else max(0.0, deadline - time.perf_counter())
+            try:
+                kind, path, value = events.get(timeout=timeout)
+            except queue.Empty:
+                deadline_passed = True
+                if _can_hedge(kwargs.get("model", groq_client.DEFAULT_MODEL)):
+                    hedged = True
+                    _start(run, "hedge")
+                    pending.add("hedge")
+                continue
+            if winner is not None and path != winner:
+                continue
+            if kind == "wait":
+                if on_wait is not None and path == "primary":
+                    on_wait(value)
+            elif kind == "delta":
+                if winner is None:
+                    winner = path
+                    for other in cancelled:
+                        if other != path:
+                            cancelled[other].set()
+                    budgets.record_path(stage, path, time.perf_counter() - start, hedged)
+                yield value
+            elif kind == "end":
+                if winner is None:  # 沒有任何文字的空回應
+                    winner = path
+                    budgets.record_path(stage, path, time.perf_counter() - start, hedged)
+                if timing is not None:
+                    timing.update(value, path=path, hedged=hedged)
+                return
+            else:
+                pending.discard(path)
+                if winner is not None or not pending:
+                    if winner is None:
+                        budgets.record_path(stage, "failed", time.perf_counter() - start, hedged)
+                    raise value
+    finally:
+        for event in cancelled.values():  # 呼叫端提早停止讀取時，所有串流都中斷
+            event.set()
+
+
+def stats():
+    """各階段採用各路徑的次數、對沖次數、實際延遲的 p50 / p95 與目前的預算。"""
+    return budgets.stats()
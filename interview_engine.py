@@ -0,0 +1,318 @@
+# --- 訪談流程引擎（不依賴 Streamlit） ---
+# 原本每個頁面各自在 st.session_state 裡維護 step / questions / answers / chat / done / generated，
+# 流程只能在瀏覽器裡跑。這裡把流程抽成一個狀態機 Interview，LLM 以可替換的函式 llm(prompt, stage) 傳入：
+#   頁面傳入自己的 call_groq（會在畫面上顯示排隊順位與錯誤），
+#   效能測試與壓力測試則傳入 GroqLLM（直接呼叫 API）或 CannedLLM（固定回覆，不連網），在同一個行程內大量模擬對話。
+#
+# 狀態：
+#   ASKING     還有問題沒回答（submit）
+#   FOLLOWUP   初始問題都答完，等待產生延伸問題（ask_followups / add_followups）
+#   DRAFTING   所有問題都答完，等待產生草稿（write_draft / finish）
+#   DONE       草稿完成
+#
+# 各頁面提問方式略有不同（延伸問題的 prompt、提示文字、最終 prompt 的格式），以 Flow 選擇；
+# 預設的 DETAILED_FLOW 是 ai_will4.py / ai_will5.py 的版本。
+# 延伸問題以 JSON 模式取得（llm(prompt, stage="followup", schema=FOLLOWUP_SCHEMA) 回傳驗證過的 dict，見 structured_output.py），
+# 不再從自由文字裡一行一行撈。
+from collections import namedtuple
+from collections.abc import Sequence
+
+import hedging
+import structured_output
+
+ASKING = "asking"
+FOLLOWUP = "followup"
+DRAFTING = "drafting"
+DONE = "done"
+
+INITIAL_QUESTIONS = (
+    "你希望這份遺囑是寫給誰的？",
+    "你有什麼話想對這個人說？",
+    "有沒有什麼未完成的心願或故事，想交代的？",
+    "是否有任何財產、物品、或資料需要安排？",
+    "你想以什麼語氣或風格呈現這份遺囑？（例如莊嚴、溫柔、幽默）",
+)
+UNANSWERED = "未回答"
+FOLLOWUP_NOTICE = "好的，我們還有幾個問題想請教您，這能幫助我們完善遺囑…"
+MAX_FOLLOWUPS = 2
+
+
+# --- 延伸問題的 prompt 與格式 ---
+FOLLOWUP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "questions": {
+            "type": "array",
+            "items": {"type": "string", "minLength": 2, "maxLength": 200},
+            "maxItems": MAX_FOLLOWUPS,
+        },
+    },
+    "required": ["questions"],
+    "additionalProperties": False,
+}
+FOLLOWUP_EXAMPLE = '{"questions": ["請問您是否有特別想要指定受益人的比例？", "您希望如何安排您的數位遺產？"]}'
+
+
+def followup_summary(answers, questions=INITIAL_QUESTIONS):
+    return "\n".join([f"{i+1}. {q}：{a}" for i, (q, a) in enumerate(zip(questions, answers[:len(questions)]))])
+
+
+def detailed_followup_prompt(answers, questions=INITIAL_QUESTIONS):
+    summary = followup_summary(answers, questions)
+    return f"請根據以下使用者提供的資訊，提出 **1 到 2 個** 可以幫助其更完善遺囑的**延伸問題**。每個問題放在 questions 陣列的一個元素，使用清晰的繁體中文提問，不要加編號。例如：\n{FOLLOWUP_EXAMPLE}\n\n使用者提供的資訊：\n{summary}"
+
+
+def brief_followup_prompt(answers, questions=INITIAL_QUESTIONS):
+    return f"請根據以下回答，提出 1~2 個可以補充的延伸問題，放在 questions 陣列中（例如 {FOLLOWUP_EXAMPLE}）：\n{followup_summary(answers, questions)}"
+
+
+def followup_questions(reply):
+    """JSON 回應（{"questions": [...]}，已依 FOLLOWUP_SCHEMA 驗證）中的延伸問題；呼叫失敗（None）時沒有延伸問題。"""
+    if not reply:
+        return []
+    return [q.strip() for q in reply["questions"]][:MAX_FOLLOWUPS]
+
+
+# --- 最終 prompt ---
+def qa_final_prompt(questions, answers):
+    final_prompt_parts = [f"問題: {q}\n回答: {a}" for q, a in zip(questions, answers)]
+    return "請根據以下資訊，幫我生成一份溫柔但格式清晰的中文遺囑草稿。請確保草稿包含所有提及的關鍵資訊。最後請加上今日日期結尾。\n\n" + "\n\n".join(final_prompt_parts)
+
+
+def numbered_final_prompt(questions, answers):
+    final_prompt = "\n".join([f"{i+1}. {q}：{a}" for i, (q, a) in enumerate(zip(questions, answers))])
+    return f"請根據以下資訊，幫我生成一份溫柔但格式清晰的中文遺囑草稿：\n{final_prompt}\n請加上今日日期結尾。"
+
+
+# --- 各頁面的提問方式（每個行程共用同一份，session 只保存參照） ---
+Flow = namedtuple("Flow", "questions followup_prompt final_prompt followup_notice list_followups")
+Flow.__doc__ = "提問方式：初始問題、延伸問題的 prompt、最終 prompt 的格式、提示文字、是否逐題列出延伸問題。"
+
+DETAILED_FLOW = Flow(INITIAL_QUESTIONS, detailed_followup_prompt, qa_final_prompt, FOLLOWUP_NOTICE, False)
+# 只有提示文字不同（a_will_2.py、ai_will3.py）
+DEEPER_FLOW = DETAILED_FLOW._replace(followup_notice="讓我們深入一點，還有幾個問題想請教您…")
+# 簡短的延伸問題 prompt，延伸問題逐題列進對話紀錄（app.py、tryy.py）
+BRIEF_FLOW = Flow(INITIAL_QUESTIONS, brief_followup_prompt, numbered_final_prompt, "讓我們深入一點…", True)
+FLOWS = (DETAILED_FLOW, DEEPER_FLOW, BRIEF_FLOW)
+
+
+# --- 狀態機 ---
+class Interview:
+    """一次遺囑訪談的狀態；不呼叫任何 st.*，可以在頁面以外直接驅動。
+
+    每段文字只存一份：回答只在 answers、草稿只在 generated，對話紀錄 chat 是依狀態即時組出的檢視；
+    初始問題與提問方式是所有 session 共用的 Flow，session 只另外保存自己的延伸問題。
+    """
+
+    __slots__ = ("flow", "followups", "answers", "followups_generated", "generated")
+
+    def __init__(self, flow=DETAILED_FLOW):
+        self.flow = flow
+        self.followups = ()          # 延伸問題
+        self.answers = []            # 儲存所有回答
+        self.followups_generated = False  # 確保只生成一次延伸問題
+        self.generated = ""          # 最終生成的遺囑草稿
+
+    @property
+    def initial_questions(self):
+        return self.flow.questions
+
+    @property
+    def questions(self):
+        return self.flow.questions + self.followups
+
+    @property
+    def chat(self):
+        """對話紀錄（transcript.render 的格式），不另外複製任何文字。"""
+        return Transcript(self)
+
+    @property
+    def step(self):
+        return len(self.answers)
+
+    @property
+    def state(self):
+        if self.generated:
+            return DONE
+        if self.step < len(self.flow.questions) + len(self.followups):
+            return ASKING
+        if not self.followups_generated:
+            return FOLLOWUP
+        return DRAFTING
+
+    @property
+    def done(self):
+        """所有問題都已回答（可以開始產生草稿）。"""
+        return self.state in (DRAFTING, DONE)
+
+    def current_question(self):
+        return self.questions[self.step] if self.state == ASKING else None
+
+    def submit(self, answer):
+        """回答目前的問題；空白回答不接受，回傳 False。"""
+        if self.state != ASKING:
+            raise RuntimeError(f"目前狀態 {self.state} 不能回答問題")
+        if not answer.strip():
+            return False
+        self.answers.append(answer)
+        return True
+
+    def followup_prompt(self):
+        return self.flow.followup_prompt(self.answers, self.flow.questions)
+
+    def add_followups(self, new_questions):
+        """加入延伸問題（可以是空的，代表直接進入草稿階段）。"""
+        if self.state != FOLLOWUP:
+            raise RuntimeError(f"目前狀態 {self.state} 不能加入延伸問題")
+        self.followups = tuple(new_questions)
+        self.followups_generated = True
+
+    def ask_followups(self, llm):
+        """以 llm 產生並加入延伸問題，回傳新問題（llm 失敗回傳 None 時沒有延伸問題）。"""
+        new_questions = followup_questions(llm(self.followup_prompt(), stage="followup", schema=FOLLOWUP_SCHEMA))
+        self.add_followups(new_questions)
+        return new_questions
+
+    def final_answers(self):
+        """與 questions 對齊的回答（沒回答的題目以「未回答」補上），也就是最終 prompt 中可以濃縮的部分。"""
+        questions = self.questions
+        return [self.answers[i] if i < len(self.answers) else UNANSWERED for i in range(len(questions))]
+
+    def render_final(self, answers):
+        return self.flow.final_prompt(self.questions, answers)
+
+    def finish(self, draft):
+        if self.state != DRAFTING:
+            raise RuntimeError(f"目前狀態 {self.state} 不能寫入草稿")
+        self.generated = draft
+
+    def write_draft(self, llm, fit=None):
+        """以 llm 產生草稿；fit(parts, render) 回傳 (prompt, 報告)，通常是 prompt_budget.fit。"""
+        parts = self.final_answers()
+        prompt = fit(parts, self.render_final)[0] if fit else self.render_final(parts)
+        self.finish(llm(prompt, stage="final"))
+        return self.generated
+
+    def snapshot(self):
+        """可以 JSON 序列化的狀態（Flow 以在 FLOWS 中的位置表示），見 session_spill.py。"""
+        return {
+            "flow": FLOWS.index(self.flow),
+            "followups": list(self.followups),
+            "answers": list(self.answers),
+            "followups_generated": self.followups_generated,
+            "generated": self.generated,
+        }
+
+    @classmethod
+    def restore(cls, snapshot):
+        interview = cls(FLOWS[snapshot["flow"]])
+        interview.followups = tuple(snapshot["followups"])
+        interview.answers = list(snapshot["answers"])
+        interview.followups_generated = snapshot["followups_generated"]
+        interview.generated = snapshot["generated"]
+        return interview
+
+
+class Transcript(Sequence):
+    """Interview 的對話紀錄檢視：依序為各題回答、延伸問題的提示（與延伸問題本身）、最終草稿。"""
+
+    __slots__ = ("_interview",)
+
+    def __init__(self, interview):
+        self._interview = interview
+
+    def __iter__(self):
+        interview = self._interview
+        initial = len(interview.flow.questions)
+        for i, answer in enumerate(interview.answers):
+            if i == initial:
+                yield from self._followup_entries()
+            yield {"role": "user", "content": answer}
+        if len(interview.answers) <= initial:
+            yield from self._followup_entries()
+        if interview.generated:
+            yield {"role": "assistant", "content": interview.generated}
+
+    def _followup_entries(self):
+        interview = self._interview
+        if interview.followups:
+            yield {"role": "assistant", "content": interview.flow.followup_notice}
+            if interview.flow.list_followups:
+                for question in interview.followups:
+                    yield {"role": "assistant", "content": question}
+
+    def _layout(self):
+        """(延伸問題區塊前的回答數, 延伸問題區塊的訊息數)。"""
+        interview = self._interview
+        before = min(len(interview.answers), len(interview.flow.questions))
+        followups = 0
+        if interview.followups:
+            followups = 1 + (len(interview.followups) if interview.flow.list_followups else 0)
+        return before, followups
+
+    def __len__(self):
+        _, followups = self._layout()
+        return len(self._interview.answers) + followups + bool(self._interview.generated)
+
+    def _entry(self, i):
+        interview = self._interview
+        before, followups = self._layout()
+        if i < before:
+            return {"role": "user", "content": interview.answers[i]}
+        if i < before + followups:
+            j = i - before
+            return {"role": "assistant", "content": interview.flow.followup_notice if j == 0 else interview.followups[j - 1]}
+        if i - followups < len(interview.answers):
+            return {"role": "user", "content": interview.answers[i - followups]}
+        return {"role": "assistant", "content": interview.generated}
+
+    def __getitem__(self, index):
+        # 直接從 answers / followups 取出需要的部分，不必為了一小段切片組出整份對話
+        if isinstance(index, slice):
+            return [self._entry(i) for i in range(len(self))[index]]
+        return self._entry(range(len(self))[index])
+
+
+def run(llm, answers, fit=None, flow=DETAILED_FLOW):
+    """從頭跑完一次訪談：answers 依序回答每一題（不夠時重複最後一個），回傳完成的 Interview。"""
+    interview = Interview(flow)
+    while interview.state != DONE:
+        if interview.state == ASKING:
+            interview.submit(answers[min(interview.step, len(answers) - 1)])
+        elif interview.state == FOLLOWUP:
+            interview.ask_followups(llm)
+        else:
+            interview.write_draft(llm, fit)
+    return interview
+
+
+# --- LLM 用戶端 ---
+class GroqLLM:
+    """直接呼叫 Groq（經過限流與對沖，見 hedging.py）；有 schema 時以 JSON 模式回傳驗證過的值。
+
+    失敗時丟出 groq_client.GroqError（回應不符合 schema 時為其子類別 StructuredOutputError）。
+    """
+
+    def __init__(self, api_key, session=None, temperature=0.7):
+        self.api_key = api_key
+        self.session = session
+        self.temperature = temperature
+
+    def __call__(self, prompt, stage="final", schema=None):
+        if schema is not None:
+            return structured_output.chat_json(prompt, schema, api_key=self.api_key, stage=stage, local=(stage == "followup"),
+                                               temperature=self.temperature, session=self.session)
+        return hedging.chat(prompt, api_key=self.api_key, stage=stage, local=(stage == "followup"),
+                            temperature=self.temperature, session=self.session)
+
+
+class CannedLLM:
+    """固定回覆、不連網，用來在行程內壓力測試或剖析流程本身的開銷。"""
+
+    def __init__(self, followups=("您希望如何安排數位遺產？", "是否有想指定的見證人？"), draft="親愛的家人，這是我的遺囑。"):
+        self.replies = {"followup": {"questions": list(followups)}, "final": draft}
+        self.calls = 0
+
+    def __call__(self, prompt, stage="final", schema=None):
+        self.calls += 1
+        return self.replies.get(stage, self.replies["final"])
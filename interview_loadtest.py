@@ -0,0 +1,69 @@
+# --- 訪談流程的行程內壓力測試 ---
+# 不開瀏覽器、不經過 Streamlit，直接以 interview_engine 在同一個行程內跑完大量訪談，
+# 量測流程本身（狀態轉移、prompt 組裝、token 預算檢查）的吞吐量，也可以搭配 cProfile 找出熱點。
+# 預設使用 CannedLLM（固定回覆、不連網）；--groq 時改用真的 API（需要環境變數 GROQ_API_KEY，注意用量）。
+#
+# 使用方式：
+#   python interview_loadtest.py --sessions 20000
+#   python interview_loadtest.py --sessions 5000 --threads 8 --budget
+#   python interview_loadtest.py --sessions 2000 --profile
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import interview_engine
+
+SAMPLE_ANSWERS = (
+    "我的女兒小安",
+    "謝謝你一直陪在我身邊，要好好照顧自己。",
+    "希望你替我去一趟京都，看看我們說好的楓葉。",
+    "台北的房子留給你，存款平均分給你和弟弟，相簿請你保管。",
+    "溫柔",
+    "請把我的帳號密碼本交給弟弟處理。",
+)
+
+
+def simulate(count, llm, fit):
+    for _ in range(count):
+        interview_engine.run(llm, SAMPLE_ANSWERS, fit=fit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在行程內大量模擬遺囑訪談，量測流程本身的吞吐量")
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--threads", type=int, default=1, help="同時模擬的執行緒數")
+    parser.add_argument("--budget", action="store_true", help="最終 prompt 也經過 prompt_budget.fit（token 計數）")
+    parser.add_argument("--groq", action="store_true", help="改用真的 Groq API（GROQ_API_KEY）")
+    parser.add_argument("--profile", action="store_true", help="以 cProfile 列出最耗時的函式（單一執行緒）")
+    args = parser.parse_args()
+
+    if args.groq:
+        llm = interview_engine.GroqLLM(os.environ["GROQ_API_KEY"])
+    else:
+        llm = interview_engine.CannedLLM()
+    fit = None
+    if args.budget:
+        import prompt_budget
+
+        fit = lambda parts, render: prompt_budget.fit(parts, render, api_key=os.environ.get("GROQ_API_KEY"))
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(simulate, args.sessions, llm, fit)
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(20)
+        return
+
+    per_thread = [args.sessions // args.threads + (1 if i < args.sessions % args.threads else 0) for i in range(args.threads)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(lambda n: simulate(n, llm, fit), per_thread))
+    elapsed = time.perf_counter() - start
+    print(f"✅ {args.sessions} 次訪談，{elapsed:.2f} 秒，{args.sessions / elapsed:,.0f} 次／秒（每次 {elapsed / args.sessions * 1e6:.0f} µs）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# --- 本機 CPU 小模型 ---
+# Groq 回應過慢時，延伸問題改由本機的小型指令模型產生（見 hedging.py）。
+# 延伸問題只有一兩行，0.5B 等級的模型在 CPU 上幾秒內就能寫完；最終的遺囑草稿仍交給 Groq。
+#
+# 預設停用：模型會常駐在每個伺服器行程的記憶體裡，和每個 session 的記憶體預算（session_memory.py）互相排擠，
+# 只在記憶體充裕的主機上開啟。開啟時也不在預熱時載入，而是在第一次需要對沖延伸問題時才於背景載入（load_in_background），
+# 並以 bf16（約 1 GB，預設）或 int8 動態量化（載入後約 0.6 GB，但載入當下會短暫用到 fp32 的 2 GB）載入，不以 fp32 常駐。
+# 還沒載入完成時 is_ready() 為 False，hedging 不會選擇本機路徑，也不會在請求當下等待載入。
+#
+# 環境變數：
+#   LOCAL_LLM                  1 啟用，0（預設）停用
+#   LOCAL_LLM_MODEL            模型，預設 Qwen/Qwen2.5-0.5B-Instruct
+#   LOCAL_LLM_DTYPE            bf16（預設）或 int8
+#   LOCAL_LLM_MAX_NEW_TOKENS   最多生成幾個 token，預設 160
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("LOCAL_LLM", "0") == "1"
+MODEL_NAME = os.environ.get("LOCAL_LLM_MODEL", "Qwen/Qwen2.5-0.5B-Instruct")
+DTYPE = os.environ.get("LOCAL_LLM_DTYPE", "bf16")
+MAX_NEW_TOKENS = int(os.environ.get("LOCAL_LLM_MAX_NEW_TOKENS", "160"))
+
+_lock = threading.Lock()
+_generate_lock = threading.Lock()  # CPU 推論一次只跑一個，並行只會互相搶核心
+_model = None
+_tokenizer = None
+_loading = False
+
+
+def is_ready():
+    return ENABLED and _model is not None
+
+
+def _load_model():
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    if DTYPE == "int8":
+        model = AutoModelForCausalLM.from_pretrained(MODEL_NAME, torch_dtype=torch.float32, low_cpu_mem_usage=True)
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return AutoModelForCausalLM.from_pretrained(MODEL_NAME, torch_dtype=torch.bfloat16, low_cpu_mem_usage=True)
+
+
+def warm_up():
+    """載入模型與 tokenizer（同步執行，只會載入一次）；停用時直接返回。"""
+    global _model, _tokenizer
+    if not ENABLED or _model is not None:
+        return
+    with _lock:
+        if _model is not None:
+            return
+        from transformers import AutoTokenizer
+
+        start = time.perf_counter()
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        model = _load_model()
+        model.eval()
+        _tokenizer = tokenizer
+        _model = model
+        logger.info("本機模型 %s（%s）載入完成（%.1f 秒）", MODEL_NAME, DTYPE, time.perf_counter() - start)
+
+
+def _load():
+    global _loading
+    try:
+        warm_up()
+    except Exception as e:  # 載入失敗就不再嘗試，延伸問題照常只走 Groq
+        logger.warning("本機模型載入失敗，不使用本機備援：%s", e)
+    else:
+        _loading = False
+
+
+def load_in_background():
+    """第一次需要本機備援時呼叫：在背景載入模型並立即返回（只會載入一次）。"""
+    global _loading
+    if not ENABLED or _model is not None:
+        return
+    with _lock:
+        if _loading:
+            return
+        _loading = True
+    threading.Thread(target=_load, name="local-llm-load", daemon=True).start()
+
+
+def generate(prompt, system):
+    """以本機模型回答，回傳文字；模型尚未載入時丟出 RuntimeError。"""
+    if not is_ready():
+        raise RuntimeError("本機模型尚未載入")
+    import torch
+
+    messages = [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+    inputs = _tokenizer.apply_chat_template(messages, add_generation_prompt=True, return_tensors="pt")
+    with _generate_lock, torch.inference_mode():
+        output = _model.generate(inputs, max_new_tokens=MAX_NEW_TOKENS, do_sample=False)
+    return _tokenizer.decode(output[0, inputs.shape[1]:], skip_special_tokens=True).strip()
@@ -0,0 +1,170 @@
+# --- Lottie 動畫快取 ---
+# 動畫 JSON 隨專案附在 assets/lottie/，每個行程只讀一次放在記憶體裡，第一次繪製與離線時也有動畫；
+# 網路更新一律在背景執行緒進行（有嚴格 timeout），頁面永遠不必等 lottie.host 回應。
+# 背景下載到的新版本寫在 .cache/lottie/（不寫回專案目錄，唯讀部署也能運作），之後啟動時優先使用。
+# 內附檔只是離線時的替代動畫：只要目前用的是內附檔（.cache/ 裡還沒有下載過的版本），
+# 第一次載入就在背景下載正式版本，失敗時每 RETRY_SECONDS 秒再試，不必等到 LOTTIE_REFRESH_SECONDS。
+#
+# 更新專案內附的動畫檔（換動畫時在本機執行一次，再 commit）：
+#   python lottie_cache.py
+#
+# 環境變數：
+#   LOTTIE_FETCH_TIMEOUT     背景下載的 timeout 秒數，預設 3
+#   LOTTIE_REFRESH_SECONDS   多久在背景重新下載一次，預設 86400（一天），0 代表完全不連網（一直使用內附檔）
+#   LOTTIE_MINIFY            1（預設）時把座標等浮點數四捨五入到小數第 3 位，減少送到瀏覽器的資料量
+#   LOTTIE_CACHE_DIR         背景下載的存放位置，預設 .cache/lottie
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOTTIE_URL = "https://lottie.host/8e67f872-e483-4e8c-9b28-6ca11329eb42/rgznX6aYYt.json"
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BUNDLE_DIR = os.path.join(ROOT, "assets", "lottie")
+CACHE_DIR = os.environ.get("LOTTIE_CACHE_DIR", os.path.join(ROOT, ".cache", "lottie"))
+
+FETCH_TIMEOUT = float(os.environ.get("LOTTIE_FETCH_TIMEOUT", "3"))
+REFRESH_SECONDS = float(os.environ.get("LOTTIE_REFRESH_SECONDS", "86400"))
+MINIFY = os.environ.get("LOTTIE_MINIFY", "1") == "1"
+MINIFY_PRECISION = 3
+RETRY_SECONDS = 60  # 還沒有下載到正式版本（沒有動畫或只有內附檔）時，下載失敗後多久再試
+
+_lock = threading.Lock()
+_cache = {}       # url -> 動畫 JSON（dict）
+_loaded_at = {}   # url -> 上次成功載入（或嘗試下載）的時間
+_refreshing = set()
+_from_bundle = set()  # 目前使用內附替代動畫的 url
+
+
+def bundle_path(url, directory=BUNDLE_DIR):
+    # 以網址最後一段當檔名，例如 assets/lottie/rgznX6aYYt.json
+    return os.path.join(directory, url.rstrip("/").rsplit("/", 1)[-1])
+
+
+def minify(data, precision=MINIFY_PRECISION):
+    """遞迴把浮點數四捨五入，肉眼看不出差別，但 JSON 可以小上一半左右。"""
+    if isinstance(data, float):
+        rounded = round(data, precision)
+        return int(rounded) if rounded.is_integer() else rounded
+    if isinstance(data, list):
+        return [minify(v, precision) for v in data]
+    if isinstance(data, dict):
+        return {k: minify(v, precision) for k, v in data.items()}
+    return data
+
+
+def _read_file(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logger.warning("Lottie 動畫檔損毀（%s）：%s", path, e)
+        return None
+
+
+def _read_bundle(url):
+    """背景下載過的版本優先，其次是專案內附的版本；回傳 (動畫, 是否為內附檔)。"""
+    data = _read_file(bundle_path(url, CACHE_DIR))
+    if data is not None:
+        return data, False
+    return _read_file(bundle_path(url)), True
+
+
+def _write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)  # 原子替換，其他行程不會讀到寫一半的檔案
+
+
+def fetch(url, timeout=FETCH_TIMEOUT):
+    """從網路下載動畫 JSON，失敗回傳 None。只應在背景執行緒或離線工具裡呼叫。"""
+    start = time.perf_counter()
+    try:
+        r = requests.get(url, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        logger.info("下載 Lottie 動畫失敗：%s", e)
+        metrics.observe("lottie_fetch_seconds", time.perf_counter() - start, status="network")
+        return None
+    logger.info("Lottie status code: %s", r.status_code)
+    metrics.observe("lottie_fetch_seconds", time.perf_counter() - start, status=r.status_code)
+    if r.status_code != 200:
+        return None
+    try:
+        data = r.json()
+    except ValueError:
+        return None
+    return minify(data) if MINIFY else data
+
+
+def _refresh(url):
+    try:
+        data = fetch(url)
+        if data is not None:
+            with _lock:
+                _cache[url] = data
+                _from_bundle.discard(url)
+            # 內容有更新時寫到快取目錄，下次冷啟動就不必再連網
+            if _read_file(bundle_path(url, CACHE_DIR)) != data:
+                _write_file(bundle_path(url, CACHE_DIR), data)
+    except OSError as e:
+        logger.warning("寫入 Lottie 動畫快取失敗：%s", e)
+    finally:
+        with _lock:
+            _loaded_at[url] = time.monotonic()
+            _refreshing.discard(url)
+
+
+def _schedule_refresh(url):
+    # 呼叫端已持有 _lock
+    if url in _refreshing:
+        return
+    _refreshing.add(url)
+    threading.Thread(target=_refresh, args=(url,), name="lottie-refresh", daemon=True).start()
+
+
+def get_animation(url=LOTTIE_URL):
+    """立即回傳動畫 JSON（記憶體 → 內附檔），從不等待網路；沒有可用的動畫時回傳 None。
+
+    沒有動畫或用的是內附的替代動畫時立刻、之後每隔 LOTTIE_REFRESH_SECONDS，會在背景下載新版本，
+    下一次 rerun 就會用到。
+    """
+    with _lock:
+        data = _cache.get(url)
+        if data is None and url not in _loaded_at:
+            data, from_bundle = _read_bundle(url)
+            if data is not None:
+                _cache[url] = data
+            if from_bundle:
+                _from_bundle.add(url)
+            _loaded_at[url] = time.monotonic()
+            if data is None or (from_bundle and REFRESH_SECONDS > 0):
+                _schedule_refresh(url)
+        elif url in _loaded_at:
+            age = time.monotonic() - _loaded_at[url]
+            if data is None and age > RETRY_SECONDS:
+                _schedule_refresh(url)
+            elif url in _from_bundle and REFRESH_SECONDS > 0 and age > RETRY_SECONDS:
+                _schedule_refresh(url)
+            elif data is not None and REFRESH_SECONDS > 0 and age > REFRESH_SECONDS:
+                _schedule_refresh(url)
+    return data
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    animation = fetch(LOTTIE_URL, timeout=30)
+    if animation is None:
+        raise SystemExit("❌ 無法下載動畫，請確認網路與網址")
+    _write_file(bundle_path(LOTTIE_URL), animation)
+    print(f"✅ 已寫入 {os.path.relpath(bundle_path(LOTTIE_URL))}（{os.path.getsize(bundle_path(LOTTIE_URL)) / 1024:.1f} KB）")
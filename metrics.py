@@ -0,0 +1,262 @@
+# --- 效能指標 ---
+# 記錄每次頁面 rerun、靜態資源載入、Lottie 下載、session 記憶體與暫存，以及每個 LLM 階段（延伸問題、段落草稿、最終草稿…）的
+# 首字延遲、總延遲、prompt / completion token 數、重試與錯誤次數，以 Prometheus 文字格式的直方圖、計數器與量表提供：
+#   curl http://127.0.0.1:9108/metrics
+# 另外可以把每一筆觀測值寫成 JSONL 方便離線分析。
+# 指標只包含數字與程式裡寫死的標籤（階段、模型、路徑、HTTP 狀態碼），絕不記錄任何使用者輸入或模型輸出。
+#
+# 環境變數：
+#   METRICS         1（預設）啟用，0 停用（所有記錄函式直接返回）
+#   METRICS_HOST    指標端點綁定的位址，預設 127.0.0.1（只供本機的 Prometheus / sidecar 抓取）
+#   METRICS_PORT    指標端點的埠號，預設 9108；0 代表不啟動端點
+#   METRICS_JSONL   設定檔案路徑時，每筆觀測值另外附加一行 JSON 到該檔案
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("METRICS", "1") == "1"
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))
+JSONL_PATH = os.environ.get("METRICS_JSONL", "")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+BYTE_BUCKETS = tuple(2 ** i * 1024 for i in range(2, 14))  # 4 KB ~ 8 MB
+
+# 名稱 -> (說明, 桶的上界)
+HISTOGRAMS = {
+    "streamlit_rerun_seconds": ("頁面腳本每次執行的時間（outcome：complete 正常結束、rerun 被 st.rerun 或新的操作中斷）", LATENCY_BUCKETS),
+    "streamlit_fragment_seconds": ("fragment 每次執行的時間", LATENCY_BUCKETS),
+    "asset_load_seconds": ("組出靜態資源 CSS / HTML 的時間", LATENCY_BUCKETS),
+    "lottie_fetch_seconds": ("背景下載 Lottie 動畫的時間", LATENCY_BUCKETS),
+    "groq_request_seconds": ("單一 Groq 請求的總延遲（含排隊與重試）", LATENCY_BUCKETS),
+    "groq_ttft_seconds": ("串流請求的首字延遲", LATENCY_BUCKETS),
+    "groq_prompt_tokens": ("Groq 回報的 prompt token 數", TOKEN_BUCKETS),
+    "groq_completion_tokens": ("Groq 回報的 completion token 數", TOKEN_BUCKETS),
+    "llm_stage_seconds": ("每個 LLM 階段使用者實際等待的時間（path：primary / hedge / local / failed）", LATENCY_BUCKETS),
+    "session_memory_bytes": ("每次 rerun 結束時單一 session 占用的記憶體估計值（見 session_memory.py）", BYTE_BUCKETS),
+    "session_spill_seconds": ("把閒置 session 加密寫入磁碟並移出記憶體的時間（見 session_spill.py）", LATENCY_BUCKETS),
+    "session_restore_seconds": ("使用者回來時從磁碟取回 session 的時間", LATENCY_BUCKETS),
+    "session_spill_bytes": ("寫入磁碟的 session 大小（加密後）", BYTE_BUCKETS),
+    "export_seconds": ("在背景產生一份 PDF / DOCX 下載檔的時間（見 will_export.py）", LATENCY_BUCKETS),
+    "font_subset_seconds": ("縮減 PDF 內嵌字型的時間（cache：hit 字集相同直接共用、miss 重新縮減）", LATENCY_BUCKETS),
+}
+COUNTERS = {
+    "groq_requests_total": "送出的 Groq 請求數（不含快取命中）",
+    "groq_retries_total": "Groq 請求的重試次數",
+    "groq_errors_total": "重試用盡仍失敗的 Groq 請求數（status：HTTP 狀態碼或 network）",
+    "groq_cache_hits_total": "回應快取命中、沒有送出請求的次數",
+    "structured_output_total": "JSON 模式的回應（見 structured_output.py；outcome：ok 直接通過驗證、repaired 修復後通過、failed 修復後仍失敗）",
+    "export_cache_hits_total": "按下下載時檔案已在背景產生好（或同一份草稿下載過）、不必等待的次數",
+}
+GAUGES = {
+    "sessions_resident": "狀態留在記憶體中的 session 數",
+    "sessions_spilled": "閒置中、狀態已暫存到磁碟的 session 數",
+}
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self, jsonl_path=JSONL_PATH):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (名稱, 標籤) -> Histogram
+        self._counters = {}    # (名稱, 標籤) -> 數值
+        self._gauges = {}      # (名稱, 標籤) -> 目前的值
+        self._jsonl = open(jsonl_path, "a", encoding="utf-8", buffering=1) if jsonl_path else None
+
+    def observe(self, name, value, labels):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(HISTOGRAMS[name][1])
+            histogram.observe(value)
+            self._log(name, value, labels)
+
+    def inc(self, name, amount, labels):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._log(name, amount, labels)
+
+    def set(self, name, value, labels):
+        with self._lock:
+            self._gauges[(name, labels)] = value
+            self._log(name, value, labels)
+
+    def _log(self, name, value, labels):
+        # 呼叫端已持有 _lock
+        if self._jsonl is not None:
+            self._jsonl.write(json.dumps({"ts": round(time.time(), 3), "metric": name, "value": value, **dict(labels)}) + "\n")
+
+    def render(self):
+        """Prometheus 文字格式（text/plain; version=0.0.4）。"""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+        lines = []
+        seen = set()
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {HISTOGRAMS[name][0]}")
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_number(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {COUNTERS[name]}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {GAUGES[name]}")
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_number(value):
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (k + '="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _labels(labels):
+    return tuple(sorted((k, "" if v is None else str(v)) for k, v in labels.items()))
+
+
+registry = Registry()
+
+
+# --- 記錄 ---
+def observe(name, value, **labels):
+    """記錄一筆直方圖觀測值；標籤只能是程式裡的固定值，不可放使用者內容。"""
+    if not ENABLED or value is None:
+        return
+    start_server()
+    registry.observe(name, value, _labels(labels))
+
+
+def inc(name, amount=1, **labels):
+    if not ENABLED or not amount:
+        return
+    start_server()
+    registry.inc(name, amount, _labels(labels))
+
+
+def set_gauge(name, value, **labels):
+    """設定目前的值（例如目前有幾個 session 留在記憶體中）。"""
+    if not ENABLED:
+        return
+    start_server()
+    registry.set(name, value, _labels(labels))
+
+
+@contextmanager
+def timer(name, **labels):
+    """計時區塊（不論是否丟出例外都會記錄）。"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+# 頁面腳本的 rerun：st.rerun() 以例外中斷腳本，結尾的程式不一定跑得到，
+# 所以在腳本開頭記下開始時間，若上一次執行沒有走到結尾，就在下一次開始時以 outcome="rerun" 記錄。
+# 同一個 session 的腳本都在同一條 ScriptRunner 執行緒上執行。
+_rerun = threading.local()
+
+
+def rerun_started(script):
+    pending = getattr(_rerun, "pending", None)
+    now = time.perf_counter()
+    if pending is not None:
+        observe("streamlit_rerun_seconds", now - pending[1], script=pending[0], outcome="rerun")
+    _rerun.pending = (script, now)
+
+
+def rerun_finished():
+    pending = getattr(_rerun, "pending", None)
+    if pending is not None:
+        _rerun.pending = None
+        observe("streamlit_rerun_seconds", time.perf_counter() - pending[1], script=pending[0], outcome="complete")
+
+
+# --- 指標端點 ---
+_server_lock = threading.Lock()
+_server = None
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass  # 抓取很頻繁，不寫進 log
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server():
+    """啟動（每個行程只啟動一次）指標端點；METRICS_PORT=0 時不啟動。"""
+    global _server
+    if _server is not None or not METRICS_PORT:
+        return
+    with _server_lock:
+        if _server is not None:
+            return
+        try:
+            server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _MetricsHandler)
+        except OSError as e:
+            # 同一台機器上多個 streamlit 行程時只有第一個能綁定，其餘只記錄（仍可寫 JSONL）
+            logger.warning("指標端點無法綁定 %s:%s（%s）", METRICS_HOST, METRICS_PORT, e)
+            _server = False
+            return
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        logger.info("指標端點啟動於 http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+        _server = server
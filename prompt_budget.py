@@ -0,0 +1,143 @@
+# --- Prompt 的 token 預算 ---
+# 使用者有時會貼上好幾頁文字，直接全部塞進最終 prompt 會拉長延遲，甚至超過 llama3-70b-8192 的 context。
+# 組 prompt 前先以本機 tokenizer（token_count.py）計數：
+#   1. 超過門檻的回答（不論總長是否超過預算，以免最終生成的延遲忽長忽短），同時（平行）交給小模型濃縮；很長的回答先切塊分別摘要（map），
+#      合起來仍太長再摘要一次（reduce）
+#   2. 濃縮後仍超過預算（或摘要失敗）時，依比例截短最長的幾段，保證最後的 prompt 一定放得進預算
+#
+# 環境變數：
+#   CONTEXT_WINDOW            模型的 context 長度，預設 8192
+#   MAX_COMPLETION_TOKENS     保留給回答的 token 數，預設 2048
+#   PROMPT_TOKEN_BUDGET       prompt（含 system）的上限，預設 CONTEXT_WINDOW - MAX_COMPLETION_TOKENS
+#   CONDENSE_THRESHOLD        單一回答超過幾個 token 就先濃縮，預設 600
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import groq_client
+import hedging
+import token_count
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_WINDOW = int(os.environ.get("CONTEXT_WINDOW", "8192"))
+MAX_COMPLETION_TOKENS = int(os.environ.get("MAX_COMPLETION_TOKENS", "2048"))
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", str(CONTEXT_WINDOW - MAX_COMPLETION_TOKENS)))
+CONDENSE_THRESHOLD = int(os.environ.get("CONDENSE_THRESHOLD", "600"))
+
+CONDENSE_MODEL = "llama3-8b-8192"  # 摘要用小模型，速度快
+CHUNK_TOKENS = 3000                 # map 階段每塊的大小，小模型的 context 放得下
+MAX_PARALLEL = 8
+
+# 摘要呼叫在自己的執行緒池裡平行執行（呼叫端可能本身就在 background_jobs 裡，所以不共用那個池）；
+# 各段回答與各段回答的分塊用不同的池，外層等待內層時才不會互相卡住
+_part_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL, thread_name_prefix="condense")
+_chunk_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL, thread_name_prefix="condense-chunk")
+
+
+def condense_prompt(text, target_tokens):
+    return (
+        "以下是使用者在撰寫遺囑時寫下的一段回答。請在不遺漏任何具體資訊（人名、物品、金額、日期、心願）的前提下，"
+        f"用第一人稱的繁體中文把它濃縮到大約 {target_tokens} 個字以內，只輸出濃縮後的內容。\n\n{text}"
+    )
+
+
+def split_chunks(text, max_tokens=CHUNK_TOKENS):
+    """依段落切塊，每塊不超過 max_tokens；單一段落過長時直接截斷成多塊。"""
+    chunks, current = [], ""
+    for paragraph in text.split("\n"):
+        candidate = f"{current}\n{paragraph}" if current else paragraph
+        if token_count.count_tokens(candidate) <= max_tokens:
+            current = candidate
+            continue
+        if current:
+            chunks.append(current)
+        while token_count.count_tokens(paragraph) > max_tokens:
+            head = token_count.truncate(paragraph, max_tokens) or paragraph[:max_tokens]
+            chunks.append(head)
+            paragraph = paragraph[len(head):].lstrip()
+        current = paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _summarize(text, target_tokens, api_key, session):
+    return hedging.chat(
+        condense_prompt(text, target_tokens), api_key=api_key, stage="condense",
+        model=CONDENSE_MODEL, temperature=0, session=session,
+    )
+
+
+def condense(text, api_key, target_tokens=CONDENSE_THRESHOLD // 2, session=None):
+    """把 text 濃縮到大約 target_tokens；失敗時丟出 groq_client.GroqError。"""
+    if token_count.count_tokens(text) <= target_tokens:
+        return text
+    chunks = split_chunks(text)
+    if len(chunks) == 1:
+        return _summarize(text, target_tokens, api_key, session)
+    # map：各塊平行摘要；reduce：合起來仍太長就再濃縮一次
+    per_chunk = max(100, target_tokens // len(chunks) * 2)
+    summaries = list(_chunk_executor.map(lambda chunk: _summarize(chunk, per_chunk, api_key, session), chunks))
+    combined = "\n".join(summaries)
+    if token_count.count_tokens(combined) > target_tokens:
+        combined = _summarize(combined, target_tokens, api_key, session)
+    return combined
+
+
+def _allocate(sizes, available):
+    """平均分配 available 個 token：比平均短的段落保持原樣，剩下的由較長的段落均分。"""
+    limits = list(sizes)
+    remaining = available
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    for n, i in enumerate(order):
+        share = remaining // (len(order) - n)
+        limits[i] = min(sizes[i], share)
+        remaining -= limits[i]
+    return limits
+
+
+def fit(parts, render, api_key, budget=PROMPT_TOKEN_BUDGET, system=groq_client.SYSTEM_PROMPT, session=None):
+    """讓 render(parts) 組出的 prompt 放得進 budget，回傳 (prompt, 報告)。
+
+    parts 是 prompt 中可以濃縮的文字（通常是各題回答），render(parts) 把它們組成完整的 prompt。
+    超過 CONDENSE_THRESHOLD 的部分一律先平行濃縮；仍超過預算時依比例截短，保證回傳的 prompt 不超過 budget。
+    """
+    start = time.perf_counter()
+    parts = list(parts)
+    report = {"budget": budget, "tokens_before": token_count.count_prompt(render(parts), system), "condensed": 0, "truncated": 0}
+    long_parts = [i for i, text in enumerate(parts) if token_count.count_tokens(text) > CONDENSE_THRESHOLD]
+    futures = {i: _part_executor.submit(condense, parts[i], api_key, CONDENSE_THRESHOLD // 2, session) for i in long_parts}
+    for i, future in futures.items():
+        try:
+            parts[i] = future.result()
+            report["condensed"] += 1
+        except groq_client.GroqError as e:
+            logger.warning("濃縮回答失敗，改為截短：%s", e)
+
+    # 保證：固定文字之外的空間依比例分給各段，超出的截短；tokenizer 的邊界誤差以逐次加大的餘裕修正
+    for attempt in range(10):
+        total = token_count.count_prompt(render(parts), system)
+        if total <= budget:
+            break
+        overhead = token_count.count_prompt(render([""] * len(parts)), system)
+        sizes = [token_count.count_tokens(text) for text in parts]
+        excess = total - budget + attempt * 8
+        limits = _allocate(sizes, max(0, sum(sizes) - excess))
+        for i, limit in enumerate(limits):
+            if limit < sizes[i]:
+                parts[i] = token_count.truncate(parts[i], limit)
+                report["truncated"] += 1
+        if overhead > budget:
+            logger.warning("prompt 的固定文字（%s tokens）已超過預算 %s", overhead, budget)
+            break
+
+    prompt = render(parts)
+    report["tokens_after"] = token_count.count_prompt(prompt, system)
+    report["seconds"] = time.perf_counter() - start
+    logger.info(
+        "prompt 預算：%s → %s tokens（上限 %s，濃縮 %s 段，截短 %s 段，%.2f 秒）",
+        report["tokens_before"], report["tokens_after"], budget, report["condensed"], report["truncated"], report["seconds"],
+    )
+    return prompt, report
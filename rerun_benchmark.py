@@ -0,0 +1,259 @@
+# --- 每次 rerun 的效能測試 ---
+# 以 Streamlit 的 AppTest 把每個頁面腳本從第一題走到遺囑完成，量測：
+#   rerun_seconds      每次 rerun（整頁或 fragment）的執行時間（p50 / p95 / 最大值）
+#   delta_bytes        每次 rerun 送往瀏覽器的 delta 訊息大小（protobuf 位元組數）
+#   reruns_per_will    完成一份遺囑總共執行了幾次腳本（含 st.rerun 觸發的重跑）
+#   peak_memory        走完流程期間 Python 配置記憶體的峰值（tracemalloc）與行程的峰值 RSS
+# Groq 的傳輸層換成立即回覆的假連線（call_groq 的排隊、對沖、prompt 預算等程式碼照常執行，只是不連網），
+# Lottie 動畫的網路下載也停用；回應快取、語意快取、本機模型、背景預熱與限流都關閉，每次測量做的事都一樣。
+# 注意 AppTest 不支援只重跑 fragment，fragment 內的 rerun 一律以整頁 rerun 計。
+# 每個腳本在獨立的子行程裡測量，結果寫入 JSON，可以和修改前的結果直接比較。
+#
+# 使用方式：
+#   python rerun_benchmark.py
+#   python rerun_benchmark.py --scripts ai_will5.py --walks 5
+#   ASSET_MODE=inline python rerun_benchmark.py   # 比較內嵌 data URI 的資源區塊
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ENTRY_SCRIPTS = ("app.py", "tryy.py", "a_will_2.py", "ai_will3.py", "ai_will4.py", "ai_will5.py")
+STUB_ENV = {
+    "GROQ_CACHE": "off", "SEMANTIC_CACHE": "0", "LOCAL_LLM": "0", "WARMUP": "0", "LOTTIE_REFRESH_SECONDS": "0",
+    "GROQ_RPM": "1000000", "GROQ_TPM": "1000000000",  # 假連線不受 Groq 額度限制，避免限流器的等待混進量測
+}
+MAX_INTERACTIONS = 40
+
+
+# --- 假的 Groq 連線 ---
+class StubTransport:
+    name = "stub"
+
+    def post(self, url, headers, payload, timeout):
+        prompt = payload["messages"][-1]["content"]
+        if "延伸問題" in prompt:
+            text = json.dumps({"questions": ["您希望如何安排數位遺產？", "是否有想指定的見證人？"]}, ensure_ascii=False)
+        else:
+            text = "親愛的家人，這是我的遺囑。" * 20
+            if payload.get("response_format"):
+                text = json.dumps({"paragraph": text}, ensure_ascii=False)
+        return {"choices": [{"message": {"content": text}}], "usage": {"prompt_tokens": 300, "completion_tokens": 200, "total_tokens": 500}}
+
+    @contextmanager
+    def stream_lines(self, url, headers, payload, timeout):
+        def lines():
+            for _ in range(20):
+                yield "data: " + json.dumps({"choices": [{"delta": {"content": "親愛的家人，這是我的遺囑。"}}]}, ensure_ascii=False)
+            yield "data: " + json.dumps({"choices": [], "x_groq": {"usage": {"prompt_tokens": 300, "completion_tokens": 200, "total_tokens": 500}}})
+            yield "data: [DONE]"
+        yield lines()
+
+    def get(self, url, headers, timeout):
+        pass
+
+
+def install_stubs():
+    import groq_client
+    import lottie_cache
+
+    groq_client.get_transport = StubTransport
+    lottie_cache.fetch = lambda url, timeout=None: None
+
+
+# --- 記錄每次 rerun ---
+class RerunRecorder:
+    """掛在 AppTest 的 ScriptRunner 事件上，記錄每次腳本執行的時間與送出的 delta 大小。"""
+
+    def __init__(self):
+        self.reruns = []
+        self._current = None
+
+    def install(self):
+        from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+        from streamlit.testing.v1 import local_script_runner
+
+        recorder = self
+        original_init = local_script_runner.LocalScriptRunner.__init__
+
+        def init(runner, *args, **kwargs):
+            original_init(runner, *args, **kwargs)
+            runner.on_event.connect(recorder.on_event, weak=False)
+
+        local_script_runner.LocalScriptRunner.__init__ = init
+        self._started = ScriptRunnerEvent.SCRIPT_STARTED
+        self._forward = ScriptRunnerEvent.ENQUEUE_FORWARD_MSG
+        self._stopped = {
+            ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
+            ScriptRunnerEvent.SCRIPT_STOPPED_WITH_COMPILE_ERROR,
+            ScriptRunnerEvent.SCRIPT_STOPPED_FOR_RERUN,
+            ScriptRunnerEvent.FRAGMENT_STOPPED_WITH_SUCCESS,
+        }
+
+    def on_event(self, sender, event, **kwargs):
+        now = time.perf_counter()
+        if event == self._started:
+            kind = "fragment" if kwargs.get("fragment_ids_this_run") else "full"
+            self._current = {"kind": kind, "start": now, "delta_bytes": 0, "deltas": 0}
+        elif event == self._forward and self._current is not None:
+            msg = kwargs["forward_msg"]
+            if msg.WhichOneof("type") == "delta":
+                self._current["delta_bytes"] += msg.ByteSize()
+                self._current["deltas"] += 1
+        elif event in self._stopped and self._current is not None:
+            current, self._current = self._current, None
+            current["seconds"] = now - current.pop("start")
+            self.reruns.append(current)
+
+
+# --- 子行程：走完單一腳本 ---
+def _input_widget(at):
+    for widgets in (at.text_area, at.text_input):
+        if len(widgets):
+            return widgets[0]
+    return None
+
+
+def walk(script, answers):
+    """從頭走到遺囑完成，回傳使用者操作次數；沒有完成時回傳 None。"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, script), default_timeout=60)
+    at.secrets["GROQ_API_KEY"] = "benchmark-key"
+    at.run()
+    for interaction in range(1, MAX_INTERACTIONS + 1):
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        if len(at.success):
+            return interaction
+        widget = _input_widget(at)
+        if widget is None:
+            at.run()  # 沒有輸入框（例如等待背景結果）時，像使用者重新整理一樣再跑一次
+            continue
+        widget.input(answers[min(interaction - 1, len(answers) - 1)]).run()
+        buttons = [b for b in at.button if "送出" in b.label]
+        if buttons:
+            buttons[0].click().run()
+    return None
+
+
+def run_worker(script, walks):
+    os.environ.update({k: v for k, v in STUB_ENV.items() if k not in os.environ})
+    sys.path.insert(0, ROOT)
+    install_stubs()
+    recorder = RerunRecorder()
+    recorder.install()
+    from interview_loadtest import SAMPLE_ANSWERS
+
+    result = {"script": script, "asset_mode": os.environ.get("ASSET_MODE", "static"), "walks": []}
+    tracemalloc.start()
+    for _ in range(walks):
+        first = len(recorder.reruns)
+        start = time.perf_counter()
+        try:
+            interactions = walk(script, SAMPLE_ANSWERS)
+        except RuntimeError as e:
+            result["error"] = str(e)
+            break
+        reruns = recorder.reruns[first:]
+        result["walks"].append({
+            "completed": interactions is not None,
+            "interactions": interactions,
+            "seconds": time.perf_counter() - start,
+            "reruns": reruns,
+        })
+    result["tracemalloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def run_isolated(script, walks):
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", "--scripts", script, "--walks", str(walks)]
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=ROOT)
+    if proc.returncode != 0:
+        error = (proc.stderr.strip().splitlines() or ["未知錯誤"])[-1]
+        return {"script": script, "error": error}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+# --- 彙整 ---
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(result):
+    walks = [w for w in result.get("walks", []) if w["completed"]]
+    summary = {"script": result["script"], "asset_mode": result.get("asset_mode"), "completed_walks": len(walks)}
+    if result.get("error"):
+        summary["error"] = result["error"]
+    if not walks:
+        return summary
+    # 第一次走訪含模組載入等冷啟動成本，有兩次以上時只統計之後的走訪
+    steady = walks[1:] or walks
+    reruns = [r for w in steady for r in w["reruns"]]
+    seconds = [r["seconds"] for r in reruns]
+    summary.update({
+        "reruns_per_will": statistics.mean(len(w["reruns"]) for w in steady),
+        "fragment_reruns_per_will": statistics.mean(sum(r["kind"] == "fragment" for r in w["reruns"]) for w in steady),
+        "rerun_seconds": {"p50": statistics.median(seconds), "p95": _percentile(seconds, 0.95), "max": max(seconds)},
+        "delta_bytes_per_rerun": {"mean": statistics.mean(r["delta_bytes"] for r in reruns), "max": max(r["delta_bytes"] for r in reruns)},
+        "delta_bytes_per_will": statistics.mean(sum(r["delta_bytes"] for r in w["reruns"]) for w in steady),
+        "will_seconds": statistics.median(w["seconds"] for w in steady),
+        "first_walk_seconds": walks[0]["seconds"],
+        "tracemalloc_peak_bytes": result["tracemalloc_peak_bytes"],
+        "max_rss_kb": result["max_rss_kb"],
+    })
+    return summary
+
+
+def print_table(summaries):
+    print(f"{'腳本':14s} {'rerun/份':>8s} {'p50(ms)':>8s} {'p95(ms)':>8s} {'delta/次(KB)':>12s} {'delta/份(KB)':>12s} {'峰值(MB)':>9s}")
+    for s in summaries:
+        if "rerun_seconds" not in s:
+            print(f"{s['script']:14s} ⚠️ {s.get('error', '沒有完成任何一份遺囑')}")
+            continue
+        print(
+            f"{s['script']:14s} {s['reruns_per_will']:8.1f} {s['rerun_seconds']['p50'] * 1000:8.1f} "
+            f"{s['rerun_seconds']['p95'] * 1000:8.1f} {s['delta_bytes_per_rerun']['mean'] / 1024:12.1f} "
+            f"{s['delta_bytes_per_will'] / 1024:12.1f} {s['tracemalloc_peak_bytes'] / 2**20:9.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以假的 LLM 量測各頁面腳本每次 rerun 的成本")
+    parser.add_argument("--scripts", nargs="+", default=list(ENTRY_SCRIPTS))
+    parser.add_argument("--walks", type=int, default=3, help="每個腳本完整走幾次（第一次視為暖身）")
+    parser.add_argument("--output", default="rerun_benchmark.json")
+    parser.add_argument("--raw", action="store_true", help="JSON 中保留每一次 rerun 的紀錄")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.scripts[0], args.walks), ensure_ascii=False))
+        return
+
+    results = []
+    for script in args.scripts:
+        print(f"⏱ {script} …", file=sys.stderr)
+        raw = run_isolated(script, args.walks)
+        summary = summarize(raw)
+        if args.raw:
+            summary["raw"] = raw
+        results.append(summary)
+    print_table(results)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"✅ 結果已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
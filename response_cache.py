@@ -0,0 +1,251 @@
+# --- Groq 回應快取 ---
+# 相同的 (model, messages, temperature) 直接回傳上次的結果，不再重新排隊、等待與消耗額度。
+# 兩層快取：
+#   - 記憶體：LRU + TTL
+#   - 本機 SQLite（選用）：內容以 Fernet 加密後才寫入磁碟，鍵是以密鑰做的 HMAC，
+#     不知道密鑰就無法從檔案推回任何使用者內容；HMAC 與 Fernet 的金鑰由同一個密鑰以不同標籤導出，不共用同一把
+# 每筆資料都標記所屬的 session，可以依 session 整批清除。
+#
+# 環境變數：
+#   GROQ_CACHE                    off / memory（預設）/ disk
+#   GROQ_CACHE_TTL                快取有效秒數，預設 3600
+#   GROQ_CACHE_MAX_ENTRIES        記憶體最多幾筆，預設 512
+#   GROQ_CACHE_DISK_MAX_ENTRIES   SQLite 最多幾筆，預設 5000
+#   GROQ_CACHE_PATH               SQLite 檔案位置，預設 .cache/groq_responses.sqlite3
+#   GROQ_CACHE_KEY                密鑰，至少 32 bytes 的 urlsafe base64（Fernet.generate_key() 的輸出即可）；
+#                                 未設定時每次啟動隨機產生，重新啟動後舊的磁碟快取就無法解密、等同作廢；
+#                                 格式不正確時只寫入警告並停用磁碟快取，不會讓 import 失敗
+#   GROQ_CACHE_NONDETERMINISTIC   1 時 temperature > 0 的請求也快取（預設不快取，因為每次結果本來就不同）
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # 沒有 cryptography 就不啟用磁碟快取，絕不以明文落地
+    Fernet = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_MODE = os.environ.get("GROQ_CACHE", "memory")
+CACHE_TTL = float(os.environ.get("GROQ_CACHE_TTL", "3600"))
+MAX_ENTRIES = int(os.environ.get("GROQ_CACHE_MAX_ENTRIES", "512"))
+DISK_MAX_ENTRIES = int(os.environ.get("GROQ_CACHE_DISK_MAX_ENTRIES", "5000"))
+CACHE_PATH = os.environ.get(
+    "GROQ_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "groq_responses.sqlite3"),
+)
+CACHE_NONDETERMINISTIC = os.environ.get("GROQ_CACHE_NONDETERMINISTIC", "0") == "1"
+MIN_SECRET_BYTES = 32
+
+
+def _decode_secret(value):
+    """把 GROQ_CACHE_KEY 解成位元組；格式不正確或太短時回傳 None。"""
+    try:
+        secret = base64.urlsafe_b64decode(value)
+    except ValueError:
+        return None
+    return secret if len(secret) >= MIN_SECRET_BYTES else None
+
+
+def derive_keys(secret):
+    """由同一個密鑰以不同標籤的 HMAC 導出兩把金鑰，回傳 (快取鍵用的 HMAC 金鑰, Fernet 金鑰)。"""
+    hmac_key = hmac.new(secret, b"groq-cache:hmac", hashlib.sha256).digest()
+    fernet_key = base64.urlsafe_b64encode(hmac.new(secret, b"groq-cache:fernet", hashlib.sha256).digest())
+    return hmac_key, fernet_key
+
+
+def is_cacheable(temperature):
+    # temperature 未指定時 Groq 預設為 1，同樣視為非決定性
+    if temperature is not None and temperature == 0:
+        return True
+    return CACHE_NONDETERMINISTIC
+
+
+class MemoryTier:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, expires_at, session)
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, expires_at, session):
+        with self._lock:
+            self._entries[key] = (value, expires_at, session)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def purge_session(self, session):
+        with self._lock:
+            stale = [k for k, (_, _, s) in self._entries.items() if s == session]
+            for k in stale:
+                del self._entries[k]
+            return len(stale)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class EncryptedSqliteTier:
+    def __init__(self, path, fernet, max_entries=DISK_MAX_ENTRIES):
+        self.fernet = fernet
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, session TEXT, expires_at REAL, last_used REAL, value BLOB)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_session ON responses(session)")
+            self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+
+    def get(self, key, now):
+        """回傳 (內容, session 標記)；沒有命中時回傳 None。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at, session FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                with self._conn:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        try:
+            return self.fernet.decrypt(row[0]).decode("utf-8"), row[2]
+        except InvalidToken:
+            return None  # 以其他金鑰寫入的舊資料
+
+    def put(self, key, value, expires_at, session, now):
+        token = self.fernet.encrypt(value.encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, session, expires_at, last_used, value) VALUES (?, ?, ?, ?, ?)",
+                (key, session, expires_at, now, token),
+            )
+            # LRU：超過上限時刪掉最久沒用到的
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def purge_session(self, session):
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM responses WHERE session = ?", (session,)).rowcount
+
+
+class ResponseCache:
+    def __init__(self, mode=CACHE_MODE, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.enabled = mode in ("memory", "disk")
+        configured = os.environ.get("GROQ_CACHE_KEY", "")
+        secret = _decode_secret(configured) if configured else os.urandom(MIN_SECRET_BYTES)
+        if secret is None:
+            if mode == "disk":
+                logger.warning("GROQ_CACHE_KEY 格式不正確（需為至少 32 bytes 的 urlsafe base64），改為僅使用記憶體快取")
+                mode = "memory"
+            secret = os.urandom(MIN_SECRET_BYTES)
+        self._hmac_key, fernet_key = derive_keys(secret)
+        self.memory = MemoryTier()
+        self.disk = None
+        if mode == "disk":
+            if Fernet is None:
+                logger.warning("未安裝 cryptography，GROQ_CACHE=disk 改為僅使用記憶體快取")
+            else:
+                try:
+                    self.disk = EncryptedSqliteTier(CACHE_PATH, Fernet(fernet_key))
+                except (OSError, sqlite3.Error) as e:
+                    logger.warning("無法開啟磁碟快取 %s，改為僅使用記憶體快取：%s", CACHE_PATH, e)
+        self._stats_lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "skipped": 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def make_key(self, model, messages, temperature):
+        payload = json.dumps(
+            {"model": model, "messages": messages, "temperature": temperature},
+            ensure_ascii=False, sort_keys=True,
+        )
+        return hmac.new(self._hmac_key, payload.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def _session_tag(self, session):
+        # 磁碟上也不留原始 session id
+        if session is None:
+            return None
+        return hmac.new(self._hmac_key, str(session).encode(), hashlib.sha256).hexdigest()[:32]
+
+    def get(self, model, messages, temperature):
+        """查詢快取；不適用（停用或 temperature > 0）或沒有命中時回傳 None。"""
+        if not self.enabled or not is_cacheable(temperature):
+            self._count("skipped")
+            return None
+        key = self.make_key(model, messages, temperature)
+        now = time.time()
+        value = self.memory.get(key, now)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        if self.disk is not None:
+            hit = self.disk.get(key, now)
+            if hit is not None:
+                value, tag = hit
+                self._count("disk_hits")
+                self.memory.put(key, value, now + self.ttl, tag)
+                return value
+        self._count("misses")
+        return None
+
+    def put(self, model, messages, temperature, value, session=None):
+        if not self.enabled or not is_cacheable(temperature):
+            return
+        key = self.make_key(model, messages, temperature)
+        now = time.time()
+        tag = self._session_tag(session)
+        self.memory.put(key, value, now + self.ttl, tag)
+        if self.disk is not None:
+            self.disk.put(key, value, now + self.ttl, tag, now)
+        self._count("stores")
+
+    def purge_session(self, session):
+        """刪除某個 session 寫入的所有快取（記憶體與磁碟），回傳刪除筆數。"""
+        tag = self._session_tag(session)
+        removed = self.memory.purge_session(tag)
+        if self.disk is not None:
+            removed += self.disk.purge_session(tag)
+        return removed
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        return stats
+
+
+cache = ResponseCache()
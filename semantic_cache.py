@@ -0,0 +1,185 @@
+# --- 延伸問題的語意快取 ---
+# 不同使用者的回答常常很像，得到的延伸問題也大同小異（數位遺產、受益比例…）。
+# 這裡用本機的句向量模型把「回答摘要」轉成向量，和過去的摘要比較餘弦相似度，
+# 夠接近就直接沿用當時的延伸問題，不必再呼叫 Groq。
+#
+# 只保存匿名化的資料：
+#   - 不保存摘要原文，只保存向量
+#   - 問題中若含有數字、相同的英文單字，或和回答有相同的中日韓文字片段，整組問題都不保存：
+#     受文對象（第 1 題）比對連續 2 個字（中文人名常只有 2～3 個字，例如小安、阿明），其他回答比對連續 3 個字；
+#     比對前先把訪談裡人人都會用到的詞（STOP_WORDS：希望、財產、家人、我的…）從回答中去掉，
+#     否則幾乎每一組延伸問題都會被擋下；不嘗試局部替換，寧可少存也不外流
+#
+# 模型在第一次使用時於背景載入（每個行程一次）；載入完成前的查詢一律視為未命中，不會卡住頁面。
+#
+# 環境變數：
+#   SEMANTIC_CACHE                  1（預設）啟用，0 停用
+#   SEMANTIC_CACHE_MODEL            句向量模型，預設 sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2
+#   SEMANTIC_CACHE_THRESHOLD        視為相同的最低餘弦相似度，預設 0.92
+#   SEMANTIC_CACHE_MAX_ENTRIES      最多保存幾筆，預設 2000（超過時淘汰最舊的）
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("SEMANTIC_CACHE", "1") == "1"
+MODEL_NAME = os.environ.get("SEMANTIC_CACHE_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+
+RECIPIENT_NGRAM = 2  # 受文對象的回答（INITIAL_QUESTIONS 第 1 題）
+LEAK_NGRAM = 3
+STOP_WORDS = (
+    "我的", "你的", "您的", "我們", "你們", "自己", "大家", "家人", "親人", "朋友", "孩子",
+    "女兒", "兒子", "父親", "母親", "爸爸", "媽媽", "太太", "先生", "老公", "老婆", "丈夫", "妻子",
+    "哥哥", "弟弟", "姊姊", "姐姐", "妹妹", "爺爺", "奶奶", "外公", "外婆", "孫子", "孫女",
+    "希望", "想要", "想說", "謝謝", "照顧", "處理", "安排", "保管", "交給", "留給", "分給", "平均",
+    "遺囑", "遺產", "財產", "物品", "資料", "存款", "房子", "帳號", "密碼", "數位", "心願", "故事",
+    "語氣", "風格", "溫柔", "莊嚴", "幽默",
+)
+STOP_PATTERN = re.compile("|".join(map(re.escape, sorted(STOP_WORDS, key=len, reverse=True))))
+CJK_RUN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0002ffff]+")
+LATIN_WORD = re.compile(r"[A-Za-z]{2,}")
+
+
+class _Encoder:
+    """句向量模型（mean pooling + L2 正規化）；torch / transformers 延後到載入時才 import。"""
+
+    def __init__(self, model_name):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name)
+        self.model.eval()
+
+    def encode(self, text):
+        torch = self.torch
+        inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=256)
+        with torch.inference_mode():
+            hidden = self.model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        vector = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        return torch.nn.functional.normalize(vector, dim=-1)[0]
+
+
+def _ngrams(text, n=LEAK_NGRAM, stop=False):
+    """text 中連續 n 個中日韓文字的片段，以及所有英文單字（小寫）；stop=True 時先去掉 STOP_WORDS。"""
+    if stop:
+        text = STOP_PATTERN.sub(" ", text)  # 以空白取代，片段不會跨過被去掉的詞
+    grams = {word.lower() for word in LATIN_WORD.findall(text)}
+    for run in CJK_RUN.findall(text):
+        grams.update(run[i:i + n] for i in range(len(run) - n + 1))
+    return grams
+
+
+class SemanticCache:
+    def __init__(self, model_name=MODEL_NAME, threshold=THRESHOLD, max_entries=MAX_ENTRIES, enabled=ENABLED):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._encoder = None
+        self._loading = False
+        self._lock = threading.Lock()
+        self._vectors = None   # torch tensor，形狀 (筆數, 維度)
+        self._questions = []   # 每筆對應的匿名化問題清單
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "rejected": 0, "not_ready": 0}
+
+    # --- 模型載入 ---
+    def _load(self):
+        try:
+            encoder = _Encoder(self.model_name)
+            with self._lock:
+                self._encoder = encoder
+            logger.info("語意快取模型載入完成：%s", self.model_name)
+        except Exception as e:  # 沒有網路或套件時就等同停用
+            logger.warning("語意快取模型載入失敗，停用語意快取：%s", e)
+            self.enabled = False
+
+    def warm_up(self, wait=False):
+        """載入模型（只會載入一次）；預設在背景載入並立即返回，wait=True 時在目前執行緒載入完才返回。"""
+        with self._lock:
+            if not self.enabled or self._encoder is not None or self._loading:
+                return
+            self._loading = True
+        if wait:
+            self._load()
+        else:
+            threading.Thread(target=self._load, name="semantic-cache-load", daemon=True).start()
+
+    def _ready(self):
+        if self._encoder is None:
+            self.warm_up()
+            self._stats["not_ready"] += 1
+            return False
+        return True
+
+    # --- 查詢與保存 ---
+    def lookup(self, summary):
+        """回傳可沿用的延伸問題清單，沒有夠相近的就回傳 None。"""
+        if not self.enabled or not self._ready():
+            return None
+        vector = self._encoder.encode(summary)
+        with self._lock:
+            if self._vectors is None:
+                self._stats["misses"] += 1
+                return None
+            scores = self._vectors @ vector
+            best = int(scores.argmax())
+            score = float(scores[best])
+            if score < self.threshold:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            template = self._questions[best]
+        logger.info("語意快取命中（相似度 %.3f）", score)
+        return list(template)
+
+    def _anonymize(self, questions, answers):
+        """問題和回答沒有共同片段時回傳可保存的問題清單，否則回傳 None（整組不保存）。
+
+        answers 依 INITIAL_QUESTIONS 的順序排列，第 1 個是受文對象。
+        """
+        recipient_grams = set()
+        answer_grams = set()
+        for i, answer in enumerate(answers):
+            if i == 0:
+                recipient_grams = _ngrams(answer, RECIPIENT_NGRAM, stop=True)
+            answer_grams |= _ngrams(answer, stop=True)
+        for q in questions:
+            if re.search(r"\d", q) or _ngrams(q, RECIPIENT_NGRAM) & recipient_grams or _ngrams(q) & answer_grams:
+                return None
+        return list(questions)
+
+    def store(self, summary, questions, answers):
+        """保存一筆（摘要向量 → 匿名化的延伸問題）；可能含個人資料的問題不保存。"""
+        if not self.enabled or not questions or not self._ready():
+            return
+        template = self._anonymize(questions, answers)
+        if template is None:
+            self._stats["rejected"] += 1
+            return
+        vector = self._encoder.encode(summary).unsqueeze(0)
+        torch = self._encoder.torch
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = vector
+            else:
+                self._vectors = torch.cat([self._vectors, vector])[-self.max_entries:]
+            self._questions = (self._questions + [template])[-self.max_entries:]
+            self._stats["stores"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._questions)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,90 @@
+# --- 每個 session 的記憶體用量 ---
+# 一個容器同時服務上百個 session 時，記憶體的上限取決於每個 session 留在 st.session_state 裡的東西。
+# 這裡估算一個 session 實際占用的位元組數（遞迴加總 sys.getsizeof，同一個物件只算一次；
+# 所有 session 共用的物件——模組、函式、類別、interview_engine 的 Flow 與題目——不算在任何 session 頭上），
+# 每次 rerun 記錄到指標（見 metrics.py），並提供上限檢查：超過上限的回答不接受，請使用者精簡。
+#
+# 環境變數：
+#   SESSION_MEMORY_CAP_KB   每個 session 的記憶體上限（KB），預設 2048；0 代表不限制
+import logging
+import os
+import sys
+import threading
+import types
+from concurrent.futures import Future
+
+import interview_engine
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CAP_BYTES = int(os.environ.get("SESSION_MEMORY_CAP_KB", "2048")) * 1024
+
+# 不屬於任何單一 session 的物件
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                 type(threading.Lock()), type(threading.RLock()))
+_shared_ids = set()
+
+
+def share(*objects):
+    """標記為所有 session 共用的物件（連同其內容），估算時不計入。"""
+    for obj in objects:
+        _shared_ids.add(id(obj))
+        if isinstance(obj, (tuple, list, frozenset)):
+            share(*obj)
+
+
+share(interview_engine.INITIAL_QUESTIONS, *interview_engine.FLOWS)
+
+
+def footprint(value, seen=None):
+    """value 連同它參照到的物件共占多少位元組（共用物件不計）。"""
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [value]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or id(obj) in _shared_ids or isinstance(obj, _SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, Future):
+            # 只算結果本身；執行緒池的內部狀態不屬於 session
+            if obj.done() and not obj.cancelled() and obj.exception() is None:
+                stack.append(obj.result())
+        else:
+            slots = getattr(type(obj), "__slots__", ())
+            stack.extend(getattr(obj, name) for name in slots if hasattr(obj, name))
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+    return total
+
+
+def session_footprint(session_state):
+    """回傳 (總位元組數, {key: 位元組數})。"""
+    seen = set()
+    by_key = {key: footprint(session_state[key], seen) for key in list(session_state.keys())}
+    return sum(by_key.values()), by_key
+
+
+def report(session_state, script):
+    """估算並記錄這個 session 的記憶體用量（每次 rerun 呼叫一次），回傳總位元組數。"""
+    total, by_key = session_footprint(session_state)
+    metrics.observe("session_memory_bytes", total, script=script)
+    if CAP_BYTES and total > CAP_BYTES:
+        largest = sorted(by_key, key=by_key.get, reverse=True)[:3]
+        logger.warning("session 記憶體 %.0f KB 超過上限 %.0f KB（最大的項目：%s）", total / 1024, CAP_BYTES / 1024, ", ".join(map(str, largest)))
+    return total
+
+
+def fits(session_state, extra=""):
+    """再加入 extra 後是否仍在上限內（不限制時一律為 True）。"""
+    if not CAP_BYTES:
+        return True
+    total, _ = session_footprint(session_state)
+    return total + footprint(extra) <= CAP_BYTES
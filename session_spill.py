@@ -0,0 +1,445 @@
+# --- 閒置 session 暫存到磁碟 ---
+# 使用者常常寫到一半就離開很久，分頁沒關，Streamlit 的 session 狀態就一直留在記憶體裡。
+# 這裡記錄每個 session 最後一次操作的時間，背景執行緒定期找出閒置超過 SESSION_IDLE_SECONDS 的 session，
+# 標記後請該 session 重新執行一次頁面；移出一律在該 session 自己的腳本執行緒上、頁面畫完之後進行（release()）：
+# 把應用程式狀態（SPILL_KEYS：訪談內容、背景工作的結果、各種報告）以 Fernet 加密後寫進本機 SQLite，並從記憶體移除。
+# 背景執行緒從不直接改動 session 狀態。使用者回來、頁面（或 fragment）重新執行時，resume() 會先從磁碟取回，頁面感覺不到差別。
+# 連線中斷（筆電休眠、網路切換）的 session 仍由 Streamlit 保留等待重新連線，同樣會被移出、資料也會保留；
+# 只有 Streamlit 已經不再保留的 session，才會刪除磁碟上的資料。
+# 這樣容器的記憶體只跟著正在作答的人數增加，而不是開著的分頁數。
+#
+# 只有可以完整還原的值才會移出：Interview（見 Interview.snapshot）、已完成的 Future（保存結果）、
+# 以及 JSON 可表示的值；還在背景執行的 Future 代表這個 session 其實沒有閒置，這一輪先不處理。
+# widget 的值（例如輸入到一半的回答）由 Streamlit 管理，留在記憶體中。
+# 與回應快取相同，沒有 cryptography 時不啟用（絕不以明文落地）；磁碟上的鍵是以密鑰做的 HMAC，不留 session id，
+# HMAC 與 Fernet 的金鑰由同一個密鑰以不同標籤導出。
+# session 只存在於建立它的行程，每個行程各用一個 SQLite 檔（檔名加上 PID），行程結束時刪除；
+# 同一台主機上的其他 Streamlit 行程或重新啟動的 worker 不會動到彼此的資料。
+#
+# 環境變數：
+#   SESSION_SPILL            1（預設）啟用，0 停用
+#   SESSION_IDLE_SECONDS     閒置多久後移到磁碟，預設 900
+#   SESSION_SWEEP_SECONDS    背景檢查的間隔，預設 60
+#   SESSION_SPILL_PATH       SQLite 檔案位置，預設 .cache/sessions.sqlite3；實際檔名會加上 PID，例如 sessions.1234.sqlite3
+#   SESSION_SPILL_KEY        密鑰，至少 32 bytes 的 urlsafe base64（Fernet.generate_key() 的輸出即可）；
+#                            未設定時每次啟動隨機產生（session 本來就不會跨行程存活），格式不正確時寫入警告並改用隨機密鑰
+#
+# 量測：
+#   python session_spill.py --sessions 2000   # 以模擬的完整訪談量測移出／取回的延遲與檔案大小
+import atexit
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import background_jobs
+import interview_engine
+import metrics
+
+try:
+    from cryptography.fernet import Fernet
+except ImportError:
+    Fernet = None
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("SESSION_SPILL", "1") == "1"
+IDLE_SECONDS = float(os.environ.get("SESSION_IDLE_SECONDS", "900"))
+SWEEP_SECONDS = float(os.environ.get("SESSION_SWEEP_SECONDS", "60"))
+SPILL_PATH = os.environ.get(
+    "SESSION_SPILL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "sessions.sqlite3"),
+)
+SPILL_KEYS = (
+    "interview", "session_id", "current_user_input", "trigger_next",
+    "followup_future", "section_futures", "prompt_budget_report", "stt_report", "llm_timing", "last_voice_clip",
+    "draft_failed",
+)
+MIN_SECRET_BYTES = 32
+
+
+class _Busy(Exception):
+    """session 還有背景工作在執行，不能移出。"""
+
+
+# --- 編碼：只接受能完整還原的值 ---
+def _encode(value):
+    if isinstance(value, interview_engine.Interview):
+        return {"i": value.snapshot()}
+    if isinstance(value, Future):
+        if not value.done():
+            raise _Busy
+        return {"f": _encode(background_jobs.result_or_none(value))}
+    if isinstance(value, dict):
+        if not all(isinstance(k, str) for k in value):
+            raise TypeError("dict 的鍵必須是字串")
+        return {"d": {k: _encode(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {"l": [_encode(v) for v in value]}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return {"v": value}
+    raise TypeError(f"無法暫存 {type(value).__name__}")
+
+
+def _decode(data):
+    kind, value = next(iter(data.items()))
+    if kind == "i":
+        return interview_engine.Interview.restore(value)
+    if kind == "f":
+        future = Future()
+        future.set_result(_decode(value))
+        return future
+    if kind == "d":
+        return {k: _decode(v) for k, v in value.items()}
+    if kind == "l":
+        return [_decode(v) for v in value]
+    return value
+
+
+# --- 加密的 SQLite ---
+def process_path(path=SPILL_PATH, pid=None):
+    """這個行程專用的 SQLite 檔：在副檔名前加上 PID。"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid() if pid is None else pid}{ext}"
+
+
+def derive_keys(secret):
+    """由同一個密鑰以不同標籤的 HMAC 導出兩把金鑰，回傳 (磁碟鍵用的 HMAC 金鑰, Fernet 金鑰)。"""
+    hmac_key = hmac.new(secret, b"session-spill:hmac", hashlib.sha256).digest()
+    fernet_key = base64.urlsafe_b64encode(hmac.new(secret, b"session-spill:fernet", hashlib.sha256).digest())
+    return hmac_key, fernet_key
+
+
+class SpillStore:
+    def __init__(self, path, fernet, hmac_key):
+        self.path = path
+        self.fernet = fernet
+        self._hmac_key = hmac_key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, spilled_at REAL, value BLOB)")
+            # 檔案只屬於這個 PID：留下來的資料來自同 PID 但已結束的行程，它的 session 都已經不存在
+            self._conn.execute("DELETE FROM sessions")
+
+    def _key(self, session):
+        return hmac.new(self._hmac_key, str(session).encode(), hashlib.sha256).hexdigest()
+
+    def put(self, session, values):
+        """加密寫入，回傳寫入的位元組數。"""
+        token = self.fernet.encrypt(json.dumps(values, ensure_ascii=False).encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (key, spilled_at, value) VALUES (?, ?, ?)",
+                (self._key(session), time.time(), token),
+            )
+        return len(token)
+
+    def take(self, session):
+        """取出並刪除；沒有資料時回傳 None。"""
+        key = self._key(session)
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM sessions WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+        if row is None:
+            return None
+        return json.loads(self.fernet.decrypt(row[0]).decode("utf-8"))
+
+    def delete(self, session):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE key = ?", (self._key(session),))
+
+    def close(self):
+        """關閉連線並刪除檔案（行程結束時呼叫）。"""
+        with self._lock:
+            self._conn.close()
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            try:
+                os.remove(self.path + suffix)
+            except FileNotFoundError:
+                pass
+
+
+def _load_secret():
+    configured = os.environ.get("SESSION_SPILL_KEY", "")
+    if configured:
+        try:
+            secret = base64.urlsafe_b64decode(configured)
+        except ValueError:
+            secret = b""
+        if len(secret) >= MIN_SECRET_BYTES:
+            return secret
+        logger.warning("SESSION_SPILL_KEY 格式不正確（需為至少 32 bytes 的 urlsafe base64），改用隨機密鑰")
+    return os.urandom(MIN_SECRET_BYTES)
+
+
+def _open_store():
+    if not ENABLED:
+        return None
+    if Fernet is None:
+        logger.warning("未安裝 cryptography，閒置的 session 不會暫存到磁碟")
+        return None
+    hmac_key, fernet_key = derive_keys(_load_secret())
+    path = process_path()
+    try:
+        store = SpillStore(path, Fernet(fernet_key), hmac_key)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("無法開啟 %s，閒置的 session 不會暫存到磁碟：%s", path, e)
+        return None
+    atexit.register(store.close)
+    return store
+
+
+# --- 每個 session 的狀態 ---
+class _Entry:
+    __slots__ = ("state", "last_active", "spilled", "evict", "lock")
+
+    def __init__(self, state):
+        self.state = state
+        self.last_active = time.monotonic()
+        self.spilled = False
+        self.evict = False  # 已請 session 重新執行，下一次執行結束時移出
+        self.lock = threading.Lock()  # 移出與取回不會同時進行
+
+
+class SessionSpiller:
+    def __init__(self, store, idle_seconds=IDLE_SECONDS, keys=SPILL_KEYS, is_alive=lambda session: True,
+                 request_rerun=lambda session: None):
+        self.store = store
+        self.is_alive = is_alive  # session 是否還存在；Streamlit 不再保留後在下一輪檢查時放掉參照與磁碟上的資料
+        self.request_rerun = request_rerun  # 請 session 重新執行頁面，讓移出在它自己的腳本執行緒上進行
+        self.idle_seconds = idle_seconds
+        self.keys = keys
+        self._entries = {}  # session -> _Entry
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def touch(self, session, state):
+        """頁面開始執行：記錄時間，已經移到磁碟的狀態先取回 state。在 session 的腳本執行緒上呼叫。"""
+        with self._lock:
+            entry = self._entries.get(session)
+            if entry is None or entry.state is not state:
+                entry = self._entries[session] = _Entry(state)
+        with entry.lock:
+            if not entry.evict:  # 為了移出而請求的這次執行不算使用者的動作
+                entry.last_active = time.monotonic()
+            if entry.spilled:
+                self._restore(session, entry, state)
+        self._start_sweeper()
+
+    def _restore(self, session, entry, state):
+        start = time.perf_counter()
+        try:
+            values = self.store.take(session) or {}
+        except Exception as e:
+            # 讀不回來時與全新的 session 一樣從頭開始，不讓頁面出錯
+            logger.warning("無法取回暫存的 session：%s", e)
+            values = {}
+        for key, value in values.items():
+            state[key] = _decode(value)
+        entry.spilled = False
+        metrics.observe("session_restore_seconds", time.perf_counter() - start)
+        self._report()
+
+    def _spill(self, session, entry, state):
+        start = time.perf_counter()
+        values = {}
+        for key in self.keys:
+            if key not in state:
+                continue
+            try:
+                values[key] = _encode(state[key])
+            except TypeError:
+                continue  # 無法還原的值留在記憶體中
+        if not values:
+            return
+        size = self.store.put(session, values)
+        for key in values:
+            try:
+                del state[key]
+            except KeyError:
+                pass
+        entry.spilled = True
+        metrics.observe("session_spill_seconds", time.perf_counter() - start)
+        metrics.observe("session_spill_bytes", size)
+
+    def release(self, session, state, now=None):
+        """頁面執行結束：session 已被標記閒置時，在這裡（session 的腳本執行緒上）移到磁碟。回傳是否移出。"""
+        with self._lock:
+            entry = self._entries.get(session)
+        if entry is None or entry.state is not state or not entry.evict:
+            return False
+        now = time.monotonic() if now is None else now
+        with entry.lock:
+            entry.evict = False
+            if entry.spilled or now - entry.last_active < self.idle_seconds:
+                return False
+            try:
+                self._spill(session, entry, state)
+            except _Busy:
+                pass  # 背景工作還在執行，下一輪檢查再試
+            except Exception as e:
+                logger.warning("暫存閒置 session 失敗：%s", e)
+        self._report()
+        return entry.spilled
+
+    def sweep(self, now=None):
+        """標記閒置超過 idle_seconds 的 session 並請它們重新執行，回傳這一輪標記幾個。不會改動 session 狀態。"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entries = list(self._entries.items())
+        marked = 0
+        for session, entry in entries:
+            if not self.is_alive(session):
+                with self._lock:
+                    if self._entries.get(session) is entry:
+                        del self._entries[session]
+                if entry.spilled:
+                    self.store.delete(session)
+                continue
+            with entry.lock:
+                if entry.spilled or entry.evict or now - entry.last_active < self.idle_seconds:
+                    continue
+                entry.evict = True
+            try:
+                self.request_rerun(session)
+                marked += 1
+            except Exception as e:
+                entry.evict = False
+                logger.warning("無法請閒置的 session 重新執行：%s", e)
+        self._report()
+        return marked
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._entries.values())
+        spilled = sum(entry.spilled for entry in entries)
+        return {"resident": len(entries) - spilled, "spilled": spilled}
+
+    def _report(self):
+        stats = self.stats()
+        metrics.set_gauge("sessions_resident", stats["resident"])
+        metrics.set_gauge("sessions_spilled", stats["spilled"])
+
+    def _start_sweeper(self):
+        if self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_forever, name="session-spill", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(SWEEP_SECONDS)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning("閒置 session 檢查失敗：%s", e)
+
+
+def _session_info(session):
+    from streamlit import runtime
+
+    if not runtime.exists():
+        return None
+    # 不用 is_active_session：連線中斷的 session 不算 active，但 Streamlit 仍保留它等待重新連線
+    return runtime.get_instance()._session_mgr.get_session_info(session)
+
+
+def _session_alive(session):
+    from streamlit import runtime
+
+    return not runtime.exists() or _session_info(session) is not None
+
+
+def _request_rerun(session):
+    from streamlit import runtime
+
+    info = _session_info(session)
+    if info is None:
+        return
+    # AppSession 只能在 Streamlit 的事件迴圈上操作；不帶 client_state 時沿用目前的 widget 狀態
+    loop = runtime.get_instance()._get_async_objs().eventloop
+    loop.call_soon_threadsafe(info.session.request_rerun, None)
+
+
+_store = _open_store()
+spiller = SessionSpiller(_store, is_alive=_session_alive, request_rerun=_request_rerun) if _store is not None else None
+
+
+def resume():
+    """每次頁面或 fragment 執行時先呼叫：記錄活動時間，並取回已移到磁碟的狀態。"""
+    if spiller is None:
+        return
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    # ctx.session_state 是每個 ScriptRunner 各自建立的包裝，執行結束就會被釋放；
+    # 底下的 SessionState 才是跟著 session 存活的那一份
+    spiller.touch(ctx.session_id, ctx.session_state._state)
+
+
+def release():
+    """頁面執行到結尾時呼叫：被標記為閒置的 session 在畫面畫完後移到磁碟。"""
+    if spiller is None:
+        return
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    spiller.release(ctx.session_id, ctx.session_state._state)
+
+
+# --- 量測 ---
+def main():
+    import argparse
+    import statistics
+    import tempfile
+
+    from interview_loadtest import SAMPLE_ANSWERS
+
+    parser = argparse.ArgumentParser(description="量測閒置 session 移到磁碟與取回的延遲")
+    parser.add_argument("--sessions", type=int, default=1000)
+    args = parser.parse_args()
+    if Fernet is None:
+        raise SystemExit("需要 cryptography")
+
+    hmac_key, fernet_key = derive_keys(os.urandom(MIN_SECRET_BYTES))
+    with tempfile.TemporaryDirectory() as tmp:
+        bench = SessionSpiller(SpillStore(os.path.join(tmp, "sessions.sqlite3"), Fernet(fernet_key), hmac_key), idle_seconds=0)
+        states = []
+        for i in range(args.sessions):
+            state = dict(interview=interview_engine.run(interview_engine.CannedLLM(), SAMPLE_ANSWERS), session_id=f"bench-{i}")
+            bench.touch(state["session_id"], state)
+            states.append(state)
+
+        bench.sweep(now=time.monotonic() + 1)
+        start = time.perf_counter()
+        for state in states:
+            bench.release(state["session_id"], state, now=time.monotonic() + 1)
+        spill_seconds = time.perf_counter() - start
+        print(f"移出 {args.sessions} 個 session：{spill_seconds:.2f} 秒（每個 {spill_seconds / args.sessions * 1e3:.2f} ms），{bench.stats()}")
+
+        restore = []
+        for i, state in enumerate(states):
+            start = time.perf_counter()
+            bench.touch(f"bench-{i}", state)
+            restore.append(time.perf_counter() - start)
+        print(f"取回：p50 {statistics.median(restore) * 1e3:.2f} ms，最大 {max(restore) * 1e3:.2f} ms，{bench.stats()}")
+        print(f"磁碟檔案：{os.path.getsize(os.path.join(tmp, 'sessions.sqlite3')) / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
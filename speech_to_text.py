@@ -0,0 +1,123 @@
+# --- 語音輸入：本機 CPU 語音轉文字 ---
+# 使用 transformers 的 Whisper 系列模型，在本機 CPU 上把錄音轉成文字。
+# 模型每個行程只載入一次，所有 session 共用；torch / transformers 延後到第一次使用時才 import。
+# 錄音會先經過 audio_preprocess（解碼、16 kHz 單聲道、切除靜音）。
+#
+# 推論後端（STT_BACKEND）：
+#   torch       fp32 PyTorch（預設）
+#   torch-int8  PyTorch 動態 int8 量化（Linear 層），CPU 上通常快 1.5～2 倍、記憶體較省
+#   onnx        ONNX Runtime（需要另外安裝 optimum[onnxruntime]，第一次載入時會自動匯出 ONNX）
+# 各後端與模型大小的比較請用 stt_benchmark.py 實測。
+#
+# 環境變數：
+#   STT_MODEL      語音模型，預設 openai/whisper-small
+#   STT_BACKEND    推論後端，預設 torch
+#   STT_LANGUAGE   辨識語言，預設 zh
+import logging
+import os
+import threading
+import time
+
+import audio_preprocess
+
+logger = logging.getLogger(__name__)
+
+STT_MODEL = os.environ.get("STT_MODEL", "openai/whisper-small")
+STT_BACKEND = os.environ.get("STT_BACKEND", "torch")
+STT_LANGUAGE = os.environ.get("STT_LANGUAGE", "zh")
+BACKENDS = ("torch", "torch-int8", "onnx")
+SAMPLING_RATE = audio_preprocess.SAMPLING_RATE
+CHUNK_LENGTH_S = 30  # 超過 30 秒的錄音分段辨識
+
+_lock = threading.Lock()
+_pipelines = {}  # (後端, 模型) -> pipeline
+
+
+def load_pipeline(backend, model_name):
+    """依指定後端建立語音辨識 pipeline（不快取，一般請用 get_pipeline）。"""
+    from transformers import AutoProcessor, pipeline
+
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的 STT_BACKEND：{backend}（可用：{', '.join(BACKENDS)}）")
+    if backend == "torch":
+        return pipeline("automatic-speech-recognition", model=model_name, device="cpu", chunk_length_s=CHUNK_LENGTH_S)
+
+    processor = AutoProcessor.from_pretrained(model_name)
+    if backend == "torch-int8":
+        import torch
+        from transformers import AutoModelForSpeechSeq2Seq
+
+        model = AutoModelForSpeechSeq2Seq.from_pretrained(model_name)
+        model.eval()
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        try:
+            from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+        except ImportError as e:
+            raise ImportError("STT_BACKEND=onnx 需要安裝 optimum[onnxruntime]") from e
+        model = ORTModelForSpeechSeq2Seq.from_pretrained(model_name, export=True)
+    return pipeline(
+        "automatic-speech-recognition",
+        model=model,
+        tokenizer=processor.tokenizer,
+        feature_extractor=processor.feature_extractor,
+        device="cpu",
+        chunk_length_s=CHUNK_LENGTH_S,
+    )
+
+
+def get_pipeline(backend=STT_BACKEND, model_name=STT_MODEL):
+    """取得（必要時載入）整個行程共用的語音辨識 pipeline。"""
+    key = (backend, model_name)
+    if key not in _pipelines:
+        with _lock:
+            if key not in _pipelines:
+                start = time.perf_counter()
+                _pipelines[key] = load_pipeline(backend, model_name)
+                logger.info("語音模型 %s（%s）載入完成（%.1f 秒）", model_name, backend, time.perf_counter() - start)
+    return _pipelines[key]
+
+
+def warm_up(backend=STT_BACKEND, model_name=STT_MODEL):
+    """載入模型、tokenizer 與特徵擷取器，並以一秒靜音跑一次推論，讓第一段真正的錄音不必等待。"""
+    import numpy as np
+
+    asr = get_pipeline(backend, model_name)
+    asr(
+        {"raw": np.zeros(SAMPLING_RATE, dtype=np.float32), "sampling_rate": SAMPLING_RATE},
+        generate_kwargs={"language": STT_LANGUAGE, "task": "transcribe"},
+    )
+
+
+def transcribe(audio_bytes, backend=STT_BACKEND, model_name=STT_MODEL):
+    """把一段錄音轉成文字，回傳 (文字, 報告)。
+
+    錄音先經 audio_preprocess 解碼、重新取樣並切除靜音，只有語音片段會送進模型；
+    報告含錄音長度、丟掉的靜音秒數、辨識耗時與即時率（RTF）。
+    """
+    start = time.perf_counter()
+    audio, report = audio_preprocess.preprocess(audio_bytes)
+    text = ""
+    infer_start = time.perf_counter()
+    if len(audio):
+        asr = get_pipeline(backend, model_name)
+        infer_start = time.perf_counter()
+        result = asr(
+            {"raw": audio, "sampling_rate": SAMPLING_RATE},
+            generate_kwargs={"language": STT_LANGUAGE, "task": "transcribe"},
+        )
+        text = result["text"].strip()
+    end = time.perf_counter()
+    audio_seconds = report["audio_seconds"]
+    report.update({
+        "latency": end - start,
+        "inference_seconds": end - infer_start,
+        "rtf": (end - infer_start) / audio_seconds if audio_seconds else None,
+        "backend": backend,
+    })
+    logger.info(
+        "語音轉文字（%s）：錄音 %.1f 秒（切除靜音 %.1f 秒，%d 段），耗時 %.2f 秒，RTF %.2f",
+        backend, audio_seconds, report["dropped_seconds"], report["segments"],
+        report["latency"], report["rtf"] or 0.0,
+    )
+    return text, report
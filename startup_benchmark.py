@@ -0,0 +1,124 @@
+# --- 冷啟動效能測試 ---
+# 對每個頁面腳本量測冷啟動（全新的 Python 行程）所需的時間：
+#   import          腳本最上層 import 敘述的耗時
+#   first_render    從行程啟動到第一次執行腳本完畢（頁面第一次繪製完成）
+#   first_interactive  從行程啟動到背景預熱（warmup.py）全部完成，第一個操作不必再等連線或模型
+#
+# 腳本以 Streamlit 的 AppTest 在同一個行程內執行（量的是伺服器端，不含瀏覽器繪製）；
+# API 金鑰取自環境變數 GROQ_API_KEY，沒有設定時用假金鑰（連線預熱仍會實際連到 api.groq.com）。
+#
+# 使用方式：
+#   python startup_benchmark.py
+#   python startup_benchmark.py --scripts ai_will5.py app.py --repeat 5
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ENTRY_SCRIPTS = ("app.py", "tryy.py", "a_will_2.py", "ai_will3.py", "ai_will4.py", "ai_will5.py")
+
+
+def _top_level_imports(path):
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    imports = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return compile(ast.Module(body=imports, type_ignores=[]), path, "exec")
+
+
+# --- 子行程：量測單一腳本 ---
+def run_worker(script, t0, interactive_timeout):
+    path = os.path.join(ROOT, script)
+    sys.path.insert(0, ROOT)
+    result = {"script": script, "interpreter": time.time() - t0}
+
+    start = time.perf_counter()
+    exec(_top_level_imports(path), {"__name__": "__startup_benchmark__"})
+    result["import"] = time.perf_counter() - start
+
+    from streamlit.testing.v1 import AppTest
+
+    import warmup
+
+    at = AppTest.from_file(path, default_timeout=interactive_timeout)
+    at.secrets["GROQ_API_KEY"] = os.environ.get("GROQ_API_KEY", "benchmark-key")
+    at.run()
+    result["first_render"] = time.time() - t0
+    if at.exception:
+        result["error"] = at.exception[0].message
+    warmup.wait(interactive_timeout)
+    result["first_interactive"] = time.time() - t0
+    result["warmup"] = warmup.status()
+    return result
+
+
+def run_isolated(script, interactive_timeout):
+    t0 = time.time()
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "--worker", str(t0),
+        "--scripts", script, "--interactive-timeout", str(interactive_timeout),
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=ROOT)
+    if proc.returncode != 0:
+        error = (proc.stderr.strip().splitlines() or ["未知錯誤"])[-1]
+        return {"script": script, "error": error}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def summarize(runs):
+    ok = [r for r in runs if "first_render" in r]
+    if not ok:
+        return runs[-1]
+    summary = {"script": ok[0]["script"], "runs": len(ok)}
+    for key in ("interpreter", "import", "first_render", "first_interactive"):
+        summary[key] = statistics.median(r[key] for r in ok)
+    summary["warmup"] = ok[-1].get("warmup", {})
+    errors = [r["error"] for r in runs if r.get("error")]
+    if errors:
+        summary["error"] = errors[-1]
+    return summary
+
+
+def print_table(results):
+    print(f"{'腳本':14s} {'直譯器(s)':>10s} {'import(s)':>10s} {'首次繪製(s)':>12s} {'可互動(s)':>10s}")
+    for r in results:
+        if "first_render" not in r:
+            print(f"{r['script']:14s} ⚠️ {r.get('error')}")
+            continue
+        print(
+            f"{r['script']:14s} {r['interpreter']:10.2f} {r['import']:10.2f} "
+            f"{r['first_render']:12.2f} {r['first_interactive']:10.2f}"
+        )
+        if r.get("error"):
+            print(f"{'':14s} ⚠️ {r['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測各頁面腳本的冷啟動時間")
+    parser.add_argument("--scripts", nargs="+", default=list(ENTRY_SCRIPTS))
+    parser.add_argument("--repeat", type=int, default=3, help="每個腳本冷啟動幾次（取中位數）")
+    parser.add_argument("--interactive-timeout", type=float, default=120.0)
+    parser.add_argument("--output", default="startup_benchmark.json")
+    parser.add_argument("--worker", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(run_worker(args.scripts[0], args.worker, args.interactive_timeout), ensure_ascii=False))
+        return
+
+    results = []
+    for script in args.scripts:
+        print(f"⏱ {script} …", file=sys.stderr)
+        results.append(summarize([run_isolated(script, args.interactive_timeout) for _ in range(args.repeat)]))
+    print_table(results)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"✅ 結果已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
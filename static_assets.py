@@ -0,0 +1,368 @@
+# --- 靜態資源 ---
+# 背景圖片與音樂不再每次 rerun 轉成 base64 塞進 st.markdown，而是以網址提供，瀏覽器只下載一次。
+# static 模式下 Streamlit 會公開 static/ 底下的所有檔案，所以 static/ 只放頁面用到的原始檔（SOURCE_FILES）
+# 與 build_assets.py 的產出（static/build/）；沒有頁面使用的檔案（例如 background1.jpg）留在 assets/。
+# server 模式只提供 SOURCE_FILES 與 static/build/manifest.json 列出的檔案；assets/ 裡的錄音（stt_clips）、字型等從不對外提供。
+#
+# 三種模式（ASSET_MODE）：
+#   static（預設）  由 Streamlit 內建的靜態檔案服務提供（.streamlit/config.toml 的 server.enableStaticServing），
+#                   網址為相對路徑 app/static/<檔名>?v=<內容雜湊>，和頁面同源、同協定，
+#                   在 Streamlit Cloud、https、反向代理後面都能直接使用；檔案改變網址就改變，支援 HTTP Range
+#   server          由這個行程內的小型 HTTP 伺服器提供（需要另外開放一個埠）：
+#                     - 網址帶內容雜湊（例如 /assets/echoofsadness.3f2a9c1b7e4d.mp3）
+#                     - Cache-Control: immutable + 一年 max-age
+#                     - 文字類檔案（json/css/svg）依 Accept-Encoding 提供 brotli / gzip
+#                     - 支援 HTTP Range，<audio> 可以邊下載邊播放、任意拖曳
+#   inline          退回 data URI，但每個行程只編碼一次
+#
+# 環境變數：
+#   ASSET_MODE        static（預設）、server 或 inline
+#   ASSET_HOST        server 模式的綁定位址，預設 127.0.0.1
+#   ASSET_PORT        server 模式的埠號，預設 8502
+#   ASSET_PUBLIC_URL  server 模式下瀏覽器看到的網址前綴，放在反向代理後面時要設定，預設 http://localhost:<埠號>
+import base64
+import functools
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+
+try:
+    import brotli  # 選用，有安裝才提供 br 編碼
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")  # Streamlit 靜態檔案服務的資料夾
+BUILD_MANIFEST_PATH = os.path.join(ASSET_DIR, "build", "manifest.json")  # 由 build_assets.py 產生
+SOURCE_FILES = ("background.jpg", "echoofsadness.mp3")  # 頁面直接使用的原始檔，也是 build_assets.py 的來源
+STATIC_URL = "app/static"
+ASSET_MODE = os.environ.get("ASSET_MODE", "static")
+ASSET_HOST = os.environ.get("ASSET_HOST", "127.0.0.1")
+ASSET_PORT = int(os.environ.get("ASSET_PORT", "8502"))
+ASSET_PUBLIC_URL = os.environ.get("ASSET_PUBLIC_URL", f"http://localhost:{ASSET_PORT}").rstrip("/")
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+CHUNK_SIZE = 64 * 1024
+
+mimetypes.add_type("audio/mpeg", ".mp3")
+mimetypes.add_type("audio/ogg", ".opus")
+mimetypes.add_type("audio/mp4", ".m4a")
+mimetypes.add_type("image/webp", ".webp")
+
+
+class _Asset:
+    __slots__ = ("path", "name", "digest", "hashed_name", "etag", "mime", "size", "encoded")
+
+    def __init__(self, path, name):
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(name)
+        self.path = path
+        self.name = name
+        self.digest = digest
+        self.hashed_name = f"{stem}.{digest}{ext}"
+        self.etag = f'"{digest}"'
+        self.mime = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.size = len(data)
+        # 只有文字類檔案才預先壓縮；mp3/jpg 本身已壓縮，再 gzip 沒有意義
+        self.encoded = {}
+        if self.mime.startswith(COMPRESSIBLE_TYPES):
+            self.encoded["gzip"] = gzip.compress(data, compresslevel=9)
+            if brotli is not None:
+                self.encoded["br"] = brotli.compress(data)
+
+
+_lock = threading.Lock()
+_assets = None         # 原始相對路徑 -> _Asset
+_by_hashed_name = None  # 雜湊檔名 -> _Asset
+_server = None
+_data_uris = {}
+_build_manifest = None
+
+
+@functools.lru_cache(maxsize=None)
+def _read_build_manifest():
+    """讀取 build_assets.py 寫出的 manifest（每個行程一次）；沒有建置過或內容損毀時回傳 None。"""
+    try:
+        with open(BUILD_MANIFEST_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError as e:
+        logger.warning("static/build/manifest.json 格式錯誤（%s），改用原始檔；請重新執行 build_assets.py", e)
+        return None
+    if not isinstance(data, dict):
+        logger.warning("static/build/manifest.json 格式錯誤，改用原始檔；請重新執行 build_assets.py")
+        return None
+    return data
+
+
+def _public_names():
+    """可以對外提供的檔案：原始檔與 manifest 列出的建置產出。"""
+    names = list(SOURCE_FILES)
+    build = _read_build_manifest()
+    if build:
+        for kind in ("background", "audio"):
+            names.extend(entry["file"] for entry in build.get(kind, ()) if isinstance(entry, dict) and "file" in entry)
+    return names
+
+
+def _load_manifest():
+    global _assets, _by_hashed_name
+    with _lock:
+        if _assets is None:
+            assets = {}
+            for name in _public_names():
+                path = os.path.normpath(os.path.join(ASSET_DIR, name))
+                # manifest 是 commit 進來的檔案，仍確認不會指到 static/ 以外
+                if not path.startswith(ASSET_DIR + os.sep) or not os.path.isfile(path):
+                    continue
+                assets[name] = _Asset(path, name)
+            _by_hashed_name = {
+                a.hashed_name: a for a in assets.values()
+            }
+            _assets = assets
+    return _assets
+
+
+class _AssetHandler(BaseHTTPRequestHandler):
+    server_version = "WillAssets/1.0"
+
+    def log_message(self, format, *args):
+        logger.debug("asset %s", format % args)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        path = self.path.split("?", 1)[0]
+        if not path.startswith("/assets/"):
+            self.send_error(404)
+            return
+        asset = _by_hashed_name.get(path[len("/assets/"):])
+        if asset is None:
+            self.send_error(404)
+            return
+
+        if self.headers.get("If-None-Match") == asset.etag:
+            self.send_response(304)
+            self._common_headers(asset)
+            self.end_headers()
+            return
+
+        # 文字類檔案：整份回傳壓縮版本
+        accept = self.headers.get("Accept-Encoding", "")
+        for encoding in ("br", "gzip"):
+            if encoding in asset.encoded and encoding in accept:
+                body = asset.encoded[encoding]
+                self.send_response(200)
+                self._common_headers(asset)
+                self.send_header("Content-Encoding", encoding)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+                return
+
+        start, end = 0, asset.size - 1
+        range_header = self.headers.get("Range")
+        if range_header:
+            byte_range = _parse_range(range_header, asset.size)
+            if byte_range is None:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{asset.size}")
+                self.end_headers()
+                return
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{asset.size}")
+        else:
+            self.send_response(200)
+        self._common_headers(asset)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if send_body:
+            self._copy_file(asset.path, start, end - start + 1)
+
+    def _common_headers(self, asset):
+        self.send_header("Content-Type", asset.mime)
+        self.send_header("Cache-Control", CACHE_CONTROL)
+        self.send_header("ETag", asset.etag)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Access-Control-Allow-Origin", "*")
+
+    def _copy_file(self, path, offset, length):
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                while length > 0:
+                    chunk = f.read(min(CHUNK_SIZE, length))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    length -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 使用者拖曳進度條時瀏覽器會中斷舊的 Range 請求
+
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _parse_range(header, size):
+    # 只支援單一區段，多段 Range 的情況瀏覽器播放音訊時不會用到
+    m = _RANGE_RE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else size - 1
+    else:  # bytes=-500 代表最後 500 bytes
+        start = max(size - int(m.group(2)), 0)
+        end = size - 1
+    end = min(end, size - 1)
+    if start > end:
+        return None
+    return start, end
+
+
+def start_asset_server():
+    """啟動（每個行程只啟動一次）靜態資源伺服器，回傳伺服器物件；已啟動時直接回傳。"""
+    global _server
+    _load_manifest()
+    with _lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((ASSET_HOST, ASSET_PORT), _AssetHandler)
+            except OSError as e:
+                # 埠號被占用時多半是同一台機器上的另一個 streamlit 行程，沿用它即可
+                logger.warning("靜態資源伺服器無法綁定 %s:%s（%s），假設已由其他行程提供", ASSET_HOST, ASSET_PORT, e)
+                _server = False
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="asset-server", daemon=True).start()
+            logger.info("靜態資源伺服器啟動於 %s:%s", ASSET_HOST, ASSET_PORT)
+    return _server or None
+
+
+def asset_url(name):
+    """回傳 static/ 底下公開檔案給瀏覽器使用的網址（內容雜湊版本）。"""
+    asset = _load_manifest()[name]
+    if ASSET_MODE == "static":
+        return f"{STATIC_URL}/{name}?v={asset.digest}"
+    if ASSET_MODE == "inline":
+        # data URI 每個行程只編碼一次，之後每次 rerun 直接重用同一個字串
+        with _lock:
+            if name not in _data_uris:
+                with open(asset.path, "rb") as f:
+                    encoded = base64.b64encode(f.read()).decode()
+                _data_uris[name] = f"data:{asset.mime};base64,{encoded}"
+            return _data_uris[name]
+    start_asset_server()
+    return f"{ASSET_PUBLIC_URL}/assets/{asset.hashed_name}"
+
+
+# --- 輕量版本（build_assets.py 的產出） ---
+def load_build_manifest():
+    """讀取 static/build/manifest.json；沒有建置過、內容損毀、或原始檔已更新而 manifest 過期時回傳 None。"""
+    global _build_manifest
+    if _build_manifest is None:
+        manifest = False
+        data = _read_build_manifest()
+        if data is not None:
+            assets = _load_manifest()
+            entries = [e for kind in ("background", "audio") for e in data.get(kind, ())]
+            stale = [
+                name for name, digest in data.get("sources", {}).items()
+                if name not in assets or assets[name].digest != digest
+            ] + [e.get("file", "?") for e in entries if not isinstance(e, dict) or e.get("file") not in assets]
+            if stale:
+                logger.warning("static/build 已過期或缺檔（%s），請重新執行 build_assets.py", ", ".join(map(str, stale)))
+            else:
+                manifest = data
+        _build_manifest = manifest
+    return _build_manifest or None
+
+
+@metrics.timer("asset_load_seconds", asset="background_css")
+def background_css(selector=".stApp", fallback="background.jpg"):
+    """回傳背景圖的 CSS：依視窗寬度挑選最接近的尺寸，瀏覽器支援 WebP 時優先使用。"""
+    rules = [f'{selector} {{ background-image: url("{asset_url(fallback)}"); }}']
+    manifest = load_build_manifest()
+    if not manifest or not manifest.get("background"):
+        return "\n".join(rules)
+
+    by_width = {}
+    for entry in manifest["background"]:
+        by_width.setdefault(entry["width"], {})[entry["type"]] = asset_url(entry["file"])
+    widths = sorted(by_width, reverse=True)
+
+    def image_set(urls):
+        candidates = [
+            f'url("{urls[mime]}") type("{mime}")'
+            for mime in ("image/webp", "image/jpeg") if mime in urls
+        ]
+        return f"image-set({', '.join(candidates)})"
+
+    # 不加 media query 的預設值用最大張；較窄的視窗依序覆寫成較小張
+    largest = by_width[widths[0]]
+    rules = [
+        f"{selector} {{ background-image: url(\"{largest.get('image/jpeg', asset_url(fallback))}\"); "
+        f"background-image: {image_set(largest)}; }}"
+    ]
+    for width in widths[1:]:
+        rules.append(
+            f"@media (max-width: {width}px) {{ {selector} {{ background-image: {image_set(by_width[width])}; }} }}"
+        )
+    return "\n".join(rules)
+
+
+@metrics.timer("asset_load_seconds", asset="audio_sources_html")
+def audio_sources_html(fallback="echoofsadness.mp3"):
+    """回傳 <audio> 內的 <source> 標籤，由小到大排列，瀏覽器會選第一個支援的格式。"""
+    sources = []
+    manifest = load_build_manifest()
+    if manifest:
+        for entry in manifest.get("audio", []):
+            sources.append(f"<source src=\"{asset_url(entry['file'])}\" type=\"{entry['type']}\">")
+    sources.append(f"<source src=\"{asset_url(fallback)}\" type=\"audio/mpeg\">")
+    return "\n".join(sources)
+
+
+def warm_up():
+    """預先計算所有資源的雜湊（server 模式另外壓縮並啟動伺服器，inline 模式則先編碼 data URI）。"""
+    background_css()
+    audio_sources_html()
+
+
+# 音樂等首次繪製完成、瀏覽器閒置後才開始下載與播放，不和頁面搶頻寬。
+# 以 st.iframe(AUDIO_AFTER_PAINT_HTML, height=1) 放進頁面（iframe 與頁面同源，可以操作上層的 <audio>）。
+AUDIO_AFTER_PAINT_HTML = """
+<script>
+const doc = window.parent.document;
+function startAudio() {
+  const audio = doc.querySelector(".audio-player audio");
+  if (!audio || audio.dataset.started) return;
+  audio.dataset.started = "1";
+  audio.preload = "auto";
+  audio.play().catch(() => {});  // 瀏覽器擋下自動播放時，使用者仍可自行按播放
+}
+const later = window.requestIdleCallback || ((cb) => setTimeout(cb, 300));
+if (doc.readyState === "complete") later(startAudio);
+else window.parent.addEventListener("load", () => later(startAudio));
+</script>
+"""
@@ -0,0 +1,136 @@
+# --- 結構化（JSON）回應 ---
+# 延伸問題與段落草稿原本從模型的自由文字裡一行一行撈（只留 1. / 2. 開頭的行、取前兩行…），
+# 模型換個格式寫，延伸問題就默默消失，等於白白浪費一次 70B 的請求。
+# 這裡改用 OpenAI 相容的 JSON 模式（response_format）請模型直接回傳 JSON，並以 JSON Schema 嚴格驗證：
+#   - 系統提示附上 schema，要求只輸出一個符合 schema 的 JSON 物件
+#   - 解析或驗證失敗時，最多修復一次：交給較便宜的小模型（REPAIR_MODEL、temperature 0）依錯誤訊息修正；
+#     Groq 在 JSON 模式下若模型輸出不是合法 JSON 會直接回 400（json_validate_failed），沒有原文可修，改由小模型重新回答
+#   - 修復後仍不符合就丟出 StructuredOutputError（groq_client.GroqError 的子類別，頁面照原本的錯誤處理顯示）
+# 每次請求的結果（ok / repaired / failed）記錄為 structured_output_total 指標，可計算解析失敗率。
+#
+# 環境變數：
+#   JSON_SCHEMA_MODE   1 時送出 response_format={"type": "json_schema", ...}（需要模型支援 Structured Outputs）；
+#                      預設 0，送出 {"type": "json_object"}（JSON 模式，所有 Groq 模型皆支援），schema 只放在系統提示
+#   JSON_REPAIR_MODEL  修復用的小模型，預設 llama3-8b-8192
+import json
+import logging
+import os
+
+import groq_client
+import hedging
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_MODE = os.environ.get("JSON_SCHEMA_MODE", "0") == "1"
+REPAIR_MODEL = os.environ.get("JSON_REPAIR_MODEL", "llama3-8b-8192")
+JSON_VALIDATE_FAILED = 400  # Groq：JSON 模式下模型的輸出不是合法 JSON
+
+
+class StructuredOutputError(groq_client.GroqError):
+    """模型的回應（修復後）仍不符合 schema。"""
+
+
+class SchemaError(ValueError):
+    """JSON 不符合 schema；訊息包含出錯的位置，會原樣交給修復用的模型。"""
+
+
+# --- 驗證（只支援這個專案用到的 JSON Schema 子集） ---
+_TYPES = {
+    "object": dict, "array": list, "string": str, "boolean": bool,
+    "integer": int, "number": (int, float),
+}
+
+
+def validate(value, schema, path="$"):
+    """value 不符合 schema 時丟出 SchemaError。未列在 properties 的欄位一律視為錯誤。"""
+    expected = _TYPES[schema["type"]]
+    if not isinstance(value, expected) or (isinstance(value, bool) and schema["type"] in ("integer", "number")):
+        raise SchemaError(f"{path} 應為 {schema['type']}")
+    if schema["type"] == "object":
+        properties = schema.get("properties", {})
+        for key in schema.get("required", ()):
+            if key not in value:
+                raise SchemaError(f"{path} 缺少欄位 {key}")
+        for key, item in value.items():
+            if key not in properties:
+                raise SchemaError(f"{path} 有多餘的欄位 {key}")
+            validate(item, properties[key], f"{path}.{key}")
+    elif schema["type"] == "array":
+        if len(value) < schema.get("minItems", 0):
+            raise SchemaError(f"{path} 至少要有 {schema['minItems']} 項")
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            raise SchemaError(f"{path} 最多 {schema['maxItems']} 項")
+        for i, item in enumerate(value):
+            validate(item, schema["items"], f"{path}[{i}]")
+    elif schema["type"] == "string":
+        if len(value.strip()) < schema.get("minLength", 0):
+            raise SchemaError(f"{path} 不可為空")
+        if "maxLength" in schema and len(value) > schema["maxLength"]:
+            raise SchemaError(f"{path} 超過 {schema['maxLength']} 字")
+
+
+def parse(text, schema):
+    """把模型的回應解析成符合 schema 的值；不符合時丟出 SchemaError。"""
+    try:
+        value = json.loads(text)
+    except (TypeError, ValueError) as e:
+        raise SchemaError(f"不是合法的 JSON：{e}") from e
+    validate(value, schema)
+    return value
+
+
+# --- 請求 ---
+def system_prompt(schema, system=groq_client.SYSTEM_PROMPT):
+    return (
+        f"{system}\n只輸出一個符合以下 JSON Schema 的 JSON 物件，不要加任何說明、標題或 Markdown：\n"
+        + json.dumps(schema, ensure_ascii=False)
+    )
+
+
+def response_format(schema, name):
+    if SCHEMA_MODE:
+        return {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}
+    return {"type": "json_object"}
+
+
+def repair_prompt(prompt, text, error):
+    if text is None:
+        return prompt  # 沒有原文可修：以原本的問題重新回答
+    return (
+        f"下面這段回應應該是符合 JSON Schema 的 JSON，但檢查失敗（{error}）。"
+        f"請修正格式並保留原本的內容，只輸出修正後的 JSON。\n\n原本的要求：\n{prompt}\n\n回應：\n{text}"
+    )
+
+
+def chat_json(prompt, schema, api_key, stage, name=None, local=False, on_wait=None, session=None, **kwargs):
+    """以 JSON 模式呼叫模型，回傳符合 schema 的值。
+
+    主請求經過 hedging.chat（延遲預算、對沖、local=True 時可用本機模型）；回應不符合 schema 時
+    以 REPAIR_MODEL 修復一次，仍失敗則丟出 StructuredOutputError。呼叫失敗時丟出 GroqError。
+    """
+    system = system_prompt(schema, kwargs.pop("system", groq_client.SYSTEM_PROMPT))
+    fmt = response_format(schema, name or stage)
+    text = None
+    try:
+        text = hedging.chat(prompt, api_key=api_key, stage=stage, local=local, on_wait=on_wait,
+                            system=system, response_format=fmt, session=session, **kwargs)
+        result = parse(text, schema)
+        metrics.inc("structured_output_total", stage=stage, outcome="ok")
+        return result
+    except groq_client.GroqError as e:
+        if e.status != JSON_VALIDATE_FAILED:
+            raise
+        error = e
+    except SchemaError as e:
+        error = e
+    logger.info("階段 %s 的 JSON 回應不符合格式（%s），以 %s 修復一次", stage, error, REPAIR_MODEL)
+    try:
+        repaired = groq_client.chat(repair_prompt(prompt, text, error), api_key, model=REPAIR_MODEL, temperature=0,
+                                    system=system, response_format=fmt, session=session, stage=f"{stage}_repair")
+        result = parse(repaired, schema)
+    except (groq_client.GroqError, SchemaError) as e:
+        metrics.inc("structured_output_total", stage=stage, outcome="failed")
+        raise StructuredOutputError(f"回應不符合格式：{e}") from e
+    metrics.inc("structured_output_total", stage=stage, outcome="repaired")
+    return result
@@ -0,0 +1,176 @@
+# --- 語音轉文字效能測試 ---
+# 用一組固定的本機錄音（國語、台灣口音），比較各推論後端與模型大小的速度、記憶體與辨識正確率：
+#   RTF（推論秒數 ÷ 錄音秒數）、每段延遲的 p50 / p95、峰值 RSS、WER / CER。
+#
+# 錄音放在 assets/stt_clips/（可用 --clips 指定其他目錄），並附上 references.tsv，
+# 每行「檔名<TAB>正確逐字稿」，例如：
+#   001.wav	我想把房子留給我的女兒
+# 錄音含個人聲音，不 commit 進 repo。
+#
+# 使用方式：
+#   python stt_benchmark.py
+#   python stt_benchmark.py --backends torch torch-int8 --models openai/whisper-base openai/whisper-small
+#
+# 每個 (後端, 模型) 組合都在獨立的子行程執行，峰值 RSS 才不會互相干擾；
+# 結果印成表格，並寫成 JSON（預設 stt_benchmark.json）。
+import argparse
+import json
+import os
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import unicodedata
+
+import speech_to_text
+
+CLIPS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "stt_clips")
+DEFAULT_MODELS = ("openai/whisper-tiny", "openai/whisper-base", "openai/whisper-small")
+
+
+def load_references(clips_dir):
+    """讀取 references.tsv，回傳 [(錄音路徑, 正確逐字稿)]。"""
+    clips = []
+    with open(os.path.join(clips_dir, "references.tsv"), encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            name, text = line.rstrip("\n").split("\t", 1)
+            clips.append((os.path.join(clips_dir, name), text))
+    return clips
+
+
+# --- 正確率 ---
+def normalize(text):
+    # 去掉標點與空白再比較；全形半形統一
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if not unicodedata.category(ch).startswith(("P", "Z", "S")))
+
+
+def words(text):
+    # 中文沒有空白斷詞，每個漢字算一個詞；英數字連在一起的算一個詞
+    text = unicodedata.normalize("NFKC", text).lower()
+    return re.findall(r"[a-z0-9']+|[^\sa-z0-9'\W]", text)
+
+
+def edit_distance(ref, hyp):
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i]
+        for j, h in enumerate(hyp, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h)))
+        prev = cur
+    return prev[-1]
+
+
+def error_rate(pairs, split):
+    errors = total = 0
+    for ref, hyp in pairs:
+        ref_units, hyp_units = split(ref), split(hyp)
+        errors += edit_distance(ref_units, hyp_units)
+        total += len(ref_units)
+    return errors / total if total else None
+
+
+def percentile(values, q):
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+# --- 子行程：量測單一組合 ---
+def run_worker(backend, model_name, clips_dir, repeat):
+    clips = load_references(clips_dir)
+    audio = []
+    for path, ref in clips:
+        with open(path, "rb") as f:
+            audio.append((f.read(), ref))
+
+    start = time.perf_counter()
+    speech_to_text.get_pipeline(backend, model_name)
+    load_seconds = time.perf_counter() - start
+    speech_to_text.transcribe(audio[0][0], backend, model_name)  # 預熱，不計入
+
+    latencies, audio_seconds, inference_seconds, pairs = [], 0.0, 0.0, []
+    for round_index in range(repeat):
+        for data, ref in audio:
+            text, report = speech_to_text.transcribe(data, backend, model_name)
+            latencies.append(report["latency"])
+            audio_seconds += report["audio_seconds"]
+            inference_seconds += report["inference_seconds"]
+            if round_index == 0:
+                pairs.append((ref, text))
+
+    return {
+        "backend": backend,
+        "model": model_name,
+        "clips": len(audio),
+        "load_seconds": load_seconds,
+        "rtf": inference_seconds / audio_seconds if audio_seconds else None,
+        "p50_latency": percentile(latencies, 0.5),
+        "p95_latency": percentile(latencies, 0.95),
+        # Linux 的 ru_maxrss 單位是 KB
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "wer": error_rate(pairs, words),
+        "cer": error_rate(pairs, lambda t: list(normalize(t))),
+    }
+
+
+def run_isolated(backend, model_name, clips_dir, repeat):
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "--worker",
+        "--backends", backend, "--models", model_name, "--clips", clips_dir, "--repeat", str(repeat),
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        error = (proc.stderr.strip().splitlines() or ["未知錯誤"])[-1]
+        return {"backend": backend, "model": model_name, "error": error}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def print_table(results):
+    print(f"{'後端':12s} {'模型':28s} {'RTF':>6s} {'p50(s)':>7s} {'p95(s)':>7s} {'RSS(MB)':>8s} {'WER':>6s} {'CER':>6s}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['backend']:12s} {r['model']:28s} ⚠️ {r['error']}")
+            continue
+        print(
+            f"{r['backend']:12s} {r['model']:28s} {_fmt(r['rtf'], '6.3f')} {r['p50_latency']:7.2f} "
+            f"{r['p95_latency']:7.2f} {r['peak_rss_mb']:8.0f} {_fmt(r['wer'], '6.1%')} {_fmt(r['cer'], '6.1%')}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較語音轉文字各後端與模型大小的效能")
+    parser.add_argument("--backends", nargs="+", default=list(speech_to_text.BACKENDS))
+    parser.add_argument("--models", nargs="+", default=list(DEFAULT_MODELS))
+    parser.add_argument("--clips", default=CLIPS_DIR)
+    parser.add_argument("--repeat", type=int, default=3, help="每段錄音重複辨識幾次（延遲統計用）")
+    parser.add_argument("--output", default="stt_benchmark.json")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.backends[0], args.models[0], args.clips, args.repeat)))
+        return
+
+    results = []
+    for model_name in args.models:
+        for backend in args.backends:
+            print(f"⏱ {backend} / {model_name} …", file=sys.stderr)
+            results.append(run_isolated(backend, model_name, args.clips, args.repeat))
+    print_table(results)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"✅ 結果已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
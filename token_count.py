@@ -0,0 +1,92 @@
+# --- 本機 token 計數 ---
+# 以 Llama 3 的 tokenizer 在本機計算 prompt 的 token 數，不必呼叫 API 就能知道是否塞得進 context。
+# tokenizer 在第一次使用時於背景載入（warmup.py 會在首次繪製後先載入）；
+# 載入完成前改用保守的估計值（寧可高估），所以預算檢查永遠不會因為等 tokenizer 而卡住。
+#
+# 環境變數：
+#   TOKENIZER_MODEL   tokenizer 來源，預設 baseten/Meta-Llama-3-tokenizer（與 llama3-8b / 70b 相同的詞彙表）
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER_MODEL = os.environ.get("TOKENIZER_MODEL", "baseten/Meta-Llama-3-tokenizer")
+MESSAGE_OVERHEAD = 8     # 每則訊息的角色標記等固定開銷
+ESTIMATE_SAFETY = 1.3    # 沒有 tokenizer 時的估計值放大倍數
+
+_lock = threading.Lock()
+_tokenizer = None
+_loading = False
+_failed = False
+
+
+def _load():
+    global _tokenizer, _failed
+    try:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_MODEL)
+        with _lock:
+            _tokenizer = tokenizer
+        logger.info("tokenizer 載入完成：%s", TOKENIZER_MODEL)
+    except Exception as e:  # 沒有網路或套件時一直使用估計值
+        logger.warning("tokenizer 載入失敗，改用估計值：%s", e)
+        _failed = True
+
+
+def warm_up(wait=False):
+    """載入 tokenizer（只會載入一次）；預設在背景載入並立即返回。"""
+    global _loading
+    with _lock:
+        if _tokenizer is not None or _loading or _failed:
+            return
+        _loading = True
+    if wait:
+        _load()
+    else:
+        threading.Thread(target=_load, name="tokenizer-load", daemon=True).start()
+
+
+def estimate(text):
+    # 中文大約一字一 token、英數字約三到四個字元一 token，再乘上安全係數
+    cjk = sum(1 for ch in text if ord(ch) > 0x2E80)
+    return int((cjk + (len(text) - cjk) / 3) * ESTIMATE_SAFETY) + 1
+
+
+def count_tokens(text):
+    """text 的 token 數；tokenizer 還沒載入時回傳保守的估計值。"""
+    if _tokenizer is None:
+        warm_up()
+        return estimate(text)
+    return len(_tokenizer.encode(text, add_special_tokens=False))
+
+
+def count_prompt(prompt, system=""):
+    """一次 system + user 對話請求的 prompt token 數。"""
+    return count_tokens(system) + count_tokens(prompt) + 2 * MESSAGE_OVERHEAD
+
+
+def truncate(text, max_tokens):
+    """把 text 截短到最多 max_tokens 個 token（盡量在句子或換行處截斷）。"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _tokenizer is not None:
+        ids = _tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+        cut = _tokenizer.decode(ids)
+    else:
+        # 估計值與長度成正比，二分搜尋可容納的最長前綴
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if estimate(text[:mid]) <= max_tokens:
+                lo = mid
+            else:
+                hi = mid - 1
+        cut = text[:lo]
+    boundary = max(cut.rfind(mark) for mark in ("\n", "。", "！", "？", ". "))
+    if boundary > len(cut) // 2:
+        cut = cut[:boundary + 1]
+    return cut.rstrip()
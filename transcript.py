@@ -0,0 +1,43 @@
+# --- 對話紀錄（只追加） ---
+# 原本每次 rerun 都把整段對話（包含完整的遺囑草稿）重新 st.markdown 一遍，
+# 對話越長，每次 rerun 的工作量與送到瀏覽器的資料就越多。
+# 這裡改用一個自訂元件（components/transcript/index.html）：已顯示過的訊息留在瀏覽器裡，
+# 伺服器記錄已經送出幾則，每次 rerun 只送之後的新訊息（一次最多 TRANSCRIPT_BATCH 則），
+# 不論對話多長，每次 rerun 的工作量都有上限。
+# 元件平常不回報任何東西（回報會多觸發一次 rerun）；只有在接不上時（iframe 重新載入、漏收了一次更新、
+# 還有下一批沒送）才回報目前顯示到第幾則，伺服器據此從那裡補送。
+#
+# 環境變數：
+#   TRANSCRIPT_BATCH   每次 rerun 最多送出幾則訊息，預設 20
+import os
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+BATCH_SIZE = int(os.environ.get("TRANSCRIPT_BATCH", "20"))
+ROLE_LABELS = {"user": "🧑‍💬 你：", "assistant": "🤖 AI："}
+
+_component = components.declare_component(
+    "will_transcript",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "transcript"),
+)
+
+
+def render(chat, key="transcript"):
+    """顯示對話紀錄 chat（[{"role", "content"}]，只會在尾端追加），只送出瀏覽器還沒有的訊息。"""
+    cursor = st.session_state.setdefault(f"{key}_cursor", {"mount": None, "sent": 0, "ack": None})
+    reported = st.session_state.get(key)
+    if reported and reported != cursor["ack"]:
+        # 元件接不上而回報：從瀏覽器實際顯示到的位置補送
+        cursor.update(ack=reported, mount=reported.get("mount"), sent=reported.get("count", 0))
+    start = cursor["sent"]
+    total = len(chat)
+    reset = start > total  # 對話被清空重來
+    if reset:
+        start = 0
+    entries = [
+        [ROLE_LABELS.get(entry["role"], ROLE_LABELS["assistant"]), entry["content"]]
+        for entry in chat[start:start + BATCH_SIZE]
+    ]
+    cursor["sent"] = start + len(entries)
+    _component(mount=cursor["mount"], start=start, entries=entries, total=total, reset=reset, key=key, default=None)
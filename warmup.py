@@ -0,0 +1,101 @@
+# --- 首次繪製後的背景預熱 ---
+# 冷啟動時頁面只做繪製需要的事；其他較慢的準備工作（Groq 連線、計算 prompt 長度用的 tokenizer、語音模型、
+# 語意快取模型、靜態資源的雜湊與壓縮）等頁面第一次繪製完成後才在背景進行，每個行程只做一次。
+# 延伸問題的本機備援模型不在這裡預載，第一次需要對沖時才載入（見 local_llm.py）。
+#
+# 用法：在頁面腳本的最後呼叫
+#   warmup.after_first_paint(api_key=GROQ_API_KEY, speech=True, semantic=True, assets=True)
+#
+# 環境變數：
+#   WARMUP          1（預設）啟用，0 停用（所有東西改成第一次用到時才載入）
+#   WARMUP_SPEECH   1（預設）時預先載入語音模型；記憶體吃緊的主機可設 0
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("WARMUP", "1") == "1"
+WARM_SPEECH = os.environ.get("WARMUP_SPEECH", "1") == "1"
+
+_lock = threading.Lock()
+_started = False
+_done = threading.Event()
+_status = {}  # 工作名稱 -> 耗時秒數，失敗時為錯誤訊息
+
+
+def _warm_groq(api_key):
+    import groq_client
+
+    groq_client.warm_connection(api_key)
+
+
+def _warm_tokenizer():
+    import token_count
+
+    token_count.warm_up(wait=True)
+
+
+def _warm_speech():
+    import speech_to_text
+
+    speech_to_text.warm_up()
+
+
+def _warm_semantic():
+    from semantic_cache import semantic_cache
+
+    semantic_cache.warm_up(wait=True)
+
+
+def _warm_assets():
+    import static_assets
+
+    static_assets.warm_up()
+
+
+def _run(tasks):
+    # 依序執行：連線最先（最快也最常用），模型最後（最慢、最吃 CPU）
+    for name, fn, args in tasks:
+        start = time.perf_counter()
+        try:
+            fn(*args)
+            _status[name] = time.perf_counter() - start
+            logger.info("預熱 %s 完成（%.2f 秒）", name, _status[name])
+        except Exception as e:  # 預熱失敗不影響正常使用，之後第一次用到時再載入
+            _status[name] = f"{type(e).__name__}: {e}"
+            logger.info("預熱 %s 失敗：%s", name, e)
+    _done.set()
+
+
+def after_first_paint(api_key=None, speech=False, semantic=False, assets=False):
+    """頁面第一次繪製完成後呼叫：在背景預熱指定項目並立即返回；每個行程只會執行一次。"""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    tasks = []
+    if api_key:
+        tasks.append(("groq", _warm_groq, (api_key,)))
+        tasks.append(("tokenizer", _warm_tokenizer, ()))  # 有呼叫 LLM 的頁面都會做 prompt 預算檢查
+    if assets:
+        tasks.append(("assets", _warm_assets, ()))
+    if semantic:
+        tasks.append(("semantic_cache", _warm_semantic, ()))
+    if speech and WARM_SPEECH:
+        tasks.append(("speech", _warm_speech, ()))
+    if not ENABLED or not tasks:
+        _done.set()
+        return
+    threading.Thread(target=_run, args=(tasks,), name="warmup", daemon=True).start()
+
+
+def wait(timeout=None):
+    """等待預熱完成，回傳是否已完成（效能測試用）。"""
+    return _done.wait(timeout)
+
+
+def status():
+    return dict(_status)
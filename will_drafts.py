@@ -0,0 +1,72 @@
+# --- 遺囑草稿的分段撰寫 ---
+# 每送出一題回答，就在背景用較快的小模型先寫好對應段落（對象、想說的話、心願、財產、補充問題），
+# 最後一步只需要把各段落合併潤飾，不必再從頭生成整份草稿。
+# 這裡的函式都不使用 st.*，可以直接丟給 background_jobs 在背景執行。
+# 段落以 JSON 模式取得（{"paragraph": ...}，見 structured_output.py），模型不會在段落前後多加「以下是段落：」之類的文字。
+import structured_output
+
+SECTION_MODEL = "llama3-8b-8192"  # 段落草稿用小模型，速度快；最後的合併潤飾仍用預設的 70B 模型
+
+# 依初始問題的順序對應段落
+SECTIONS = ("recipient", "message", "wishes", "property", "tone")
+SECTION_TITLES = {
+    "recipient": "受文對象",
+    "message": "想對對方說的話",
+    "wishes": "未完成的心願與故事",
+    "property": "財產、物品與資料的安排",
+    "tone": "語氣與風格",
+    "extra": "補充說明",
+}
+# 這些段落直接使用使用者原文，不需要呼叫模型
+PASSTHROUGH_SECTIONS = ("recipient", "tone")
+SECTION_SCHEMA = {
+    "type": "object",
+    "properties": {"paragraph": {"type": "string", "minLength": 1}},
+    "required": ["paragraph"],
+    "additionalProperties": False,
+}
+
+
+def section_key(index):
+    """第 index 題（從 0 開始）對應的段落；延伸問題一律歸在 extra_<index>。"""
+    return SECTIONS[index] if index < len(SECTIONS) else f"extra_{index}"
+
+
+def section_title(key):
+    return SECTION_TITLES[key.split("_", 1)[0]]
+
+
+def section_prompt(key, question, answer):
+    return (
+        f"以下是使用者在撰寫遺囑時，針對「{section_title(key)}」這個部分的問答。"
+        "請把回答改寫成遺囑中的一個段落：保留所有具體資訊（人名、物品、數字、心願），"
+        "用第一人稱、溫柔而清楚的繁體中文，不要加標題、不要加日期、不要補充使用者沒提到的內容。"
+        '段落文字放在 paragraph 欄位，例如 {"paragraph": "……"}。\n\n'
+        f"問題：{question}\n回答：{answer}"
+    )
+
+
+def draft_section(key, question, answer, api_key, session=None):
+    """寫出單一段落的草稿，回傳文字；失敗時丟出 groq_client.GroqError（回應不符合格式時為 StructuredOutputError）。"""
+    if key in PASSTHROUGH_SECTIONS:
+        return answer.strip()
+    reply = structured_output.chat_json(
+        section_prompt(key, question, answer), SECTION_SCHEMA, api_key=api_key, stage="section",
+        model=SECTION_MODEL, temperature=0.5, session=session,
+    )
+    return reply["paragraph"].strip()
+
+
+def merge_prompt(sections):
+    """sections 為 [(段落 key, 段落文字)]，依題目順序排列。"""
+    tone = dict(sections).get("tone", "溫柔")
+    parts = [
+        f"【{section_title(key)}】\n{text}"
+        for key, text in sections if key != "tone" and text.strip()
+    ]
+    body = "\n\n".join(parts)
+    return (
+        "以下是一份遺囑已經分段寫好的內容。請把它們整合、潤飾成一份完整且格式清晰的中文遺囑草稿，"
+        f"整體語氣與風格為：{tone}。請確保草稿包含所有段落中的關鍵資訊，段落之間自然銜接，"
+        f"最後請加上今日日期結尾。\n\n{body}"
+    )
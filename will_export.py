@@ -0,0 +1,274 @@
+# --- 遺囑草稿下載（PDF / Word） ---
+# 草稿完成後提供 PDF 與 DOCX 下載。檔案在專用的執行緒池裡產生，頁面腳本只拿到 Future：
+# 下載按鈕使用 st.download_button 的延遲產生（data 傳入函式，按下時才在另一條執行緒取結果），
+# 頁面本身從不等待排版。
+#
+# PDF 需要內嵌繁體中文字型，完整的 CJK 字型檔有數十 MB，每次整份嵌入又慢又大；
+# 這裡先以 fontTools 把字型縮減成草稿實際用到的字（字集相同就共用同一份縮減結果），再交給 fpdf2 排版。
+# DOCX 不內嵌字型，只指定東亞字型名稱，由開啟檔案的電腦提供字型。
+# 產生的檔案以「格式 + 草稿內容的雜湊」快取在記憶體，重複下載直接取用；清除 session 暫存時一併刪除（forget）。
+#
+# 需要 fpdf2（PDF）、python-docx（DOCX）、fonttools；沒有安裝的格式不提供下載。
+# 字型：依序使用 EXPORT_FONT_PATH、assets/fonts/ 內的字型、系統的 Noto CJK（packages.txt 的 fonts-noto-cjk）；
+# .ttc 字型集合會自動挑選名稱含 TC / TW 的繁體中文字型。
+#
+# 環境變數：
+#   EXPORT_WORKERS         產生檔案的執行緒數，預設 2
+#   EXPORT_CACHE_ENTRIES   記憶體中保留幾份產生好的檔案，預設 64
+#   EXPORT_SUBSET_ENTRIES  保留幾份縮減後的字型，預設 32
+#   EXPORT_FONT_PATH       PDF 使用的字型檔（.ttf / .otf / .ttc）
+#   EXPORT_DOCX_FONT       DOCX 的東亞字型名稱，預設「新細明體」
+#   EXPORT_TIMEOUT         按下下載後最多等待幾秒，預設 30
+import glob
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", "2"))
+CACHE_ENTRIES = int(os.environ.get("EXPORT_CACHE_ENTRIES", "64"))
+SUBSET_ENTRIES = int(os.environ.get("EXPORT_SUBSET_ENTRIES", "32"))
+DOCX_FONT = os.environ.get("EXPORT_DOCX_FONT", "新細明體")
+EXPORT_TIMEOUT = float(os.environ.get("EXPORT_TIMEOUT", "30"))
+FONT_CANDIDATES = (
+    os.environ.get("EXPORT_FONT_PATH", ""),
+    *sorted(glob.glob(os.path.join(ROOT, "assets", "fonts", "*.[to]t[fc]"))),
+    "/usr/share/fonts/opentype/noto/NotoSerifCJK-Regular.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+)
+TRADITIONAL_NAME = re.compile(r"\b(TC|TW)\b")
+TITLE = "遺囑草稿"
+
+# fpdf2 / python-docx / fontTools 載入要數百毫秒，第一次產生檔案時才 import（不拖慢冷啟動）；
+# 沒有 fontTools 就無法縮減字型，不提供 PDF
+HAS_PDF = all(importlib.util.find_spec(name) is not None for name in ("fpdf", "fontTools"))
+HAS_DOCX = importlib.util.find_spec("docx") is not None
+
+# 執行緒數很少：排版只在草稿完成時做一次，不與背景的 LLM 工作（background_jobs）搶執行緒
+_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="will-export")
+
+
+# --- 字型 ---
+def _find_font():
+    """回傳 (字型檔路徑, .ttc 中的索引)；找不到時回傳 None。"""
+    from fontTools.ttLib import TTCollection
+
+    for path in FONT_CANDIDATES:
+        if not path or not os.path.exists(path):
+            continue
+        if not path.lower().endswith(".ttc"):
+            return path, None
+        collection = TTCollection(path, lazy=True)
+        for index, font in enumerate(collection.fonts):
+            if TRADITIONAL_NAME.search(font["name"].getDebugName(1) or ""):
+                return path, index
+        return path, 0
+    return None
+
+
+class FontSubsets:
+    """依字集快取縮減後的字型檔（存在這個行程專用的暫存目錄，行程結束即刪除）。"""
+
+    def __init__(self, font, max_entries=SUBSET_ENTRIES):
+        self.path, self.index = font
+        self.max_entries = max_entries
+        self._dir = tempfile.TemporaryDirectory(prefix="will-fonts-")
+        self._entries = OrderedDict()  # 字集的雜湊 -> 檔案路徑
+        self._lock = threading.Lock()
+        self._pending = {}  # 字集的雜湊 -> 正在縮減時的 Lock，同一個字集不重複縮減
+
+    def get(self, text):
+        glyphs = "".join(sorted(set(text) - {"\n", "\r"}))
+        key = hashlib.sha256(glyphs.encode("utf-8")).hexdigest()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                metrics.observe("font_subset_seconds", 0.0, cache="hit")
+                return self._entries[key]
+            pending = self._pending.setdefault(key, threading.Lock())
+        with pending:
+            with self._lock:
+                if key in self._entries:
+                    return self._entries[key]
+            from fontTools import subset as font_subset
+            from fontTools.ttLib import TTFont
+
+            start = time.perf_counter()
+            out = os.path.join(self._dir.name, key[:32] + ".otf")
+            try:
+                font = TTFont(self.path, fontNumber=self.index if self.index is not None else -1, lazy=True)
+                options = font_subset.Options()
+                options.notdef_outline = True
+                options.drop_tables += ["FFTM"]
+                options.name_IDs = ["*"]  # 保留字型名稱與授權資訊
+                subsetter = font_subset.Subsetter(options)
+                subsetter.populate(text=glyphs)
+                subsetter.subset(font)
+                font.save(out)
+                font.close()
+            finally:
+                with self._lock:
+                    self._pending.pop(key, None)
+            metrics.observe("font_subset_seconds", time.perf_counter() - start, cache="miss")
+            with self._lock:
+                self._entries[key] = out
+                while len(self._entries) > self.max_entries:
+                    _, stale = self._entries.popitem(last=False)
+                    os.remove(stale)
+            return out
+
+
+_subsets = None
+_subsets_lock = threading.Lock()
+
+
+def font_subsets():
+    """每個行程共用的 FontSubsets；找不到字型時回傳 None。"""
+    global _subsets
+    if _subsets is None:
+        with _subsets_lock:
+            if _subsets is None:
+                font = _find_font()
+                if font is None:
+                    logger.warning("找不到繁體中文字型，不提供 PDF 下載（可設定 EXPORT_FONT_PATH）")
+                _subsets = FontSubsets(font) if font else False
+    return _subsets or None
+
+
+# --- 排版 ---
+def _paragraphs(draft):
+    """草稿的 Markdown 只保留文字：去掉標題、粗體與項目符號的標記。"""
+    lines = []
+    for line in draft.splitlines():
+        line = re.sub(r"^\s{0,3}#{1,6}\s*", "", line)
+        line = re.sub(r"^\s*[-*]\s+", "・", line)
+        lines.append(line.replace("**", "").replace("__", "").rstrip())
+    return lines
+
+
+def render_pdf(draft):
+    from fpdf import FPDF
+
+    paragraphs = _paragraphs(draft)
+    font_path = font_subsets().get(TITLE + "".join(paragraphs))
+    pdf = FPDF(format="A4")
+    pdf.set_title(TITLE)
+    pdf.set_margins(20, 20, 20)
+    pdf.add_font("WillFont", fname=font_path)
+    pdf.add_page()
+    pdf.set_font("WillFont", size=18)
+    pdf.cell(0, 14, TITLE, new_x="LMARGIN", new_y="NEXT", align="C")
+    pdf.set_font("WillFont", size=12)
+    for paragraph in paragraphs:
+        # 中文沒有空白斷詞，以字元換行
+        pdf.multi_cell(0, 8, paragraph or " ", wrapmode="CHAR", new_x="LMARGIN", new_y="NEXT")
+    return bytes(pdf.output())
+
+
+def render_docx(draft):
+    import docx
+    from docx.oxml.ns import qn
+    from docx.shared import Pt
+
+    document = docx.Document()
+    document.core_properties.title = TITLE
+    normal = document.styles["Normal"]
+    normal.font.name = DOCX_FONT
+    normal.font.size = Pt(12)
+    normal.element.get_or_add_rPr().get_or_add_rFonts().set(qn("w:eastAsia"), DOCX_FONT)
+    title = document.add_paragraph()
+    title.add_run(TITLE).bold = True
+    for paragraph in _paragraphs(draft):
+        document.add_paragraph(paragraph)
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+# 格式 -> (按鈕文字, 副檔名, MIME, 產生函式)
+FORMATS = {
+    "pdf": ("⬇️ 下載 PDF", "pdf", "application/pdf", render_pdf),
+    "docx": ("⬇️ 下載 Word", "docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", render_docx),
+}
+
+
+def available_formats():
+    formats = []
+    if HAS_PDF and font_subsets() is not None:
+        formats.append("pdf")
+    if HAS_DOCX:
+        formats.append("docx")
+    return formats
+
+
+# --- 產生與快取 ---
+_results = OrderedDict()  # 格式 + 草稿的雜湊 -> Future（bytes）
+_results_lock = threading.Lock()
+
+
+def _key(draft, fmt):
+    return hashlib.sha256(f"{fmt}\0{draft}".encode("utf-8")).hexdigest()
+
+
+def _render(fmt, draft):
+    with metrics.timer("export_seconds", format=fmt):
+        return FORMATS[fmt][3](draft)
+
+
+def submit(draft, fmt):
+    """開始（或取回已開始的）產生 fmt 格式的檔案，回傳 Future；不會等待。"""
+    key = _key(draft, fmt)
+    with _results_lock:
+        future = _results.get(key)
+        if future is not None and not (future.done() and future.exception() is not None):
+            _results.move_to_end(key)
+            return future
+        future = _results[key] = _executor.submit(_render, fmt, draft)
+        while len(_results) > CACHE_ENTRIES:
+            _results.popitem(last=False)
+    return future
+
+
+def forget(draft):
+    """刪除這份草稿已產生的所有檔案。"""
+    with _results_lock:
+        for fmt in FORMATS:
+            _results.pop(_key(draft, fmt), None)
+
+
+def _download(draft, fmt):
+    # 按下按鈕時由 Streamlit 在另一條執行緒呼叫；通常檔案早已產生好
+    future = submit(draft, fmt)
+    if future.done():
+        metrics.inc("export_cache_hits_total", format=fmt)
+    return future.result(timeout=EXPORT_TIMEOUT)
+
+
+def download_buttons(draft):
+    """顯示草稿的下載按鈕，並立即在背景開始產生各格式的檔案。"""
+    formats = available_formats()
+    if not formats:
+        return
+    columns = st.columns(len(formats))
+    for column, fmt in zip(columns, formats):
+        submit(draft, fmt)
+        label, extension, mime, _ = FORMATS[fmt]
+        with column:
+            st.download_button(
+                label, data=lambda fmt=fmt: _download(draft, fmt), file_name=f"{TITLE}.{extension}",
+                mime=mime, on_click="ignore", key=f"download_{fmt}",
+            )